@@ -38,12 +38,29 @@ IMPORTANT NOTES:
       machines.  This is a second reason why you should run this test module
       there.
 """
+import asyncio
+import io
 import os
+import subprocess
+import sys
+import tarfile
+import zipfile
 
 from hypothesis import given
 from hypothesis.strategies import integers
 
-from tm_trees import TMTree, FileSystemTree
+from tm_trees import TMTree, FileSystemTree, ScanOptions, extension_colour
+from tm_journal import EditJournal
+from tm_paging import SubtreePager
+from tm_archive import OVERHEAD, ArchiveTree, open_archive_leaf
+from tm_bulk import UNLISTED, build_records, read_csv, read_du
+from tm_export import TileGrid, export_png, export_tiles
+from tm_diff import ADDED, REMOVED, RESIZED, diff_trees
+from tm_scan import AsyncScan, EstimatedScan, scan_parallel, size_bounds
+from tm_search import NameIndex
+from tm_shared import share_tree
+from tm_profile import Profiler
+from tm_report import iter_report, write_report, render, main as report_main
 
 # This should be the path to the "workshop" folder in the sample data.
 # You may need to modify this, depending on where you downloaded and
@@ -174,10 +191,863 @@ def test_extra_test() -> None:
     assert 1 == 1
 
 
+# TEST 7 -----------------------------------------------------------------------
+def test_duplicate_keeps_edited_size(tmp_path) -> None:
+    """Test that duplicate clones the node in memory, so the copy keeps a size
+    that was changed in the visualiser, and the parent sizes stay correct.
+    """
+    _make_directory(tmp_path, {'a.txt': 10, 'b.txt': 20})
+    tree = FileSystemTree(str(tmp_path))
+    leaf = _find(tree, 'a.txt')
+    leaf.change_size(0.5)
+    assert leaf.data_size == 15
+    assert tree.data_size == 35
+
+    copy = leaf.duplicate()
+    assert copy is not leaf
+    assert copy.data_size == 15
+    assert copy._parent_tree is tree
+    assert tree.data_size == 50
+    assert tree.update_data_sizes() == 50
+
+
+# TEST 8 -----------------------------------------------------------------------
+def test_clone_folder_copy_on_write(tmp_path) -> None:
+    """Test that a cloned folder shares structure with its source until
+    either of them is edited.
+    """
+    _make_directory(tmp_path, {'sub': {'a.txt': 10, 'inner': {'b.txt': 20}}})
+    tree = FileSystemTree(str(tmp_path))
+    folder = _find(tree, 'sub')
+    clone = folder._clone()
+    assert clone._subtree_source is folder
+    assert clone.data_size == 30
+
+    # editing the source must not leak into the clone
+    _find(folder, 'b.txt').change_size(1.0)
+    assert folder.data_size == 50
+    assert clone.data_size == 30
+    assert _find(clone, 'b.txt').data_size == 20
+
+    # and editing the clone must not leak into the source
+    clone_leaf = _find(clone, 'a.txt')
+    clone_leaf.delete_self()
+    assert clone.data_size == 20
+    assert _find(folder, 'a.txt') is not None
+    assert folder.data_size == 50
+
+
+# TEST 9 -----------------------------------------------------------------------
+def test_journal_undo_redo(tmp_path) -> None:
+    """Test that every edit can be undone and redone, restoring the sizes and
+    the order of the subtrees.
+    """
+    _make_directory(tmp_path, {'a.txt': 10, 'sub': {'b.txt': 20, 'c.txt': 5}})
+    tree = FileSystemTree(str(tmp_path))
+    _sort_subtrees(tree)
+    journal = EditJournal(tree, capacity=100)
+    a, sub = tree._subtrees
+    b = _find(tree, 'b.txt')
+
+    a.change_size(1.0)
+    b.move(tree)
+    b.duplicate()
+    _find(tree, 'c.txt').delete_self()
+    assert tree.data_size == 60
+    assert [t._name for t in tree._subtrees] == ['a.txt', 'b.txt', 'b.txt']
+
+    while journal.undo():
+        pass
+    assert tree.data_size == 35
+    assert a.data_size == 10
+    assert [t._name for t in tree._subtrees] == ['a.txt', 'sub']
+    assert [t._name for t in sub._subtrees] == ['b.txt', 'c.txt']
+
+    while journal.redo():
+        pass
+    assert tree.data_size == 60
+    assert tree.update_data_sizes() == 60
+
+
+# TEST 10 ----------------------------------------------------------------------
+def test_largest_files_and_folders(tmp_path) -> None:
+    """Test that the largest files and folders are found, and stay correct
+    after the tree is edited.
+    """
+    _make_directory(tmp_path, {'a.txt': 10, 'big': {'b.txt': 40, 'c.txt': 5},
+                               'small': {'d.txt': 30}})
+    tree = FileSystemTree(str(tmp_path))
+    assert [t._name for t in tree.largest_files(3)] == ['b.txt', 'd.txt',
+                                                        'a.txt']
+    assert [t._name for t in tree.largest_folders(5)] == ['big', 'small']
+
+    _find(tree, 'b.txt').delete_self()
+    assert [t._name for t in tree.largest_files(2)] == ['d.txt', 'a.txt']
+    assert [t._name for t in tree.largest_folders(1)] == ['small']
+
+    _find(tree, 'c.txt').change_size(20.0)
+    assert tree.largest_files(1)[0]._name == 'c.txt'
+
+
+# TEST 11 ----------------------------------------------------------------------
+def test_name_index(tmp_path) -> None:
+    """Test name, substring, extension and glob queries, and that the index
+    follows edits to the tree.
+    """
+    _make_directory(tmp_path, {'app.log': 10, 'logs': {'old.LOG': 40,
+                                                       'notes.txt': 5}})
+    tree = FileSystemTree(str(tmp_path))
+    index = NameIndex(tree)
+
+    assert [(t._name, size) for t, size in index.find_extension('log')] == \
+        [('old.LOG', 40), ('app.log', 10)]
+    assert [t._name for t, _ in index.find_glob('*.log')] == ['old.LOG',
+                                                             'app.log']
+    assert [t._name for t, _ in index.find_substring('log')] == \
+        ['logs', 'old.LOG', 'app.log']
+    assert [t._name for t, _ in index.find_glob('n?tes.*')] == ['notes.txt']
+    logs = _find(tree, 'logs')
+    assert [t._name for t, _ in index.find_glob('*', under=logs)] == \
+        ['logs', 'old.LOG', 'notes.txt']
+
+    _find(tree, 'app.log').duplicate()
+    assert len(index.find_name('APP.LOG')) == 2
+    _find(tree, 'old.LOG').delete_self()
+    assert [t._name for t, _ in index.find_extension('.log')] == ['app.log',
+                                                                 'app.log']
+
+    # the nodes of a paged out subtree are dropped, and indexed again when
+    # it is read back in
+    pager = SubtreePager(tree, budget=1)
+    tree.expand()
+    assert pager.enforce() == 1
+    assert index.find_name('notes.txt') == []
+    assert len(index.find_name('logs')) == 1
+    assert logs._subtrees[0]._name == 'notes.txt'
+    assert [t._parent_tree for t, _ in index.find_name('notes.txt')] == [logs]
+
+
+# TEST 12 ----------------------------------------------------------------------
+def test_extension_sizes(tmp_path) -> None:
+    """Test that the sizes by extension are kept for every folder and follow
+    edits to the tree, which treat empty folders as folders.
+    """
+    _make_directory(tmp_path, {'a.log': 10, 'b.jar': 4, 'empty': {},
+                               'sub': {'c.LOG': 40, 'd.parquet': 5}})
+    tree = FileSystemTree(str(tmp_path))
+    assert tree.get_extension_sizes() == {'.log': 50, '.jar': 4,
+                                          '.parquet': 5}
+    sub = _find(tree, 'sub')
+    assert sub.get_extension_sizes() == {'.log': 40, '.parquet': 5}
+    assert tree.get_extension_class_sizes() == {'log': 50, 'code': 4,
+                                                'data': 5}
+
+    _find(tree, 'a.log').move(sub)
+    _find(tree, 'b.jar').change_size(1.0)
+    _find(tree, 'd.parquet').delete_self()
+    assert sub.get_extension_sizes() == {'.log': 50}
+    assert tree.get_extension_sizes() == {'.log': 50, '.jar': 8}
+
+    empty = _find(tree, 'empty')
+    empty.change_size(1.0)
+    assert empty.duplicate() is None
+    _find(tree, 'b.jar').copy_paste(empty)
+    assert [t._name for t in empty._subtrees] == ['b.jar']
+    assert tree.get_extension_sizes() == {'.log': 50, '.jar': 16}
+    assert empty.get_extension_sizes() == {'.jar': 8}
+
+
+# TEST 13 ----------------------------------------------------------------------
+def test_scan_hard_links_and_symlinks(tmp_path) -> None:
+    """Test that hard-linked files are counted once, and that following
+    symbolic links does not loop forever.
+    """
+    _make_directory(tmp_path, {'a.bin': 100, 'sub': {}})
+    os.link(os.path.join(str(tmp_path), 'a.bin'),
+            os.path.join(str(tmp_path), 'sub', 'b.bin'))
+    os.symlink(str(tmp_path), os.path.join(str(tmp_path), 'sub', 'loop'))
+
+    tree = FileSystemTree(str(tmp_path))
+    assert tree.data_size == 100 + os.lstat(
+        os.path.join(str(tmp_path), 'sub', 'loop')).st_size
+    assert _find(tree, 'loop')._subtrees == []
+
+    tree = FileSystemTree(str(tmp_path), ScanOptions(symlinks='skip',
+                                                     dedupe_hard_links=False))
+    assert tree.data_size == 200
+    assert _find(tree, 'loop') is None
+
+    tree = FileSystemTree(str(tmp_path), ScanOptions(symlinks='follow'))
+    assert tree.data_size == 100
+    loop = _find(tree, 'loop')
+    assert loop._subtrees == []
+    assert (loop._file_count, loop._folder_count) == (0, 1)
+    assert 'folder' in loop.get_suffix()
+    assert (tree._file_count, tree._folder_count) == (2, 3)
+
+
+# TEST 14 ----------------------------------------------------------------------
+def test_headless_report_and_render(tmp_path) -> None:
+    """Test the size report and the rendered treemap of the headless tool.
+    """
+    _make_directory(tmp_path, {'data': {'a.csv': 30, 'deep': {'b.log': 10}},
+                               'c.py': 20})
+    tree = FileSystemTree(str(tmp_path / 'data'))
+    rows = list(iter_report(tree, max_depth=1))
+    assert [(row['type'], row['depth'], row['size'], row['items'])
+            for row in sorted(rows, key=lambda row: row['path'])] == \
+        [('folder', 0, 40, 2), ('file', 1, 30, 0), ('folder', 1, 10, 1)]
+
+    out = io.StringIO()
+    assert write_report(tree, out, 'csv') == 4
+    assert out.getvalue().splitlines()[0] == 'path,type,depth,size,items'
+
+    svg = str(tmp_path / 'map.svg')
+    assert report_main([str(tmp_path), '--no-report', '--render', svg,
+                        '--size', '100x50']) == 0
+    with open(svg) as f:
+        assert f.read().count('<rect ') == 4  # background and three files
+
+
+# TEST 15 ----------------------------------------------------------------------
+def test_profiler_counts_and_removes_instrumentation(tmp_path) -> None:
+    """Test that the profiler counts visited nodes and produced rectangles,
+    also when rendering at a level of detail, and that disabling it restores
+    the original methods.
+    """
+    _make_directory(tmp_path, {'a.txt': 10, 'sub': {'b.txt': 20}})
+    tree = FileSystemTree(str(tmp_path))
+    original = TMTree.update_rectangles
+    profiler = Profiler()
+    profiler.enable()
+    try:
+        tree.update_rectangles((0, 0, 100, 100))
+        tree.expand()
+        rects = tree.get_rectangles()
+    finally:
+        profiler.disable()
+    assert TMTree.update_rectangles is original
+    assert profiler.counters['update_rectangles.nodes'] >= 4
+    assert profiler.counters['rects_produced'] == len(rects)
+    assert profiler.timings['get_rectangles'].count == 1
+
+    profiler.reset()
+    profiler.enable()
+    try:
+        rects = tree.get_lod_rectangles((0, 0, 100, 100), 6)
+        tree.get_lod_tree_at_position((1, 1), 6)
+    finally:
+        profiler.disable()
+    assert profiler.counters['rects_produced'] == len(rects)
+    assert profiler.timings['get_lod_rectangles'].count == 1
+    assert profiler.timings['get_lod_tree_at_position'].count == 1
+
+
+# TEST 16 ----------------------------------------------------------------------
+def test_scan_limits_summarise_items(tmp_path) -> None:
+    """Test that the items beyond the depth and size limits are summed into
+    one summary leaf per folder, keeping the folder sizes exact.
+    """
+    _make_directory(tmp_path, {'big.bin': 100, 'tiny1': 1, 'tiny2': 2,
+                               'sub': {'deep': {'x': 7}, 'y': 3}})
+    tree = FileSystemTree(str(tmp_path), ScanOptions(max_depth=1,
+                                                     min_size=10))
+    assert tree.data_size == 113
+    names = sorted(t._name for t in tree._subtrees)
+    assert names == ['(2 smaller items)', 'big.bin', 'sub']
+    assert _find(tree, '(2 smaller items)').data_size == 3
+    assert _find(tree, '(2 smaller items)').is_summary()
+
+    sub = _find(tree, 'sub')
+    assert sub.data_size == 10
+    assert [t._name for t in sub._subtrees] == ['(3 deeper items)']
+    assert not sub.is_summary()
+
+
+# TEST 17 ----------------------------------------------------------------------
+def test_scan_parallel_matches_serial_scan(tmp_path) -> None:
+    """Test that scanning with worker processes builds the same tree, and
+    that a file hard-linked from two top-level folders is counted once.
+    """
+    _make_directory(tmp_path, {'a': {'x.txt': 10, 'deep': {'y.txt': 20}},
+                               'b': {'z.txt': 30}, 'c.txt': 5, 'empty': {}})
+    os.link(os.path.join(str(tmp_path), 'a', 'x.txt'),
+            os.path.join(str(tmp_path), 'b', 'x_link.txt'))
+    serial = FileSystemTree(str(tmp_path))
+    parallel = scan_parallel(str(tmp_path), workers=2)
+
+    assert list(iter_report(parallel)) == list(iter_report(serial))
+    assert parallel.data_size == 65
+    assert _mtimes(parallel) == _mtimes(serial)
+    assert _find(parallel, 'empty')._folder_count == 1
+    for subtree in parallel._subtrees:
+        assert subtree._parent_tree is parallel
+    assert _find(parallel, 'y.txt')._parent_tree._parent_tree._name == 'a'
+
+
+# TEST 18 ----------------------------------------------------------------------
+def test_async_scan_partial_tree_and_cancel(tmp_path) -> None:
+    """Test that an asyncio scan builds the same tree as a serial scan, with
+    the same modification times, that its partial tree has consistent sizes
+    while it runs, and that leaving the loop early stops it, even while a
+    folder is being measured.
+    """
+    _make_directory(tmp_path, {'a': {'x.txt': 10, 'deep': {'y.txt': 20}},
+                               'b': {'z.txt': 30}, 'c.txt': 5, 'empty': {}})
+    serial = FileSystemTree(str(tmp_path))
+
+    async def scan_all():
+        scan = AsyncScan(str(tmp_path), concurrency=2, max_pending=1)
+        folders = []
+        async for folder in scan:
+            folders.append(folder._name)
+            assert scan.tree.data_size == sum(
+                t.data_size for t in scan.tree._subtrees)
+        return scan, folders
+
+    scan, folders = asyncio.run(scan_all())
+    assert scan.done
+    assert sorted(folders) == sorted([tmp_path.name, 'a', 'b', 'deep',
+                                      'empty'])
+    key = lambda row: row['path']
+    assert sorted(iter_report(scan.tree), key=key) == \
+        sorted(iter_report(serial), key=key)
+    assert _mtimes(scan.tree) == _mtimes(serial)
+
+    async def scan_one():
+        scan = AsyncScan(str(tmp_path), concurrency=1)
+        folders = scan.__aiter__()
+        await folders.__anext__()
+        await folders.aclose()
+        return scan
+
+    scan = asyncio.run(scan_one())
+    assert not scan.done
+    assert scan.tree.data_size == sum(t.data_size for t in scan.tree._subtrees)
+    assert scan._measure(str(tmp_path)) == (0, 0)  # stopped
+
+    # a file hard-linked from a measured folder and a listed one counts once
+    os.link(os.path.join(str(tmp_path), 'a', 'deep', 'y.txt'),
+            os.path.join(str(tmp_path), 'b', 'y_link.txt'))
+    options = ScanOptions(max_depth=2)
+    scan = AsyncScan(str(tmp_path), options, concurrency=4)
+    assert asyncio.run(scan.wait()).data_size == 65
+    assert FileSystemTree(str(tmp_path), options).data_size == 65
+
+
+# TEST 19 ----------------------------------------------------------------------
+def test_diff_trees(tmp_path) -> None:
+    """Test that diffing two scans reports what was added, removed and
+    resized, skipping unchanged subtrees, that a snapshot clone is skipped
+    without being walked, and that a diff following edits gives the growth
+    of diffing again.
+    """
+    _make_directory(tmp_path, {'a': {'b': {'x': 10}}, 'c': {'y': 5}, 'z': 3})
+    old = FileSystemTree(str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'a', 'b', 'x'), 'ab') as f:
+        f.write(b'x' * 4)
+    _make_directory(os.path.join(str(tmp_path), 'a'), {'new': 7})
+    os.remove(os.path.join(str(tmp_path), 'z'))
+    new = FileSystemTree(str(tmp_path))
+
+    for diff in (diff_trees(old, new),
+                 diff_trees(old, new, use_mtime=False, use_hashes=True)):
+        sep = os.sep
+        assert sorted(diff.changes) == sorted([
+            (RESIZED, '', 18, 26), (RESIZED, 'a', 10, 21),
+            (RESIZED, 'a' + sep + 'b', 10, 14),
+            (RESIZED, 'a' + sep + 'b' + sep + 'x', 10, 14),
+            (ADDED, 'a' + sep + 'new', 0, 7), (REMOVED, 'z', 3, 0)])
+        assert diff.skipped == 1  # the folder c
+        assert diff.growth(_find(new, 'a')) == 11
+        assert diff.growth(_find(new, 'new')) == 7
+        assert diff.growth(_find(new, 'c')) == 0
+    assert diff_trees(old, new).largest_changes(1) == [(RESIZED, 'a', 10, 21)]
+
+    snapshot = new._clone()
+    _find(new, 'y').duplicate()
+    diff = diff_trees(snapshot, new, use_mtime=False)
+    assert diff.get_changes(ADDED) == [(ADDED, 'c' + os.sep + 'y', 0, 5)]
+    assert diff.skipped == 1  # the folder a
+
+    # hashing compares the unchanged clones by their sources, without
+    # materialising them
+    snapshot = new._clone()
+    _find(new, 'new').move(_find(new, 'c'))
+    diff = diff_trees(snapshot, new, use_mtime=False, use_hashes=True)
+    assert sorted(diff.get_changes(RESIZED)) == [(RESIZED, 'a', 21, 14),
+                                                 (RESIZED, 'c', 10, 17)]
+    a = next(t for t in snapshot._subtree_list if t._name == 'a')
+    assert next(t for t in a._subtree_list if t._name == 'b') \
+        ._subtree_list is None
+
+    journal = EditJournal(new)
+    diff = diff_trees(old, new, use_mtime=False, use_hashes=True,
+                      follow_edits=True)
+    edits = [lambda: _find(new, 'x').change_size(0.5),
+             lambda: _find(new, 'x').delete_self(), journal.undo,
+             lambda: _find(new, 'x').move(_find(new, 'c')), journal.undo,
+             lambda: _find(new, 'c').duplicate(), journal.undo, journal.redo,
+             lambda: _find(new, 'b').delete_self()]
+    for edit in edits:
+        edit()
+        again = diff_trees(old, new, use_mtime=False, use_hashes=True)
+        assert _growths(diff, new) == _growths(again, new)
+    diff.close()
+    assert diff not in new._get_observers()
+
+
+# TEST 20 ----------------------------------------------------------------------
+def test_level_of_detail_rectangles(tmp_path) -> None:
+    """Test that level-of-detail rendering expands only the folders that
+    are at least the threshold in size, tiles the whole area, and that its
+    hit-testing returns the trees it drew.
+    """
+    _make_directory(tmp_path, {'big': {'a': 600, 'b': 340},
+                               'small': {f'f{i}': 1 for i in range(60)}})
+    tree = FileSystemTree(str(tmp_path))
+    rects = tree.get_lod_rectangles((0, 0, 100, 10), 7)
+    assert sum(w * h for (x, y, w, h), _ in rects) == 1000
+    small = _find(tree, 'small')
+    assert small.rect[2] == 6
+    assert len(rects) == 3  # a, b and small as a single block
+    assert (small.rect, small._colour) in rects
+    centre = (small.rect[0] + 3, 5)
+    assert tree.get_lod_tree_at_position(centre, 7) is small
+    big = _find(tree, 'big')
+    assert tree.get_lod_tree_at_position((big.rect[0] + 1, 1), 7)._name \
+        in ('a', 'b')
+    assert tree.get_lod_tree_at_position((200, 5), 7) is None
+
+    # with a smaller threshold, small is expanded, but its files are too
+    # small to have any area apart from the last, which fills the rest
+    rects = tree.get_lod_rectangles((0, 0, 100, 10), 2)
+    assert sum(w * h for (x, y, w, h), _ in rects) == 1000
+    assert (small.rect, small._colour) not in rects
+    assert len(rects) == 3
+    assert tree.get_lod_tree_at_position(centre, 2)._name.startswith('f')
+    assert not tree._expanded
+
+
+# TEST 21 ----------------------------------------------------------------------
+def test_expand_and_collapse_keep_invariants(tmp_path) -> None:
+    """Test that expanding expands every ancestor, that collapsing from a
+    leaf collapses its parent and everything in it, and that moving an
+    expanded folder into a collapsed one collapses it.
+    """
+    _make_directory(tmp_path, {'a': {'b': {'c': {'x': 1}}, 'y': 2},
+                               'd': {'e': {'z': 3}}})
+    tree = FileSystemTree(str(tmp_path))
+    tree.update_rectangles((0, 0, 100, 100))
+    rect = _find(tree, 'x').rect
+    _find(tree, 'c').expand()
+    assert [t._expanded for t in (tree, _find(tree, 'a'), _find(tree, 'b'),
+                                  _find(tree, 'c'))] == [True] * 4
+    assert not _find(tree, 'd')._expanded
+    assert _find(tree, 'x').rect == rect
+
+    _find(tree, 'x').collapse()
+    assert not _find(tree, 'c')._expanded
+    assert _find(tree, 'b')._expanded
+    _find(tree, 'b').collapse()  # collapses a, b and c
+    assert not _find(tree, 'a')._expanded and tree._expanded
+
+    tree.expand_all()
+    assert all(t._expanded for t in (tree, _find(tree, 'b'), _find(tree, 'e')))
+    _find(tree, 'z').collapse_all()
+    assert not any(t._expanded for t in (tree, _find(tree, 'a'),
+                                         _find(tree, 'c'), _find(tree, 'e')))
+
+    _find(tree, 'c').expand()
+    b = _find(tree, 'b')
+    b._detach()
+    b._attach(_find(tree, 'e'))
+    assert not b._expanded and not _find(tree, 'c')._expanded
+    tree.collapse_all()
+    assert not tree._expanded and not _find(tree, 'a')._expanded
+
+
+# TEST 22 ----------------------------------------------------------------------
+def test_subtree_statistics(tmp_path) -> None:
+    """Test that the file and folder counts and heights are computed by the
+    scan and kept up to date by edits.
+    """
+    _make_directory(tmp_path, {'a': {'b': {'x': 1, 'y': 2}, 'z': 3},
+                               'empty': {}, 'w': 4})
+    tree = FileSystemTree(str(tmp_path))
+    assert (tree._file_count, tree._folder_count, tree._height) == (4, 4, 3)
+    assert tree.max_depth() == 3
+    assert _find(tree, 'empty')._file_count == 0
+    assert '4 files, 3 subfolders, 3 levels' in tree.get_suffix()
+
+    limited = FileSystemTree(str(tmp_path), ScanOptions(max_depth=1))
+    # the summary of a counts b, x, y and z
+    assert (limited._file_count, limited._folder_count) == (5, 3)
+    assert limited.max_depth() == 2
+
+    _find(tree, 'x').move(_find(tree, 'a'))
+    assert (_find(tree, 'a')._file_count, _find(tree, 'b')._file_count,
+            tree._file_count) == (3, 1, 4)
+    _find(tree, 'y').delete_self()  # deletes b too, which is now empty
+    assert (tree._file_count, tree._folder_count, tree._height) == (3, 3, 2)
+    _find(tree, 'x').duplicate()
+    assert (_find(tree, 'a')._file_count, tree._file_count) == (3, 4)
+
+
+# TEST 23 ----------------------------------------------------------------------
+def test_colours_are_lazy_and_deterministic(tmp_path) -> None:
+    """Test that a leaf's colour is only picked when it is first read, and
+    that it is the same in every scan of the same path.
+    """
+    _make_directory(tmp_path, {'a.txt': 10, 'b.txt': 10, 'sub': {'a.txt': 5}})
+    first = FileSystemTree(str(tmp_path))
+    leaf = _find(first, 'b.txt')
+    assert '_colour_value' not in leaf.__dict__
+    assert is_valid_colour(leaf._colour)
+    assert '_colour_value' in leaf.__dict__
+
+    second = FileSystemTree(str(tmp_path))
+    for name in ('a.txt', 'b.txt', 'sub'):
+        assert _find(first, name)._colour == _find(second, name)._colour
+    second.update_colours_and_depths()
+    assert second._colour == (0, 0, 0)
+
+
+# TEST 24 ----------------------------------------------------------------------
+def test_build_from_records() -> None:
+    """Test that trees built from du output and CSV records have the right
+    structure, sizes and parent links, and that folder records larger than
+    their listed contents get an unlisted leaf.
+    """
+    du = io.StringIO('10\t./a/x.txt\n20\t./a/b/y.py\n35\t./a/b\n'
+                     '50\t./a\n50\t.\n')
+    tree = build_records(read_du(du), name='root')
+    assert tree.data_size == 50
+    b = _find(tree, 'b')
+    assert b.data_size == 35 and b._parent_tree._name == 'a'
+    assert sorted(t._name for t in b._subtrees) == [UNLISTED, 'y.py']
+    assert _find(tree, 'a').data_size == 50
+    assert b.get_full_path() == 'root/a/b'
+    assert (tree._file_count, tree._folder_count) == (4, 3)  # 2 unlisted
+
+    inventory = io.StringIO('bucket,key,size\nb,k\\one.txt,5\n'
+                            'b,k\\two\\,\nb,k\\two\\three.bin,7\n')
+    tree = build_records(read_csv(inventory, 'key', 'size'), 'b', '\\')
+    assert tree.data_size == 12
+    assert _find(tree, 'three.bin').get_path_string() == 'b\\k\\two\\three.bin'
+    assert list(iter_report(tree))[1] == {'path': 'b\\k', 'type': 'folder',
+                                          'depth': 1, 'size': 12, 'items': 2}
+
+    tree = build_records([('photos/', 0), ('docs/a.txt', 3)])
+    photos = _find(tree, 'photos')
+    assert (photos._file_count, photos._folder_count) == (0, 1)
+    assert (tree._file_count, tree._folder_count) == (1, 3)
+
+
+# TEST 25 ----------------------------------------------------------------------
+def test_open_archive_leaves(tmp_path) -> None:
+    """Test that zip and tar leaves are replaced by trees of their members
+    that keep the size of the leaf, and that the replacement can be undone.
+    """
+    with zipfile.ZipFile(os.path.join(str(tmp_path), 'a.zip'), 'w') as z:
+        z.writestr('src/x.py', 'x' * 30)
+        z.writestr('src/', '')
+        z.writestr('README', 'r' * 20)
+    _make_directory(tmp_path, {'data': {'y': 40}})
+    with tarfile.open(os.path.join(str(tmp_path), 'b.tar'), 'w') as t:
+        t.add(os.path.join(str(tmp_path), 'data'), 'data')
+    with tarfile.open(os.path.join(str(tmp_path), 'c.tar.gz'), 'w:gz') as t:
+        info = tarfile.TarInfo('zeros')
+        info.size = 100000
+        t.addfile(info, io.BytesIO(bytes(info.size)))
+    tree = FileSystemTree(str(tmp_path))
+    journal = EditJournal(tree)
+    before = tree.data_size
+
+    size = _find(tree, 'a.zip').data_size
+    archive = open_archive_leaf(_find(tree, 'a.zip'))
+    assert isinstance(archive, ArchiveTree) and archive._parent_tree is tree
+    assert archive.data_size == size
+    assert _find(archive, 'x.py').data_size == 30  # stored uncompressed
+    assert _find(archive, OVERHEAD).data_size == size - 50
+    assert _find(archive, 'x.py')._parent_tree._name == 'src'
+    assert _find(archive, 'x.py').get_full_path() == \
+        os.path.join(str(tmp_path), 'a.zip', 'src', 'x.py')
+    archive = open_archive_leaf(_find(tree, 'b.tar'))
+    assert [t._name for t in archive._subtrees] == ['data', OVERHEAD]
+    assert _find(archive, 'y').data_size == 40
+    assert open_archive_leaf(_find(archive, 'y')) is None
+    size = _find(tree, 'c.tar.gz').data_size
+    archive = open_archive_leaf(_find(tree, 'c.tar.gz'))
+    assert archive.data_size == size < 100000
+    assert _find(archive, 'zeros').data_size <= size  # scaled down
+    assert tree.data_size == before
+    assert tree.data_size == sum(t.data_size for t in tree._subtrees)
+
+    journal.undo()
+    journal.undo()
+    journal.undo()
+    assert tree.data_size == before
+    assert not _find(tree, 'a.zip')._subtrees
+
+
+# TEST 26 ----------------------------------------------------------------------
+def test_estimated_scan_is_refined(tmp_path, monkeypatch) -> None:
+    """Test that an estimated scan samples large folders, lists each folder
+    only once, gives bounds around its estimates, and that refining it gives
+    the sizes and layout of an exact scan, even if an estimate was deleted.
+    """
+    _make_directory(tmp_path, {
+        'big': {f'f{i}': 10 + 20 * (i % 5) for i in range(60)},
+        'small': {'a': 5, 'b': 7}, 'other': {f'g{i}': 40 for i in range(30)}})
+    exact = FileSystemTree(str(tmp_path))
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir',
+                        lambda path: listed.append(path) or scandir(path))
+    scan = EstimatedScan(str(tmp_path), sample=10, seed=1)
+    monkeypatch.undo()
+    assert len(listed) == len(set(listed)) == 4
+    tree = scan.tree
+    assert not scan.done
+    assert len(_find(tree, 'big')._subtrees) == 1
+    assert _find(tree, 'big')._subtrees[0].is_summary()
+    assert _find(tree, 'other').data_size == 1200  # all the samples agree
+    assert _find(tree, 'small').data_size == 12
+    low, high = size_bounds(tree)
+    assert low < tree.data_size < high and tree._size_variance > 0
+    assert 'estimated' in tree.get_suffix()
+
+    tree.update_rectangles((0, 0, 300, 200))
+    relaid = scan.wait(threshold=0)
+    assert scan.done and relaid == [tree]
+    assert tree.data_size == exact.data_size == 4212
+    assert size_bounds(tree) == (4212, 4212)
+    assert len(_find(tree, 'big')._subtrees) == 60
+    rects = [(t._name, t.rect) for t in tree._subtrees]
+    tree.update_rectangles((0, 0, 300, 200))
+    assert rects == [(t._name, t.rect) for t in tree._subtrees]
+
+    # an estimate deleted before it is refined leaves no uncertainty behind
+    scan = EstimatedScan(str(tmp_path), sample=10, seed=1)
+    assert _find(scan.tree, 'big')._subtrees[0].delete_self()
+    scan.wait(threshold=0)
+    assert scan.tree._size_variance == 0
+    assert 'estimated' not in scan.tree.get_suffix()
+
+
+# TEST 27 ----------------------------------------------------------------------
+def test_subtrees_are_paged_out_and_in(tmp_path) -> None:
+    """Test that a pager pages out collapsed subtrees to stay within its
+    budget, that they are read back in unchanged when they are needed, that
+    paging an unedited subtree out again does not grow the spill file, that
+    edited subtrees are never paged out, and that deleting a paged out
+    subtree keeps the count of nodes in memory.
+    """
+    _make_directory(tmp_path, {'a': {'x': 10, 'y': {'z': 20, 'w': 5}},
+                               'b': {f'f{i}': 3 for i in range(10)},
+                               'c': {'v': 7}, 'u': 1})
+    tree = FileSystemTree(str(tmp_path))
+    tree.update_rectangles((0, 0, 120, 80))
+    tree.expand()
+    before = _snapshot(tree)
+    rectangles = tree.get_rectangles()
+    journal = EditJournal(tree)
+    pager = SubtreePager(tree, budget=8)
+    assert pager.resident() == 20
+
+    top = {subtree._name: subtree for subtree in tree._subtrees}
+    pager.touch(top['c'])
+    assert pager.enforce() == 2  # a and b, but not the most recent c
+    assert pager.resident() == 6
+    assert top['a']._subtree_list is None
+    assert top['c']._subtree_list is not None
+    assert tree.get_rectangles() == rectangles
+    x, y, _, _ = top['a'].rect
+    assert tree.get_tree_at_position((x + 1, y + 1)) is top['a']
+    assert 'folder' in top['b'].get_suffix()
+    assert extension_colour(top['b']) == top['b']._colour
+    assert top['a']._subtree_list is None and top['b']._subtree_list is None
+
+    spilled = pager._file.seek(0, 2)
+    assert len(top['b']._subtrees) == 10
+    pager.page_out(top['b'])
+    assert pager._file.seek(0, 2) == spilled
+    assert pager.resident() == 6
+    pager.budget = 1
+    assert pager.enforce() == 1  # only c is left, which is not enough
+    assert pager._settled and pager.enforce() == 0
+    assert len(top['c']._subtrees) == 1
+    assert not pager._settled
+    pager.budget = 8
+
+    top['a'].expand()
+    _find(top['a'], 'x').change_size(0.5)
+    assert pager.resident() == 10
+    tree.collapse_all()
+    tree.expand()
+    assert pager.enforce() == 1  # a was edited, so only c is paged out
+    assert top['a']._subtree_list is not None
+    assert top['c']._subtree_list is None
+    journal.undo()
+    assert _snapshot(tree) == before
+
+    pager.page_out(top['c'])
+    resident = pager.resident()
+    assert top['c'].delete_self()
+    assert pager.resident() == resident - 1  # v was not in memory
+    journal.undo()
+    assert pager.resident() == resident
+    assert top['c']._subtree_list is None
+
+    pager.close()
+    assert pager.resident() == 20
+    assert _snapshot(tree) == before
+
+
+# TEST 28 ----------------------------------------------------------------------
+def test_shared_node_table(tmp_path) -> None:
+    """Test that a tree shared in a node table is read back, lazily, with the
+    same structure, sizes and layout, and that another process can attach
+    to it.
+    """
+    _make_directory(tmp_path, {'a': {'x.txt': 10, 'y': {'z.py': 20}},
+                               'empty': {}, 'é.txt': 5})
+    tree = FileSystemTree(str(tmp_path))
+    table = share_tree(tree)
+    try:
+        view = table.root()
+        assert view._subtree_list is None  # nothing read in yet
+        assert len(table) == 7
+        assert _snapshot(view) == _snapshot(tree)
+        assert _find(view, 'z.py').get_full_path() == \
+            _find(tree, 'z.py').get_full_path()
+        assert view.get_extension_sizes() == tree.get_extension_sizes()
+        assert view.get_suffix() == tree.get_suffix()
+
+        view.update_rectangles((0, 0, 90, 60))
+        tree.update_rectangles((0, 0, 90, 60))
+        view.expand_all()
+        tree.expand_all()
+        assert view.get_rectangles() == tree.get_rectangles()
+        _find(view, 'x.txt').change_size(1.0)  # only in this view
+        assert view.data_size == 45 and table.root().data_size == 35
+
+        viewer = subprocess.run(
+            [sys.executable, '-c', 'import sys; from tm_shared import '
+             'attach_tree; t = attach_tree(sys.argv[1]); r = t.root(); '
+             'print(r.data_size, len(r._subtrees)); t.close()', table.name],
+            capture_output=True, text=True, cwd=os.path.dirname(__file__),
+            check=True)
+        assert viewer.stdout.split() == ['35', '3']
+    finally:
+        table.close()
+
+
+# TEST 29 ----------------------------------------------------------------------
+def test_tiled_export(tmp_path) -> None:
+    """Test that the tile grid assigns each rectangle to the tiles it
+    overlaps, and that a treemap exported in tiles by worker processes is the
+    same image as one rendered whole.
+    """
+    grid = TileGrid(50, 37, 16)
+    assert (grid.columns, grid.rows, len(grid)) == (4, 3, 12)
+    assert grid.tile_rect(2, 3) == (48, 32, 2, 5)
+    grid.add((10, 10, 10, 30), (1, 2, 3))
+    grid.add((60, 0, 5, 5), (1, 2, 3))  # off the canvas
+    assert [(row, column) for row in range(3) for column in range(4)
+            if grid.tile(row, column)] == \
+        [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]
+
+    (tmp_path / 'data').mkdir()
+    _make_directory(tmp_path / 'data', {'a': {'x.txt': 600, 'y.py': 200},
+                                        'b': {f'f{i}': 10 * i + 1
+                                              for i in range(12)},
+                                        'c.bin': 300})
+    tree = FileSystemTree(str(tmp_path / 'data'))
+    tree.expand_all()
+    render(tree, str(tmp_path / 'whole.png'), 50, 37)
+    assert export_png(tree, str(tmp_path / 'tiled.png'), 50, 37,
+                      tile_size=16, workers=2) == 12
+    assert (tmp_path / 'tiled.png').read_bytes() == \
+        (tmp_path / 'whole.png').read_bytes()
+
+    paths = export_tiles(tree, str(tmp_path / 'tiles'), 50, 37,
+                         tile_size=16, workers=2)
+    assert [os.path.basename(path) for path in paths[:5]] == \
+        ['0_0.png', '0_1.png', '0_2.png', '0_3.png', '1_0.png']
+    with open(paths[-1], 'rb') as f:
+        assert f.read(24)[16:] == bytes([0, 0, 0, 2, 0, 0, 0, 5])
+
+
 ##############################################################################
 # Helpers
 ##############################################################################
 
+def _make_directory(path, layout: dict) -> None:
+    """Create the files and folders described by <layout> under <path>. Each
+    key is a name; an int value is a file of that many bytes and a dict value
+    is a folder with that layout.
+    """
+    for name, value in layout.items():
+        child = os.path.join(str(path), name)
+        if isinstance(value, dict):
+            os.mkdir(child)
+            _make_directory(child, value)
+        else:
+            with open(child, 'wb') as f:
+                f.write(b'x' * value)
+
+
+def _find(tree: TMTree, name: str):
+    """Return the first node in <tree> called <name>, or None.
+    """
+    if tree._name == name:
+        return tree
+    for subtree in tree._subtrees:
+        found = _find(subtree, name)
+        if found is not None:
+            return found
+    return None
+
+
+def _snapshot(tree: TMTree) -> list:
+    """Return the (path, size, rect) of every node in <tree>, in order.
+    """
+    nodes = []
+    stack = [(tree, '')]
+    while stack:
+        node, path = stack.pop()
+        path += '/' + node._name
+        nodes.append((path, node.data_size, node.rect))
+        stack.extend((subtree, path) for subtree in reversed(node._subtrees))
+    return nodes
+
+
+def _growths(diff, tree: TMTree) -> list:
+    """Return the growth given by <diff> to every node in <tree>, in order.
+    """
+    growths = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        growths.append((node._name, diff.growth(node)))
+        stack.extend(node._subtrees)
+    return growths
+
+
+def _mtimes(tree: TMTree) -> dict:
+    """Return the modification time of every node in <tree>, by path.
+    """
+    mtimes = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        mtimes[node.get_full_path(), node._name] = node._mtime
+        stack.extend(node._subtrees)
+    return mtimes
+
+
 def is_valid_colour(colour: tuple[int, int, int]) -> bool:
     """Return True iff <colour> is a valid colour. That is, if all of its
     values are between 0 and 255, inclusive.
@@ -253,3 +1123,4 @@ if __name__ == '__main__':
     #             subtree.update_rectangles(new_rect)
     #             temp_y += rect2[3]  # next subtree, we assign rect with
     #             # higher y value
+
@@ -0,0 +1,147 @@
+"""
+Assignment 2: Browsing Archives as Treemap Trees
+
+=== Module Description ===
+This module builds trees of the members of .zip and .tar (optionally
+compressed) archives, without extracting any member data:
+    - a zip archive is read from its central directory only, which is at the
+      end of the file, so the cost depends on the number of members and not
+      on their size
+    - a tar archive is read in a single pass over its member headers. For
+      an uncompressed tar, the data between the headers is skipped with
+      seeks; a compressed tar has to be decompressed as it is read, but
+      none of the data is kept.
+
+The sizes of zip members are their compressed sizes, i.e. the space they
+take in the archive; the sizes of tar members are their sizes in the tar.
+
+open_archive_leaf replaces an archive leaf of a scanned tree with the tree
+of its members, as one undoable edit. The tree keeps the size of the leaf,
+so the totals of the folders around it do not change: the member sizes are
+scaled down in proportion if they add up to more (e.g. the uncompressed
+members of a .tar.gz), and the rest of the size (headers, directories and
+padding) is given to an '(archive overhead)' leaf.
+"""
+from __future__ import annotations
+
+import os
+import tarfile
+import zipfile
+from typing import Iterator, List, Optional
+
+from tm_trees import TMTree
+from tm_bulk import Record, RecordTree, build_records
+
+ZIP_EXTENSIONS = ('.zip', '.jar', '.whl', '.apk')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                  '.txz')
+
+OVERHEAD = '(archive overhead)'
+
+
+class ArchiveTree(RecordTree):
+    """A tree of the members of an archive file (see read_archive).
+
+    === Private Attributes ===
+    _archive: For the root, the path of the archive file. None for the other
+    nodes.
+    """
+    _archive: Optional[str] = None
+
+    def get_full_path(self) -> str:
+        """Returns the path of this member, inside the path of the archive.
+        """
+        names = []
+        tree = self
+        while tree._archive is None and tree._parent_tree is not None:
+            names.append(tree._name)
+            tree = tree._parent_tree
+        if tree._archive is None:  # not read by read_archive
+            return self.get_path_string()
+        return os.path.join(tree._archive, *reversed(names))
+
+
+def is_archive(path: str) -> bool:
+    """Returns whether <path> has the extension of an archive that
+    read_archive can read.
+    """
+    lower = path.lower()
+    return lower.endswith(ZIP_EXTENSIONS) or lower.endswith(TAR_EXTENSIONS)
+
+
+def read_archive(path: str, size: Optional[int] = None) -> ArchiveTree:
+    """Returns the tree of the members of the archive at <path>, named after
+    the archive file. If <size> is given, the member sizes are fitted to it
+    (see the module description).
+
+    Raises OSError, zipfile.BadZipFile or tarfile.TarError if the archive
+    cannot be read.
+    """
+    if path.lower().endswith(ZIP_EXTENSIONS):
+        records = _zip_records(path)
+    else:
+        records = _tar_records(path)
+    if size is not None:
+        records = _fit_records(list(records), size)
+    tree = build_records(records, os.path.basename(path), cls=ArchiveTree)
+    tree._archive = path
+    return tree
+
+
+def _fit_records(records: List[Record], size: int) -> List[Record]:
+    """Returns <records> with their sizes scaled down in proportion if they
+    add up to more than <size>, and an OVERHEAD record for the rest of
+    <size>, so that they add up to exactly <size>.
+    """
+    total = sum(record_size for _, record_size in records)
+    if total > size:
+        records = [(name, record_size * size // total)
+                   for name, record_size in records]
+        total = sum(record_size for _, record_size in records)
+    if total < size:
+        records.append((OVERHEAD, size - total))
+    return records
+
+
+def _zip_records(path: str) -> Iterator[Record]:
+    """Yields the (name, compressed size) of the files in the zip archive at
+    <path>, read from its central directory.
+    """
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, info.compress_size
+
+
+def _tar_records(path: str) -> Iterator[Record]:
+    """Yields the (name, size) of the regular files in the tar archive at
+    <path>, in one pass over its headers.
+    """
+    with tarfile.open(path, 'r:*') as archive:
+        member = archive.next()
+        while member is not None:
+            if member.isfile():
+                yield member.name, member.size
+            archive.members = []  # the headers are not needed again
+            member = archive.next()
+
+
+def open_archive_leaf(leaf: TMTree) -> Optional[ArchiveTree]:
+    """Replaces the archive file <leaf> of a scanned tree with the tree of
+    its members, in the same position, and returns that tree. Returns None,
+    leaving the tree unchanged, if <leaf> is not an archive leaf or the
+    archive cannot be read.
+    """
+    if leaf._subtrees or leaf._parent_tree is None or leaf.is_summary() \
+            or isinstance(leaf, ArchiveTree) \
+            or not is_archive(leaf.get_full_path()):
+        return None
+    try:
+        tree = read_archive(leaf.get_full_path(), leaf.data_size)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError):
+        return None
+    parent = leaf._parent_tree
+    with leaf._edit():
+        index = leaf._detach()
+        tree._attach(parent, index)
+    return tree
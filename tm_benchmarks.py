@@ -0,0 +1,630 @@
+"""
+Assignment 2: Benchmarks for Treemap Trees
+
+=== Module Description ===
+This module contains benchmarks for the tree operations used by the treemap
+visualiser, and generators of synthetic trees to run them on:
+    - wide_flat: one folder holding every file
+    - deep_chain: chains of nested folders, each holding one file
+    - balanced: a complete tree with 10 subtrees per folder
+    - zipf: a randomly shaped tree whose file sizes follow a Zipf-like
+      (heavy-tailed) distribution
+The trees are built in memory, or written as sparse files to a directory
+(a tmpfs such as /dev/shm by default) and scanned with FileSystemTree.
+
+The suite records one JSON line per timed operation, tagged with the git
+revision, so the results of two versions can be compared, e.g.:
+    python tm_benchmarks.py suite --nodes 1000 100000 -o new.jsonl
+    python tm_benchmarks.py compare old.jsonl new.jsonl
+    python tm_benchmarks.py journal --edits 100000
+    python tm_benchmarks.py startup
+    python tm_benchmarks.py parallel --nodes 1000000 --workers 1 2 4 8
+    python tm_benchmarks.py export --size 20000 --tile-sizes 4096 1024 256
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional
+
+from tm_trees import TMTree, FileSystemTree
+from tm_journal import EditJournal
+from tm_scan import scan_parallel
+from tm_shared import pack_tree, read_table
+from tm_bulk import build_records, read_du
+from tm_export import export_png, layout
+
+# The longest folder chain built by deep_chain. The tree methods are
+# recursive, so much deeper chains would exceed Python's recursion limit.
+MAX_CHAIN = 400
+
+
+def _file(i: int, size: int) -> TMTree:
+    """Returns a leaf named after <i> with the given <size>.
+    """
+    return TMTree(f'file{i}.dat', [], size)
+
+
+def balanced_tree(fanout: int, depth: int, rng: random.Random) -> TMTree:
+    """Returns a complete tree with <fanout> subtrees per folder and leaves
+    at <depth>, whose leaf sizes are random.
+    """
+    if depth == 0:
+        return _file(0, rng.randint(1, 1 << 20))
+    return TMTree(f'dir{depth}', [balanced_tree(fanout, depth - 1, rng)
+                                  for _ in range(fanout)])
+
+
+def wide_flat(nodes: int, rng: random.Random) -> TMTree:
+    """Returns a folder holding <nodes> - 1 files.
+    """
+    return TMTree('wide', [_file(i, rng.randint(1, 1 << 20))
+                           for i in range(max(nodes - 1, 1))])
+
+
+def deep_chain(nodes: int, rng: random.Random) -> TMTree:
+    """Returns a tree of about <nodes> nodes made of chains of nested
+    folders (at most MAX_CHAIN deep) that each hold one file.
+    """
+    chains = []
+    remaining = max(nodes - 1, 2)
+    while remaining > 1:
+        length = min(remaining // 2, MAX_CHAIN)
+        chain = None
+        for i in range(length):
+            subtrees = [_file(i, rng.randint(1, 1 << 20))]
+            if chain is not None:
+                subtrees.append(chain)
+            chain = TMTree(f'level{length - i}', subtrees)
+        chains.append(chain)
+        remaining -= 2 * length
+    for i, chain in enumerate(chains):
+        chain._name = f'chain{i}'
+    return TMTree('deep', chains)
+
+
+def balanced(nodes: int, rng: random.Random) -> TMTree:
+    """Returns a complete tree with 10 subtrees per folder and <nodes>
+    leaves, rounded down to a power of 10.
+    """
+    depth = max(int(math.log10(max(nodes, 10))), 1)
+    return balanced_tree(10, depth, rng)
+
+
+def zipf(nodes: int, rng: random.Random) -> TMTree:
+    """Returns a randomly shaped tree of about <nodes> nodes, whose folders
+    hold 2 to 20 subtrees and whose file sizes are heavy-tailed: most files
+    are small and a few are very large.
+    """
+    def build(budget: int, depth: int) -> TMTree:
+        if budget <= 1 or depth > 12:
+            size = int(1024 * rng.paretovariate(1.1))
+            return _file(budget, size)
+        fanout = min(rng.randint(2, 20), budget - 1)
+        shares = [rng.random() for _ in range(fanout)]
+        total = sum(shares)
+        return TMTree(f'dir{depth}_{budget}',
+                      [build(max(int((budget - 1) * share / total), 1),
+                             depth + 1) for share in shares])
+    return build(max(nodes, 2), 0)
+
+
+GENERATORS = {
+    'wide_flat': wide_flat,
+    'deep_chain': deep_chain,
+    'balanced': balanced,
+    'zipf': zipf,
+}
+
+
+def materialise(tree: TMTree, path: str) -> None:
+    """Writes <tree> under the folder <path>, as folders and sparse files of
+    the same sizes. Siblings with the same name are numbered to make them
+    unique.
+    """
+    os.makedirs(path, exist_ok=True)
+    stack = [(tree, path)]
+    while stack:
+        node, folder = stack.pop()
+        seen = {}
+        for subtree in node._subtrees:
+            name = subtree._name
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                name = f'{seen[name]}_{name}'
+            child = os.path.join(folder, name)
+            if subtree._subtrees:
+                os.mkdir(child)
+                stack.append((subtree, child))
+            else:
+                with open(child, 'wb') as f:
+                    f.truncate(subtree.data_size)
+
+
+def records(tree: TMTree) -> Iterator[tuple]:
+    """Yields a (path, size) record for every leaf in <tree>, with paths
+    relative to it. Siblings with the same name are numbered as in
+    materialise.
+    """
+    stack = [(tree, '')]
+    while stack:
+        node, folder = stack.pop()
+        seen = {}
+        for subtree in node._subtrees:
+            name = subtree._name
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                name = f'{seen[name]}_{name}'
+            if subtree._subtrees:
+                stack.append((subtree, folder + name + '/'))
+            else:
+                yield folder + name, subtree.data_size
+
+
+def _count_nodes(tree: TMTree) -> int:
+    """Returns the number of nodes in <tree>.
+    """
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node._subtrees)
+    return count
+
+
+def _leaves(tree: TMTree) -> List[TMTree]:
+    """Returns the leaves of <tree>.
+    """
+    leaves = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node._subtrees:
+            stack.extend(node._subtrees)
+        else:
+            leaves.append(node)
+    return leaves
+
+
+def _folders(tree: TMTree) -> List[TMTree]:
+    """Returns the internal nodes of <tree>.
+    """
+    folders = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node._subtrees:
+            folders.append(node)
+            stack.extend(node._subtrees)
+    return folders
+
+
+def _timed(function: Callable[[], object]) -> float:
+    """Returns the number of seconds it takes to call <function>.
+    """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_journal(edits: int = 100000, capacity: int = 100000,
+                  seed: int = 148) -> Dict[str, float]:
+    """Runs an editing session of <edits> random resize, move, duplicate and
+    delete operations on a journaled tree, then undoes and redoes all of
+    them. Returns the timings and the peak memory held by the journal.
+    """
+    rng = random.Random(seed)
+    tree = balanced_tree(10, 4, rng)
+    leaves = _leaves(tree)
+    folders = _folders(tree)
+
+    tracemalloc.start()
+    journal = EditJournal(tree, capacity)
+
+    def session() -> None:
+        for _ in range(edits):
+            leaf = leaves[rng.randrange(len(leaves))]
+            if leaf._parent_tree is None:  # deleted earlier in the session
+                continue
+            op = rng.random()
+            if op < 0.5:
+                leaf.change_size(rng.choice((0.01, -0.01)))
+            elif op < 0.75:
+                leaf.move(folders[rng.randrange(len(folders))])
+            elif op < 0.9:
+                leaves.append(leaf.duplicate())
+            else:
+                leaf.delete_self()
+
+    results = {'edits': edits, 'capacity': capacity,
+               'session_s': _timed(session)}
+    steps = 0
+
+    def undo_all() -> None:
+        nonlocal steps
+        while journal.undo():
+            steps += 1
+
+    def redo_all() -> None:
+        while journal.redo():
+            pass
+
+    results['undo_all_s'] = _timed(undo_all)
+    results['redo_all_s'] = _timed(redo_all)
+    results['undo_steps'] = steps
+    results['records'] = len(journal)
+    results['peak_mib'] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+    tracemalloc.stop()
+    return results
+
+
+# The script timed by bench_startup in a fresh interpreter. It prints the
+# seconds taken to import the modules, and then to open a window and draw
+# the first frame of a small tree (if pygame is installed).
+_STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+print(imported - start)
+if {first_frame}:
+    import random
+    from tm_benchmarks import balanced_tree
+    from treemap_visualiser import Visualiser
+    tree = balanced_tree(10, 3, random.Random(0))
+    visualiser = Visualiser()
+    visualiser.open_window()
+    visualiser.tree = tree
+    tree.update_rectangles((0, 0, visualiser.width,
+                            visualiser.height - visualiser.font_height))
+    tree.update_colours_and_depths()
+    visualiser.render_display()
+    print(time.perf_counter() - imported)
+"""
+
+
+def bench_startup(repeat: int = 5) -> Dict[str, float]:
+    """Times importing the tree modules and the visualiser in fresh
+    interpreters, and the time from importing the visualiser to its first
+    frame (drawn with SDL's dummy video driver). Returns the best of <repeat>
+    runs of each.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy',
+               PYGAME_HIDE_SUPPORT_PROMPT='1')
+    results = {}
+    for module in ('tm_trees', 'tm_report', 'treemap_visualiser'):
+        first_frame = module == 'treemap_visualiser'
+        script = _STARTUP_SCRIPT.format(module=module, first_frame=first_frame)
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', script], cwd=here,
+                                    env=env, capture_output=True, text=True)
+            if output.returncode == 0:
+                runs.append([float(line) for line in output.stdout.split()])
+        if not runs:
+            continue
+        results[f'import_{module}_ms'] = min(run[0] for run in runs) * 1000
+        if first_frame:
+            results['first_frame_ms'] = min(run[1] for run in runs) * 1000
+    return results
+
+
+def bench_parallel_scan(nodes: int = 200000, workers: Optional[List[int]] = None,
+                        seed: int = 148,
+                        directory: Optional[str] = None) -> Dict[str, float]:
+    """Writes a wide synthetic tree of about <nodes> nodes (32 top-level
+    folders) as sparse files, and times scanning it with FileSystemTree and
+    with scan_parallel for each number of <workers>.
+
+    The speedup of each number of workers is also given as an efficiency:
+    the fraction of a linear speedup (on the CPUs there are) it reaches.
+    parent_s is the serial part of a parallel scan that grows with the
+    tree: the time the parent process takes to read the tables of all the
+    top-level folders sent back by the workers.
+    """
+    workers = workers or [1, 2, 4, 8]
+    if directory is None:
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    rng = random.Random(seed)
+    tree = TMTree('wide', [zipf(nodes // 32, rng) for _ in range(32)])
+    for i, subtree in enumerate(tree._subtrees):
+        subtree._name = f'top{i}'
+    root = tempfile.mkdtemp(prefix='tm_bench_', dir=directory)
+    results = {}
+    try:
+        materialise(tree, root)
+        results['nodes'] = _count_nodes(tree)
+        results['cpus'] = os.cpu_count() or 1
+        results['serial_s'] = _timed(lambda: FileSystemTree(root))
+        packed = [pickle.dumps((pack_tree(subtree),
+                                subtree._get_extension_sizes()))
+                  for subtree in FileSystemTree(root)._subtrees]
+        results['parent_s'] = _timed(lambda: [
+            read_table(pickle.loads(data)[0]).root() for data in packed])
+        for count in workers:
+            seconds = _timed(lambda: scan_parallel(root, workers=count))
+            speedup = results['serial_s'] / seconds
+            results[f'workers_{count}_s'] = seconds
+            results[f'workers_{count}_speedup'] = speedup
+            results[f'workers_{count}_efficiency'] = \
+                speedup / min(count, results['cpus'])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def bench_expansion(nodes: int = 1000000, seed: int = 148) -> Dict[str, float]:
+    """Times expanding and collapsing a balanced tree of about <nodes>
+    nodes that has been laid out once.
+    """
+    rng = random.Random(seed)
+    tree = balanced(nodes, rng)
+    tree.update_rectangles((0, 0, 1920, 1080))
+    leaves = _leaves(tree)
+    deep = rng.choice(leaves)
+    results = {'nodes': _count_nodes(tree)}
+    results['expand_all_s'] = _timed(tree.expand_all)
+    results['collapse_leaf_s'] = _timed(deep.collapse)
+    results['collapse_all_s'] = _timed(tree.collapse_all)
+    results['collapse_all_again_s'] = _timed(tree.collapse_all)
+    results['expand_deep_s'] = _timed(deep.get_parent().expand)
+    results['collapse_all_path_s'] = _timed(deep.collapse_all)
+    return results
+
+
+def bench_bulk(rows: int = 1000000, seed: int = 148) -> Dict[str, float]:
+    """Times building a tree from about <rows> (path, size) records, from
+    a list of records and from du output, and reports rows per second.
+    """
+    rng = random.Random(seed)
+    rows_list = list(records(zipf(int(rows * 1.1), rng)))
+    du_text = ''.join(f'{size}\t./{path}\n' for path, size in rows_list)
+    results = {'rows': len(rows_list)}
+    seconds = _timed(lambda: build_records(rows_list))
+    results['build_s'] = seconds
+    results['build_rows_per_s'] = len(rows_list) / seconds
+    seconds = _timed(lambda: build_records(read_du(io.StringIO(du_text))))
+    results['du_s'] = seconds
+    results['du_rows_per_s'] = len(rows_list) / seconds
+    return results
+
+
+def bench_export(nodes: int = 200000, size: int = 10000,
+                 tile_sizes: Optional[List[int]] = None,
+                 workers: Optional[int] = None,
+                 seed: int = 148) -> Dict[str, float]:
+    """Times laying out a fully expanded tree of about <nodes> nodes on a
+    <size> by <size> canvas, and exporting it as a PNG in tiles of each of
+    <tile_sizes> by <workers> processes, keyed by the number of tiles.
+    """
+    tile_sizes = tile_sizes or [4096, 2048, 1024, 512, 256]
+    rng = random.Random(seed)
+    tree = zipf(nodes, rng)
+    tree.expand_all()
+    results = {'nodes': _count_nodes(tree)}
+    results['layout_s'] = _timed(lambda: layout(tree, size, size))
+    handle, path = tempfile.mkstemp(prefix='tm_bench_', suffix='.png')
+    os.close(handle)
+    try:
+        for tile_size in tile_sizes:
+            tiles = (-(-size // tile_size)) ** 2
+            results[f'tiles_{tiles}_s'] = _timed(
+                lambda: export_png(tree, path, size, size, tile_size, workers))
+        results['png_bytes'] = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    return results
+
+
+def _git_revision() -> str:
+    """Returns the git revision of this module's folder, or 'unknown'.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        output = subprocess.run(['git', 'describe', '--always', '--dirty'],
+                                cwd=here, capture_output=True, text=True)
+    except OSError:
+        return 'unknown'
+    return output.stdout.strip() or 'unknown'
+
+
+def _time_operations(tree: TMTree, rng: random.Random,
+                     edits: int) -> Iterator[tuple]:
+    """Times the tree operations on <tree>, yielding (operation, seconds,
+    count) for each one. <count> is how many times it was repeated.
+    """
+    screen = (0, 0, 1920, 1080)
+    yield 'update_rectangles', _timed(lambda: tree.update_rectangles(screen)), 1
+    yield 'update_colours_and_depths', \
+        _timed(tree.update_colours_and_depths), 1
+    yield 'get_rectangles_collapsed', _timed(tree.get_rectangles), 1
+    yield 'expand_all', _timed(tree.expand_all), 1
+    tree.update_rectangles(screen)
+    yield 'get_rectangles_expanded', _timed(tree.get_rectangles), 1
+    yield 'get_lod_rectangles', _timed(
+        lambda: tree.get_lod_rectangles(screen, 4)), 1
+
+    points = [(rng.randrange(1920), rng.randrange(1080)) for _ in range(1000)]
+    yield 'get_tree_at_position', _timed(
+        lambda: [tree.get_tree_at_position(point) for point in points]), \
+        len(points)
+    yield 'collapse_all', _timed(tree.collapse_all), 1
+
+    leaves = _leaves(tree)
+    folders = _folders(tree)
+    actions = [('change_size', lambda leaf: leaf.change_size(0.01)),
+               ('duplicate', lambda leaf: leaf.duplicate()),
+               ('move', lambda leaf: leaf.move(rng.choice(folders))),
+               ('delete_self', lambda leaf: leaf.delete_self())]
+    for name, action in actions:
+        targets = [rng.choice(leaves) for _ in range(edits)]
+
+        def run() -> None:
+            for leaf in targets:
+                if leaf._parent_tree is not None:
+                    action(leaf)
+        yield name, _timed(run), edits
+
+
+def bench_suite(shapes: Optional[List[str]] = None,
+                nodes: Optional[List[int]] = None, mode: str = 'memory',
+                edits: int = 100, seed: int = 148,
+                directory: Optional[str] = None,
+                output: Optional[str] = None) -> Dict[str, float]:
+    """Runs the operations timed by _time_operations on every generated
+    tree shape in <shapes> at every size in <nodes>.
+
+    In 'memory' mode the trees are built directly; in 'disk' mode they are
+    written as sparse files under <directory> (a tmpfs by default) and the
+    timed construction is the FileSystemTree scan. Each result is printed,
+    and appended as a JSON line to <output> if it is given. Returns the
+    total time per operation.
+    """
+    shapes = shapes or list(GENERATORS)
+    nodes = nodes or [1000, 10000, 100000]
+    if directory is None:
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    common = {'revision': _git_revision(), 'mode': mode,
+              'python': platform.python_version(), 'time': time.time()}
+    totals = {}
+    out = open(output, 'a') if output else None
+    try:
+        for shape in shapes:
+            for size in nodes:
+                rng = random.Random(seed)
+                tree = None
+
+                def build() -> None:
+                    nonlocal tree
+                    tree = GENERATORS[shape](size, rng)
+
+                results = [('build', _timed(build), 1)]
+                if mode == 'disk':
+                    root = tempfile.mkdtemp(prefix='tm_bench_', dir=directory)
+
+                    def scan() -> None:
+                        nonlocal tree
+                        tree = FileSystemTree(root)
+
+                    try:
+                        materialise(tree, root)
+                        results.append(('scan', _timed(scan), 1))
+                    finally:
+                        shutil.rmtree(root, ignore_errors=True)
+                actual = _count_nodes(tree)
+                results.extend(_time_operations(tree, rng, edits))
+                for operation, seconds, count in results:
+                    row = dict(common, shape=shape, nodes=actual,
+                               operation=operation, seconds=seconds,
+                               count=count)
+                    print(f'{shape:>10} {actual:>9} {operation:>26} '
+                          f'{seconds:10.4f}s')
+                    if out is not None:
+                        out.write(json.dumps(row) + '\n')
+                    totals[operation] = totals.get(operation, 0.0) + seconds
+    finally:
+        if out is not None:
+            out.close()
+    return totals
+
+
+def compare(old: str, new: str, threshold: float = 0.10) -> Dict[str, float]:
+    """Compares two JSON Lines files written by bench_suite, printing the
+    ratio of new to old time for every (shape, nodes, operation) in both,
+    and flagging the ones more than <threshold> slower. Returns the ratios.
+    """
+    def load(path: str) -> Dict[tuple, float]:
+        best = {}
+        with open(path) as f:
+            for line in f:
+                row = json.loads(line)
+                key = (row['shape'], row['nodes'], row['operation'])
+                best[key] = min(best.get(key, math.inf), row['seconds'])
+        return best
+
+    before, after = load(old), load(new)
+    ratios = {}
+    for key in sorted(before.keys() & after.keys()):
+        ratio = after[key] / before[key] if before[key] else math.inf
+        ratios['/'.join(str(part) for part in key)] = ratio
+        flag = '  REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{key[0]:>10} {key[1]:>9} {key[2]:>26} '
+              f'{before[key]:10.4f}s {after[key]:10.4f}s {ratio:6.2f}x{flag}')
+    return ratios
+
+
+BENCHMARKS = {
+    'journal': bench_journal,
+    'startup': bench_startup,
+    'suite': bench_suite,
+    'compare': compare,
+    'parallel': bench_parallel_scan,
+    'expansion': bench_expansion,
+    'bulk': bench_bulk,
+    'export': bench_export,
+}
+
+
+def main() -> None:
+    """Runs the benchmark named on the command line and prints its results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='benchmark', required=True)
+    journal = commands.add_parser('journal', help='time a journaled editing session')
+    journal.add_argument('--edits', type=int, default=100000)
+    journal.add_argument('--capacity', type=int, default=100000)
+    startup = commands.add_parser('startup', help='time imports and the first frame')
+    startup.add_argument('--repeat', type=int, default=5)
+    suite = commands.add_parser('suite', help='time the tree operations on '
+                                              'generated trees')
+    suite.add_argument('--shapes', nargs='+', choices=sorted(GENERATORS))
+    suite.add_argument('--nodes', nargs='+', type=int)
+    suite.add_argument('--mode', choices=('memory', 'disk'), default='memory')
+    suite.add_argument('--edits', type=int, default=100)
+    suite.add_argument('--directory', help='where to write disk-mode trees')
+    suite.add_argument('-o', '--output', help='append JSON lines results here')
+    parallel = commands.add_parser('parallel', help='time scanning with '
+                                                    'worker processes')
+    parallel.add_argument('--nodes', type=int, default=200000)
+    parallel.add_argument('--workers', nargs='+', type=int)
+    parallel.add_argument('--directory', help='where to write the tree')
+    expansion = commands.add_parser('expansion', help='time expanding and '
+                                                      'collapsing a large tree')
+    expansion.add_argument('--nodes', type=int, default=1000000)
+    bulk = commands.add_parser('bulk', help='time building trees from '
+                                            'path records')
+    bulk.add_argument('--rows', type=int, default=1000000)
+    export = commands.add_parser('export', help='time exporting a large '
+                                                'treemap in tiles')
+    export.add_argument('--nodes', type=int, default=200000)
+    export.add_argument('--size', type=int, default=10000)
+    export.add_argument('--tile-sizes', nargs='+', type=int)
+    export.add_argument('--workers', type=int)
+    comparison = commands.add_parser('compare', help='compare two suite '
+                                                     'result files')
+    comparison.add_argument('old')
+    comparison.add_argument('new')
+    comparison.add_argument('--threshold', type=float, default=0.10)
+    args = vars(parser.parse_args())
+    results = BENCHMARKS[args.pop('benchmark')](**args)
+    for key, value in results.items():
+        print(f'{key}: {value:.4f}' if isinstance(value, float)
+              else f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Assignment 2: Building Treemap Trees from Path Records
+
+=== Module Description ===
+This module builds trees from streams of (path, size) records, such as du
+dumps, object-store inventory CSVs or backup manifests, without a live file
+system.
+
+build_records reads the records once, inserting each path into a trie of
+interned path components, and then turns the trie into RecordTree nodes
+bottom-up. Each node is created once, with its subtrees already built, so
+the _parent_tree links and data_size totals are set without recomputing
+anything per insert, and the whole build takes O(N) time.
+
+If a folder has a record of its own (as du writes one for every folder),
+that record's size is not added to its subtrees. When it is larger than the
+total of the subtrees that were listed, e.g. because du was run without -a,
+the difference is given to an '(unlisted files)' leaf so that the folder's
+size is right.
+
+    tree = build_records(read_du(open('du.txt')), name='/srv')
+"""
+from __future__ import annotations
+
+import csv
+import gc
+import sys
+from typing import (Iterable, Iterator, List, Optional, TextIO, Tuple, Type,
+                    Union)
+
+from tm_trees import TMTree, FileSystemTree
+
+Record = Tuple[str, int]
+
+UNLISTED = '(unlisted files)'
+
+# the number of records between moving the nodes built so far out of the
+# cyclic collector's way
+_FREEZE_EVERY = 10000
+
+# the positions of the fields in a trie node
+_CHILDREN = 0
+_SIZE = 1
+
+
+class RecordTree(FileSystemTree):
+    """A tree of files and folders built from (path, size) records rather
+    than by scanning the file system (see build_records).
+
+    Unlike a scanned tree, nodes do not store their paths, which are made
+    from the names of their ancestors when they are needed.
+
+    === Private Attributes ===
+    _separator: The separator between the names in a path.
+    """
+    _separator: str = '/'
+
+    def __init__(self, name: str, subtrees: List[TMTree],
+                 data_size: int = 0) -> None:
+        """Initializes a new RecordTree with the provided name, subtrees and
+        (for a leaf) data_size, without accessing the file system.
+        """
+        TMTree.__init__(self, name, subtrees, data_size)
+
+    def get_full_path(self) -> str:
+        """Returns the path of this tree, from the name of the root.
+        """
+        return self.get_path_string()
+
+    def get_separator(self) -> str:
+        """Returns the separator used in the records' paths.
+        """
+        return self._separator
+
+
+def build_records(records: Iterable[Record], name: str = '.',
+                  separator: str = '/',
+                  cls: Type[RecordTree] = RecordTree) -> RecordTree:
+    """Returns a tree of class <cls> named <name> holding the files in
+    <records>, whose paths are relative to it, with components separated by
+    <separator>.
+
+    Leading separators and '.' components are ignored, so '/a/b', 'a/b' and
+    './a/b' are all the file b in the folder a. A path ending with
+    <separator>, as some inventories list folders, is a folder even if
+    nothing is listed in it. If a path appears more than once, its last size
+    is used.
+    """
+    # Nothing built here can be garbage until the build is over, so every
+    # so often the nodes built so far are moved out of the cyclic
+    # collector's way (gc.freeze), rather than it walking the growing tree
+    # again and again. Unlike gc.disable, this leaves the collector running
+    # for other threads. If something else has frozen objects, they are
+    # left alone, and so is the collector.
+    freeze = gc.get_freeze_count() == 0
+    try:
+        intern = sys.intern
+        root = [None, None]
+        for count, (path, size) in enumerate(records, 1):
+            if freeze and not count % _FREEZE_EVERY:
+                gc.freeze()
+            node = root
+            for component in path.split(separator):
+                if not component or component == '.':
+                    continue
+                children = node[_CHILDREN]
+                if children is None:
+                    children = node[_CHILDREN] = {}
+                child = children.get(component)
+                if child is None:
+                    child = children[intern(component)] = [None, None]
+                node = child
+            if path.endswith(separator) and node[_CHILDREN] is None:
+                node[_CHILDREN] = {}  # a folder, even if nothing is in it
+            node[_SIZE] = size
+        return _build_tree(root, name, separator, cls, freeze)
+    finally:
+        if freeze:
+            gc.unfreeze()
+
+
+def _build_tree(root: list, name: str, separator: str,
+                cls: Type[RecordTree], freeze: bool) -> RecordTree:
+    """Returns the tree of class <cls> for the trie rooted at <root>,
+    building every node after its subtrees, without recursion. If <freeze>
+    is True, the nodes built so far are frozen every so often (see
+    build_records).
+    """
+    made = 0
+
+    def make(tree_name: str, subtrees: Optional[List[TMTree]],
+             size: int = 0) -> RecordTree:
+        # a folder if <subtrees> is a list, even an empty one
+        nonlocal made
+        made += 1
+        if freeze and not made % _FREEZE_EVERY:
+            gc.freeze()
+        tree = cls.__new__(cls)
+        if subtrees is None:
+            TMTree.__init__(tree, tree_name, [], size)
+        else:
+            tree._init_folder(tree_name, subtrees)
+        if separator != '/':
+            tree._separator = separator
+        return tree
+
+    # each entry is (trie node, name, built subtrees, iterator over children)
+    stack = [(root, name, [], iter((root[_CHILDREN] or {}).items()))]
+    while True:
+        node, node_name, subtrees, children = stack[-1]
+        for child_name, child in children:
+            if child[_CHILDREN] is not None:
+                stack.append((child, child_name, [],
+                              iter(child[_CHILDREN].items())))
+                break
+            subtrees.append(make(child_name, None, child[_SIZE] or 0))
+        else:
+            stack.pop()
+            size = node[_SIZE]
+            if size is not None:
+                listed = sum(subtree.data_size for subtree in subtrees)
+                if size > listed:
+                    subtrees.append(make(UNLISTED, None, size - listed))
+            tree = make(node_name, subtrees)
+            if not stack:
+                return tree
+            stack[-1][2].append(tree)
+
+
+# ******************************************************************************
+# ************* RECORD READERS *************************************************
+# ******************************************************************************
+
+def read_du(lines: Iterable[str], block_size: int = 1) -> Iterator[Record]:
+    """Yields the (path, size) records in the output of du, e.g. du -ab,
+    whose lines are a size and a path separated by a tab. Sizes are
+    multiplied by <block_size> (e.g. 1024 for du -k).
+    """
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        size, path = line.split('\t', 1)
+        yield path, int(size) * block_size
+
+
+def read_csv(f: TextIO, path_column: Union[int, str] = 0,
+             size_column: Union[int, str] = 1,
+             header: Optional[bool] = None) -> Iterator[Record]:
+    """Yields the (path, size) records in the CSV file <f>, taking the path
+    and size from the given columns, by position or by header name.
+
+    If <header> is None, the file has a header row exactly when a column is
+    given by name. Rows with an empty size (e.g. folders in some
+    inventories) are skipped.
+    """
+    rows = csv.reader(f)
+    if header is None:
+        header = isinstance(path_column, str) or isinstance(size_column, str)
+    if header:
+        names = next(rows)
+        if isinstance(path_column, str):
+            path_column = names.index(path_column)
+        if isinstance(size_column, str):
+            size_column = names.index(size_column)
+    for row in rows:
+        if row and row[size_column]:
+            yield row[path_column], int(row[size_column])
@@ -0,0 +1,310 @@
+"""
+Assignment 2: Differences Between Treemap Trees
+
+=== Module Description ===
+This module compares two trees of the same folder, e.g. scans taken on two
+different nights, and reports what was added, removed and resized.
+
+The trees are aligned by path: the subtrees of two aligned folders are
+matched by name. The walk does not descend into a pair of subtrees that are
+known to be identical, which is decided in O(1) time when:
+    - one subtree is a pending copy-on-write clone of the other, or both
+      are pending clones of the same tree
+    - both have the same size and the same newest modification time
+      (FileSystemTree._mtime), which covers everything scanned inside them
+    - hashing is enabled, and both have the same size and the same hash of
+      the (name, size) pairs inside them. Each node is hashed at most once,
+      and a pending clone is hashed as its source, so hashing never
+      materialises a clone.
+
+The diff also gives every node of the new tree its growth, so that the
+treemap can be coloured by it (see TreeDiff.growth_colour). A diff can
+follow the edits made to the new tree afterwards, as an observer of it, and
+update the growth of the edited nodes and their ancestors in O(depth) time
+per edit instead of diffing the trees again. It follows nodes by identity
+rather than by name, so a duplicate stays added even if the node it was
+copied from is removed.
+"""
+from __future__ import annotations
+
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
+
+from tm_trees import TMTree
+
+ADDED = 'added'
+REMOVED = 'removed'
+RESIZED = 'resized'
+
+# (kind, path relative to the roots, old size, new size)
+Change = Tuple[str, str, int, int]
+
+_UNCHANGED_COLOUR = (90, 90, 90)
+_GROWN_COLOUR = (230, 50, 40)
+_SHRUNK_COLOUR = (40, 120, 230)
+
+
+def diff_trees(old: TMTree, new: TMTree, use_mtime: bool = True,
+               use_hashes: bool = False,
+               follow_edits: bool = False) -> TreeDiff:
+    """Returns the differences from the tree <old> to the tree <new>.
+
+    If <use_mtime> is True, subtrees with the same size and newest
+    modification time are assumed to be identical. This is only safe when
+    neither tree has been edited since it was scanned.
+    If <use_hashes> is True, subtrees with the same (name, size) hash are
+    skipped as identical.
+    If <follow_edits> is True, the growth of the nodes of <new>, which must
+    be a root, is kept up to date as it is edited, until the diff is closed.
+    """
+    diff = TreeDiff(old, new, use_mtime, use_hashes)
+    if follow_edits:
+        new._add_observer(diff)
+    return diff
+
+
+class TreeDiff:
+    """The differences from one tree to another.
+
+    === Public Attributes ===
+    old: The tree the differences are from.
+    new: The tree the differences are to.
+    changes: Every change, in the order the trees were walked. An added or
+    removed subtree is one change; the nodes inside it are not listed. This
+    is not updated when the diff follows edits; only the growth is.
+    skipped: The number of identical pairs of subtrees that were not walked.
+
+    === Private Attributes ===
+    _use_mtime: Whether subtrees with the same modification time are
+    skipped.
+    _hashes: The (name, size) hash of each node hashed so far, or None if
+    hashes are not used.
+    _growth: The growth of each node of <new> that was resized.
+    _added: The roots of the subtrees of <new> that were added. They are not
+    walked, so that adding a large (cloned) subtree stays cheap.
+    _home: The parent each node of <new> that was not added had when it was
+    first removed by an edit, so that it is known to be back in place when
+    its removal is undone.
+    """
+    old: TMTree
+    new: TMTree
+    changes: List[Change]
+    skipped: int
+    _use_mtime: bool
+    _hashes: Optional[Dict[TMTree, int]]
+    _growth: Dict[TMTree, int]
+    _added: Set[TMTree]
+    _home: Dict[TMTree, TMTree]
+
+    def __init__(self, old: TMTree, new: TMTree, use_mtime: bool = True,
+                 use_hashes: bool = False) -> None:
+        """Compares <old> to <new> (see diff_trees).
+        """
+        self.old = old
+        self.new = new
+        self.changes = []
+        self.skipped = 0
+        self._use_mtime = use_mtime
+        self._hashes = {} if use_hashes else None
+        self._growth = {}
+        self._added = set()
+        self._home = {}
+        self._diff(old, new, '')
+
+    def close(self) -> None:
+        """Stops following the edits to the new tree.
+        """
+        self.new._remove_observer(self)
+
+    def get_changes(self, kind: Optional[str] = None) -> List[Change]:
+        """Returns the changes of the given <kind> (ADDED, REMOVED or
+        RESIZED), or all changes if <kind> is None.
+        """
+        if kind is None:
+            return list(self.changes)
+        return [change for change in self.changes if change[0] == kind]
+
+    def largest_changes(self, k: int) -> List[Change]:
+        """Returns the <k> changes with the largest size differences, largest
+        first.
+        """
+        return heapq.nlargest(k, self.changes,
+                              key=lambda change: abs(change[3] - change[2]))
+
+    def growth(self, tree: TMTree) -> int:
+        """Returns how much the node <tree> of the new tree grew, in bytes.
+        This is its whole size if it was added.
+        """
+        delta = self._growth.get(tree)
+        if delta is not None and tree not in self._added:
+            return delta
+        ancestor = tree
+        while ancestor is not None and ancestor is not self.new:
+            if ancestor in self._added:
+                return tree.data_size
+            ancestor = ancestor._parent_tree
+        return 0
+
+    def growth_colour(self, tree: TMTree) -> Tuple[int, int, int]:
+        """Returns the colour of the node <tree> of the new tree by its growth:
+        grey if it did not change, and redder (or bluer) the more it grew (or
+        shrank) relative to its size. This can be passed as the colouring to
+        TMTree.get_rectangles.
+        """
+        delta = self.growth(tree)
+        if delta == 0:
+            return _UNCHANGED_COLOUR
+        target = _GROWN_COLOUR if delta > 0 else _SHRUNK_COLOUR
+        old_size = tree.data_size - delta
+        # even small changes are clearly coloured
+        scale = 0.3 + 0.7 * min(1.0, abs(delta) / max(old_size,
+                                                        tree.data_size, 1))
+        red, green, blue = (int(start + (end - start) * scale) for start, end
+                            in zip(_UNCHANGED_COLOUR, target))
+        return red, green, blue
+
+    def _add_growth(self, tree: Optional[TMTree], delta: int) -> None:
+        """Adds <delta> to the growth of <tree> and its ancestors, apart from
+        those in added subtrees, whose growth is their size.
+        """
+        path = []
+        while tree is not None:
+            path.append(tree)
+            if tree in self._added:
+                path = []
+            tree = tree._parent_tree
+        for node in path:
+            self._growth[node] = self._growth.get(node, 0) + delta
+
+    def _diff(self, old: TMTree, new: TMTree, path: str) -> None:
+        """Records the changes from <old> to <new>, which are aligned at
+        <path>.
+        """
+        if self._identical(old, new):
+            self.skipped += 1
+            return
+        if old.data_size != new.data_size:
+            self.changes.append((RESIZED, path, old.data_size, new.data_size))
+            self._growth[new] = new.data_size - old.data_size
+
+        old_subtrees = _by_name(old._subtrees)
+        prefix = path + new.get_separator() if path else ''
+        for key, new_subtree in _by_name(new._subtrees).items():
+            old_subtree = old_subtrees.pop(key, None)
+            if old_subtree is None:
+                self.changes.append((ADDED, prefix + new_subtree._name, 0,
+                                     new_subtree.data_size))
+                self._added.add(new_subtree)
+            else:
+                self._diff(old_subtree, new_subtree,
+                           prefix + new_subtree._name)
+        for old_subtree in old_subtrees.values():
+            self.changes.append((REMOVED, prefix + old_subtree._name,
+                                 old_subtree.data_size, 0))
+
+    def _identical(self, old: TMTree, new: TMTree) -> bool:
+        """Returns whether <old> and <new> are known to be identical without
+        walking them.
+        """
+        if _source(old) is _source(new):
+            return True
+        if old.data_size != new.data_size:
+            return False
+        if self._use_mtime:
+            mtime = getattr(old, '_mtime', None)
+            if mtime is not None and mtime == getattr(new, '_mtime', None):
+                return True
+        if self._hashes is not None:
+            return self._hash(old) == self._hash(new)
+        return False
+
+    def _hash(self, tree: TMTree) -> int:
+        """Returns the hash of the names and sizes in <tree>, which does not
+        depend on the order of its subtrees. Each node is hashed after its
+        subtrees, without recursion.
+        """
+        hashes = self._hashes
+        stack = [_source(tree)]
+        while stack:
+            node = stack[-1]
+            if node in hashes:
+                stack.pop()
+                continue
+            subtrees = [_source(subtree) for subtree in node._subtrees]
+            missing = [subtree for subtree in subtrees
+                       if subtree not in hashes]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            hashes[node] = hash((node._name, node.data_size, tuple(sorted(
+                hashes[subtree] for subtree in subtrees))))
+        return hashes[_source(tree)]
+
+
+    # **************************************************************************
+    # ************* OBSERVER INTERFACE FOR TMTree ******************************
+    # **************************************************************************
+    def on_edit_begin(self) -> None:
+        pass
+
+    def on_edit_end(self) -> None:
+        pass
+
+    def on_load(self, tree: TMTree) -> None:
+        pass
+
+    def on_unload(self, tree: TMTree) -> None:
+        pass
+
+    def on_display(self, tree: TMTree) -> None:
+        pass
+
+    def on_resize(self, tree: TMTree, old_size: int) -> None:
+        """Adds the change in the size of <tree> to its growth and to the
+        growth of its ancestors.
+        """
+        self._add_growth(tree, tree.data_size - old_size)
+
+    def on_detach(self, tree: TMTree, parent: TMTree, index: int) -> None:
+        """Takes the size of <tree> off the growth of the <parent> it was
+        removed from and its ancestors.
+        """
+        if tree not in self._added:
+            self._home.setdefault(tree, parent)
+        self._add_growth(parent, -tree.data_size)
+
+    def on_attach(self, tree: TMTree, parent: TMTree,
+                  index: Optional[int]) -> None:
+        """Adds the size of <tree> to the growth of the <parent> it was
+        inserted into and its ancestors. <tree> is added, unless it is back
+        where it was before it was removed.
+        """
+        if self._home.get(tree) is parent:
+            self._added.discard(tree)
+        else:
+            self._added.add(tree)
+        self._add_growth(parent, tree.data_size)
+
+
+def _source(tree: TMTree) -> TMTree:
+    """Returns the tree whose subtrees <tree> reads, if it is a pending
+    copy-on-write clone, and <tree> otherwise. A pending clone has the same
+    names and sizes as its source.
+    """
+    while tree._subtree_source is not None:
+        tree = tree._subtree_source
+    return tree
+
+
+def _by_name(subtrees: List[TMTree]) -> Dict[Tuple[str, int], TMTree]:
+    """Returns <subtrees> keyed by their name and, for subtrees that share a
+    name (e.g. after duplicating in the visualiser), how many came before.
+    """
+    keyed = {}
+    for subtree in subtrees:
+        occurrence = 0
+        while (subtree._name, occurrence) in keyed:
+            occurrence += 1
+        keyed[(subtree._name, occurrence)] = subtree
+    return keyed
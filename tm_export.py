@@ -0,0 +1,257 @@
+"""
+Assignment 2: Exporting Large Treemap Images in Tiles
+
+=== Module Description ===
+This module renders a treemap at a resolution far larger than the screen,
+e.g. 20000 by 20000 pixels for a poster or a zoomable viewer, using several
+processes and without holding the whole image in memory.
+
+The tree is laid out once, at the target size. The canvas is then split
+into square tiles, and a TileGrid assigns each rectangle returned by
+TMTree.get_rectangles to the tiles it overlaps, so that each tile is
+rasterised from only its own rectangles, by a worker process. A worker only
+ever holds the pixels of one tile, so its memory is bounded by the tile
+size, whatever the size of the image.
+
+export_png stitches the tiles into a single PNG, one band (row of tiles) at
+a time: the pixel rows of a band are compressed as soon as its tiles are
+done, while the workers rasterise the next band. export_tiles instead writes
+every tile to its own PNG file, compressed by the worker that rasterised it.
+
+It does not import pygame, e.g.:
+    python tm_export.py ~/Documents poster.png --size 20000x20000
+    python tm_export.py ~/Documents tiles/ --tiles --tile-size 512
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from tm_trees import TMTree, FileSystemTree, expand_to_depth, \
+    extension_colour
+from tm_report import Colour, Rect, rasterise, write_png
+
+DEFAULT_TILE_SIZE = 1024
+
+
+class TileGrid:
+    """A grid of square tiles over a canvas, used as a spatial index of the
+    rectangles drawn on it.
+
+    Tiles are numbered by row and column from the top-left corner. The tiles
+    in the last row and column are cut short by the edges of the canvas.
+
+    === Public Attributes ===
+    width: The width of the canvas, in pixels.
+    height: The height of the canvas, in pixels.
+    tile_size: The width and height of a (whole) tile.
+    columns: The number of tiles across the canvas.
+    rows: The number of tiles down the canvas.
+
+    === Private Attributes ===
+    _buckets: The rectangles and colours overlapping each tile, row by row,
+    in the order they were added.
+    """
+    width: int
+    height: int
+    tile_size: int
+    columns: int
+    rows: int
+    _buckets: List[List[Tuple[Rect, Colour]]]
+
+    def __init__(self, width: int, height: int, tile_size: int) -> None:
+        """Initializes an empty grid of <tile_size> tiles over a <width> by
+        <height> canvas.
+        """
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.columns = -(-width // tile_size)
+        self.rows = -(-height // tile_size)
+        self._buckets = [[] for _ in range(self.columns * self.rows)]
+
+    def __len__(self) -> int:
+        """Returns the number of tiles in the grid.
+        """
+        return len(self._buckets)
+
+    def add(self, rect: Rect, colour: Colour) -> None:
+        """Adds <rect>, filled with <colour>, to every tile it overlaps.
+        Rectangles with no area on the canvas are ignored.
+        """
+        x, y, w, h = rect
+        left, right = max(x, 0), min(x + w, self.width)
+        top, bottom = max(y, 0), min(y + h, self.height)
+        if left >= right or top >= bottom:
+            return
+        size = self.tile_size
+        first, last = left // size, (right - 1) // size
+        for row in range(top // size, (bottom - 1) // size + 1):
+            start = row * self.columns
+            for bucket in self._buckets[start + first:start + last + 1]:
+                bucket.append((rect, colour))
+
+    def tile_rect(self, row: int, column: int) -> Rect:
+        """Returns the rectangle of the canvas covered by the tile at <row>
+        and <column>.
+        """
+        x, y = column * self.tile_size, row * self.tile_size
+        return (x, y, min(self.tile_size, self.width - x),
+                min(self.tile_size, self.height - y))
+
+    def tile(self, row: int, column: int) -> List[Tuple[Rect, Colour]]:
+        """Returns the rectangles and colours that overlap the tile at <row>
+        and <column>, in the order they were added.
+        """
+        return self._buckets[row * self.columns + column]
+
+
+def layout(tree: TMTree, width: int, height: int,
+           tile_size: int = DEFAULT_TILE_SIZE,
+           by_extension: bool = False) -> TileGrid:
+    """Lays out <tree> once on a <width> by <height> canvas and returns a
+    grid of <tile_size> tiles holding its displayed rectangles.
+    """
+    tree.update_rectangles((0, 0, width, height))
+    tree.update_colours_and_depths()
+    grid = TileGrid(width, height, tile_size)
+    for rect, colour in tree.get_rectangles(extension_colour if by_extension
+                                            else None):
+        grid.add(rect, colour)
+    return grid
+
+
+def export_png(tree: TMTree, path: str, width: int, height: int,
+               tile_size: int = DEFAULT_TILE_SIZE,
+               workers: Optional[int] = None,
+               by_extension: bool = False) -> int:
+    """Renders the displayed rectangles of <tree>, laid out on a <width> by
+    <height> canvas, to the PNG file at <path>. The image is rasterised in
+    <tile_size> tiles by <workers> processes (by default, one per CPU).
+    Returns the number of tiles.
+
+    The image is the same as the one tm_report.render writes.
+    """
+    grid = layout(tree, width, height, tile_size, by_extension)
+    jobs = ((grid.tile_rect(row, column), grid.tile(row, column))
+            for row in range(grid.rows) for column in range(grid.columns))
+    # one band is being stitched while the next is rasterised
+    tiles = _run(_rasterise_tile, jobs, workers, 2 * grid.columns)
+    with open(path, 'wb') as out:
+        write_png(out, width, height, _stitch(grid, tiles))
+    return len(grid)
+
+
+def export_tiles(tree: TMTree, directory: str, width: int, height: int,
+                 tile_size: int = DEFAULT_TILE_SIZE,
+                 workers: Optional[int] = None,
+                 by_extension: bool = False) -> List[str]:
+    """Renders the displayed rectangles of <tree>, laid out on a <width> by
+    <height> canvas, as <tile_size> tiles, each written by one of <workers>
+    processes (by default, one per CPU) to its own PNG file in <directory>.
+    Returns the paths of the tiles, row by row.
+
+    Each tile is named after its row and column, e.g. 0_1.png is the second
+    tile of the top row.
+    """
+    grid = layout(tree, width, height, tile_size, by_extension)
+    os.makedirs(directory, exist_ok=True)
+    jobs = ((os.path.join(directory, f'{row}_{column}.png'),
+             grid.tile_rect(row, column), grid.tile(row, column))
+            for row in range(grid.rows) for column in range(grid.columns))
+    workers = workers or os.cpu_count() or 1
+    return list(_run(_write_tile, jobs, workers, 2 * workers))
+
+
+def _run(function: Callable, jobs: Iterator, workers: Optional[int],
+         window: int) -> Iterator:
+    """Yields <function> applied to each of <jobs>, in order, computed by
+    <workers> processes (by default, one per CPU) with at most <window> jobs
+    submitted but not yet yielded. With one worker, the jobs are run in this
+    process instead.
+    """
+    if workers == 1:
+        for job in jobs:
+            yield function(job)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(function, job))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _stitch(grid: TileGrid, tiles: Iterator[bytearray]) -> Iterator[bytes]:
+    """Yields the pixel rows of the image on <grid>, whose RGB <tiles> come
+    row by row. Only one band of tiles is held at a time.
+    """
+    for row in range(grid.rows):
+        band = [next(tiles) for _ in range(grid.columns)]
+        strides = [grid.tile_rect(row, column)[2] * 3
+                   for column in range(grid.columns)]
+        for line in range(grid.tile_rect(row, 0)[3]):
+            yield b''.join(tile[line * stride:(line + 1) * stride]
+                           for tile, stride in zip(band, strides))
+
+
+def _rasterise_tile(job: Tuple[Rect, List[Tuple[Rect, Colour]]]) \
+        -> bytearray:
+    """Returns the RGB pixels of the tile covering the rectangle in <job>,
+    filled with the rectangles in <job>.
+    """
+    (x, y, width, height), rects = job
+    return rasterise(rects, width, height, (x, y))
+
+
+def _write_tile(job: Tuple[str, Rect, List[Tuple[Rect, Colour]]]) -> str:
+    """Rasterises the tile in <job> (see _rasterise_tile) and writes it to
+    the PNG file at the path in <job>, which is returned.
+    """
+    path, tile_rect, rects = job
+    pixels = _rasterise_tile((tile_rect, rects))
+    stride = tile_rect[2] * 3
+    with open(path, 'wb') as out:
+        write_png(out, tile_rect[2], tile_rect[3],
+                  (bytes(pixels[i:i + stride])
+                   for i in range(0, len(pixels), stride)))
+    return path
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Runs the command-line interface and returns the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Scan a path and export a large treemap image in tiles.')
+    parser.add_argument('path', help='the file or folder to scan')
+    parser.add_argument('output', help='the .png file to write, or the '
+                                       'folder to write the tiles to')
+    parser.add_argument('--size', default='20000x20000',
+                        help='the size of the image, as WxH')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--tiles', action='store_true',
+                        help='write each tile to its own file')
+    parser.add_argument('--max-depth', type=int, default=None,
+                        help='only draw this many levels')
+    parser.add_argument('--colour-by-type', action='store_true',
+                        help='colour files by their extension class')
+    args = parser.parse_args(argv)
+
+    width, height = (int(n) for n in args.size.lower().split('x'))
+    tree = FileSystemTree(args.path)
+    expand_to_depth(tree, args.max_depth)
+    export = export_tiles if args.tiles else export_png
+    export(tree, args.output, width, height, args.tile_size, args.workers,
+           args.colour_by_type)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+Assignment 2: Undo Journal for Treemap Edits
+
+=== Module Description ===
+This module contains an undo/redo journal for the edits that the treemap
+visualiser makes to a TMTree (change size, delete, move, duplicate and
+copy/paste).
+
+Instead of snapshotting the tree, the journal records a compact, reversible
+delta for every structural change:
+    - (RESIZE, leaf, old_size, new_size)
+    - (DETACH, subtree, parent, index)
+    - (ATTACH, subtree, parent, index)
+A detached subtree is kept alive by its record, so undoing a delete simply
+re-attaches the same handle. Each record is undone or redone in O(depth)
+time, since only the sizes along one ancestor path change.
+
+The records of one user-level edit are grouped into a single undo step.
+The journal keeps at most <capacity> records; when that is exceeded, the
+oldest undo steps are evicted first.
+"""
+from __future__ import annotations
+
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from tm_trees import TMTree
+
+RESIZE = 0
+DETACH = 1
+ATTACH = 2
+
+Record = Tuple[int, TMTree, object, object]
+
+
+class EditJournal:
+    """An undo/redo journal for the edits made below a TMTree root.
+
+    === Public Attributes ===
+    capacity: The maximum number of records kept across all undo and redo
+    steps.
+
+    === Private Attributes ===
+    _root: The tree this journal observes.
+    _undo: The undo steps, oldest first. Each step is a list of records in
+    the order they were made.
+    _redo: The steps that were undone, most recently undone last.
+    _current: The step being recorded, or None if no edit is in progress.
+    _nesting: How many user-level edits are currently open.
+    _size: The number of records currently kept.
+    _replaying: Whether the journal is applying an undo or redo, in which
+    case the changes it makes are not recorded.
+
+    === Representation Invariants ===
+    - _size is the total number of records in _undo and _redo
+    - _size <= capacity, except while an edit is in progress
+    """
+    capacity: int
+    _root: TMTree
+    _undo: Deque[List[Record]]
+    _redo: List[List[Record]]
+    _current: Optional[List[Record]]
+    _nesting: int
+    _size: int
+    _replaying: bool
+
+    def __init__(self, root: TMTree, capacity: int = 100000) -> None:
+        """Initializes a journal recording the edits made below <root>.
+        """
+        self.capacity = capacity
+        self._root = root
+        self._undo = deque()
+        self._redo = []
+        self._current = None
+        self._nesting = 0
+        self._size = 0
+        self._replaying = False
+        root._add_observer(self)
+
+    def close(self) -> None:
+        """Stops recording edits and forgets the history.
+        """
+        self._root._remove_observer(self)
+        self._undo.clear()
+        self._redo.clear()
+        self._size = 0
+
+    def can_undo(self) -> bool:
+        """Returns whether there is an edit to undo.
+        """
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        """Returns whether there is an undone edit to redo.
+        """
+        return bool(self._redo)
+
+    def __len__(self) -> int:
+        """Returns the number of records kept by this journal.
+        """
+        return self._size
+
+    def undo(self) -> bool:
+        """Undoes the most recent edit and returns whether there was one.
+        """
+        if not self._undo:
+            return False
+        step = self._undo.pop()
+        self._replaying = True
+        try:
+            for record in reversed(step):
+                _apply(record, undo=True)
+        finally:
+            self._replaying = False
+        self._redo.append(step)
+        return True
+
+    def redo(self) -> bool:
+        """Redoes the most recently undone edit and returns whether there was
+        one.
+        """
+        if not self._redo:
+            return False
+        step = self._redo.pop()
+        self._replaying = True
+        try:
+            for record in step:
+                _apply(record, undo=False)
+        finally:
+            self._replaying = False
+        self._undo.append(step)
+        return True
+
+    # **************************************************************************
+    # ************* OBSERVER INTERFACE FOR TMTree ******************************
+    # **************************************************************************
+    def on_edit_begin(self) -> None:
+        """Starts a new undo step, unless one is already open.
+        """
+        if self._replaying:
+            return
+        if self._nesting == 0:
+            self._current = []
+        self._nesting += 1
+
+    def on_edit_end(self) -> None:
+        """Closes the current undo step once the outermost edit ends.
+        """
+        if self._replaying:
+            return
+        self._nesting -= 1
+        if self._nesting == 0:
+            step, self._current = self._current, None
+            if step:
+                self._commit(step)
+
+    def on_resize(self, tree: TMTree, old_size: int) -> None:
+        """Records that the size of <tree> changed from <old_size>.
+        """
+        self._record((RESIZE, tree, old_size, tree.data_size))
+
+    def on_detach(self, tree: TMTree, parent: TMTree, index: int) -> None:
+        """Records that <tree> was removed from position <index> of <parent>.
+        """
+        self._record((DETACH, tree, parent, index))
+
+    def on_attach(self, tree: TMTree, parent: TMTree,
+                  index: Optional[int]) -> None:
+        """Records that <tree> was inserted at position <index> of <parent>.
+        """
+        if index is None:
+            index = len(parent._subtrees) - 1
+        self._record((ATTACH, tree, parent, index))
+
+    def on_load(self, tree: TMTree) -> None:
+        """Does nothing; reading subtrees in is not an edit.
+        """
+
+    def on_unload(self, tree: TMTree) -> None:
+        """Does nothing; paging subtrees out is not an edit.
+        """
+
+    def on_display(self, tree: TMTree) -> None:
+        """Does nothing; expanding or collapsing trees is not an edit.
+        """
+
+    def _record(self, record: Record) -> None:
+        """Adds <record> to the current step, or makes it a step of its own if
+        the change happened outside of a user-level edit.
+        """
+        if self._replaying:
+            return
+        if self._current is not None:
+            self._current.append(record)
+        else:
+            self._commit([record])
+
+    def _commit(self, step: List[Record]) -> None:
+        """Pushes <step> onto the undo history, discarding the redo history
+        and evicting the oldest steps if the journal is over capacity.
+        """
+        for undone in self._redo:
+            self._size -= len(undone)
+        self._redo.clear()
+        self._undo.append(step)
+        self._size += len(step)
+        while self._size > self.capacity and len(self._undo) > 1:
+            self._size -= len(self._undo.popleft())
+
+
+def _apply(record: Record, undo: bool) -> None:
+    """Applies <record> to its tree, or reverts it if <undo> is True.
+    """
+    kind, tree, first, second = record
+    if kind == RESIZE:
+        tree._set_size(first if undo else second)
+    elif (kind == DETACH) == undo:  # put the subtree back
+        tree._attach(first, second)
+    else:
+        tree._detach()
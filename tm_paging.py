@@ -0,0 +1,326 @@
+"""
+Assignment 2: Paging Treemap Subtrees to Disk
+
+=== Module Description ===
+This module keeps the number of nodes of a large TMTree that are held in
+memory under a budget, by paging out the subtrees that are not being looked
+at to a spill file.
+
+A SubtreePager only pages out collapsed folders that are displayed as a
+single block (their parents are expanded), least recently touched first.
+Such a folder keeps its own node, with its data_size, rect, colour and
+other aggregates, so it is drawn and hit-tested as before; only the nodes
+below it are written to the spill file and dropped. They are read back in
+transparently, through the _subtrees property, as soon as anything needs
+them: expanding the folder, drawing it at a finer level of detail, editing
+inside it, or any walk over the whole tree.
+
+The nodes read back in are new objects equal to the ones that were paged
+out. A subtree that has been edited is never paged out, so the nodes an
+EditJournal refers to stay in the tree. Observers are told when subtrees are
+paged out and in (see TMTree._add_observer), so that e.g. a NameIndex drops
+its references to the nodes that are paged out. Trees read from a node
+table (see tm_shared, and tm_scan.scan_parallel), whose nodes are already
+read in lazily, should not be used with a pager.
+
+Nodes are counted as in TMTree._file_count and _folder_count, i.e. a summary
+leaf counts as the number of items it stands for. A folder that is paged
+out again, unedited since it was paged in, reuses the record it was read
+from, so the spill file only grows by subtrees that were not in it yet. It
+is deleted when the pager is closed.
+"""
+from __future__ import annotations
+
+import pickle
+import tempfile
+import weakref
+from typing import BinaryIO, List, Optional
+
+from tm_trees import TMTree
+
+# the attributes of a node that are not written to the spill file, because
+# they are restored from its position in the tree when it is read back in
+_POSITIONAL = ('_parent_tree', '_subtree_list', '_expanded',
+               '_expanded_subtrees', '_depth', 'rect', '_cow_dependents',
+               '_loader')
+
+
+class SubtreePager:
+    """Pages the collapsed subtrees of a tree out to a spill file, so that at
+    most about <budget> of its nodes are held in memory.
+
+    === Public Attributes ===
+    budget: The most nodes to keep in memory.
+
+    === Private Attributes ===
+    _root: The root of the tree this pager manages.
+    _file: The spill file.
+    _offloaded: The number of nodes of the tree that are paged out.
+    _clock: The number of touches so far.
+    _touched: The clock at which each folder was last touched.
+    _pinned: The trees that have been edited, which are never paged out.
+    _paged_out: The folders whose subtrees are paged out.
+    _records: The (offset, length) in the spill file of the record each
+    folder was last paged in from, for the folders not edited since.
+    _settled: Whether the last call to enforce could not page out enough,
+    and no subtrees have been read in, edited, expanded or collapsed since,
+    so that there is still nothing more to page out.
+    """
+    budget: int
+    _root: TMTree
+    _file: BinaryIO
+    _offloaded: int
+    _clock: int
+    _touched: weakref.WeakKeyDictionary
+    _pinned: weakref.WeakSet
+    _paged_out: weakref.WeakSet
+    _records: weakref.WeakKeyDictionary
+    _settled: bool
+
+    def __init__(self, root: TMTree, budget: int,
+                 path: Optional[str] = None) -> None:
+        """Manages the tree <root> with a budget of <budget> nodes, spilling
+        to a new file at <path> (by default, an anonymous temporary file).
+        """
+        self.budget = budget
+        self._root = root
+        self._file = open(path, 'w+b') if path is not None \
+            else tempfile.TemporaryFile()
+        self._offloaded = 0
+        self._clock = 0
+        self._touched = weakref.WeakKeyDictionary()
+        self._pinned = weakref.WeakSet()
+        self._paged_out = weakref.WeakSet()
+        self._records = weakref.WeakKeyDictionary()
+        self._settled = False
+        root._add_observer(self)
+
+    def close(self) -> None:
+        """Pages every subtree back in, stops managing the tree and deletes
+        the spill file.
+        """
+        while self._paged_out:  # paging in may restore paged out subtrees
+            next(iter(self._paged_out))._page_in()
+        self._root._remove_observer(self)
+        self._file.close()
+
+    def resident(self) -> int:
+        """Returns the number of nodes of the tree held in memory.
+        """
+        return _weight(self._root) - self._offloaded
+
+    def touch(self, tree: Optional[TMTree]) -> None:
+        """Records that <tree> (e.g. the selected or hovered tree) was just
+        used, so that it and its ancestors are paged out last.
+        """
+        self._clock += 1
+        while tree is not None:
+            self._touched[tree] = self._clock
+            tree = tree._parent_tree
+
+    def enforce(self) -> int:
+        """Pages out the least recently touched collapsed subtrees until the
+        tree is within budget, or nothing more can be paged out. Returns the
+        number of subtrees that were paged out.
+
+        The trees are only walked again once something has changed since the
+        last call that could not page out enough.
+        """
+        if self.resident() <= self.budget or self._settled:
+            return 0
+        blocked = set()
+        for tree in self._pinned:
+            while tree is not None and tree not in blocked:
+                blocked.add(tree)
+                tree = tree._parent_tree
+        candidates = [tree for tree in self._candidates()
+                      if tree not in blocked]
+        candidates.sort(key=lambda tree: self._touched.get(tree, 0))
+        paged = 0
+        for tree in candidates:
+            if self.resident() <= self.budget:
+                break
+            self.page_out(tree)
+            paged += 1
+        self._settled = self.resident() > self.budget
+        return paged
+
+    def _candidates(self) -> List[TMTree]:
+        """Returns the folders that can be paged out: the collapsed folders
+        with subtrees in memory whose parents are expanded, or are the root.
+        Only the expanded trees are visited.
+        """
+        candidates = []
+        stack = [self._root]
+        while stack:
+            tree = stack.pop()
+            for subtree in tree._subtrees:
+                if subtree._expanded:
+                    stack.append(subtree)
+                elif subtree._subtree_list:
+                    candidates.append(subtree)
+        return candidates
+
+    def page_out(self, folder: TMTree) -> None:
+        """Writes the nodes below <folder> to the spill file and drops them
+        from memory, keeping <folder> itself. If they have not been edited
+        since they were paged in, the record they were read from is reused.
+
+        Precondition: <folder> is collapsed and its subtrees are in memory.
+        """
+        record = self._records.get(folder)
+        records = []
+        offloaded = _weight(folder) - 1
+        stack = [folder]
+        while stack:
+            tree = stack.pop()
+            for subtree in tree._subtrees:
+                if subtree._loader is not None:  # already paged out
+                    offloaded -= _weight(subtree) - 1
+                else:
+                    stack.append(subtree)
+                if record is not None:
+                    continue
+                state = {key: value for key, value in subtree.__dict__.items()
+                         if key not in _POSITIONAL}
+                if subtree._loader is not None:
+                    records.append((subtree.__class__, state, -1,
+                                    subtree._loader[1:]))
+                else:
+                    records.append((subtree.__class__, state,
+                                    len(subtree._subtrees), None))
+        if record is None:
+            # each folder's subtrees are written together, in the order the
+            # folders are taken off the stack
+            data = pickle.dumps((len(folder._subtree_list), records),
+                                pickle.HIGHEST_PROTOCOL)
+            self._file.seek(0, 2)
+            record = (self._file.tell(), len(data))
+            self._file.write(data)
+        for observer in folder._get_observers():
+            observer.on_unload(folder)
+        folder._subtree_list = None
+        folder._loader = (self,) + record
+        self._paged_out.add(folder)
+        self._offloaded += offloaded
+
+    def page_in(self, folder: TMTree) -> None:
+        """Reads the nodes below the paged out <folder> back in from the spill
+        file, and lays them out in its rectangle. This is called by
+        TMTree._page_in, which then tells the tree's observers.
+        """
+        _, offset, length = folder._loader
+        self._file.seek(offset)
+        records = pickle.loads(self._file.read(length))
+        del folder._loader
+        self._records[folder] = (offset, length)
+        self._paged_out.discard(folder)
+        self._offloaded -= _weight(folder) - 1
+
+        # rebuild the folders in the order their subtrees were written
+        folder._subtree_list = []
+        count, records = records
+        stack = [(folder, count)]
+        position = 0
+        while stack:
+            parent, count = stack.pop()
+            for cls, state, subtree_count, spilled in \
+                    records[position:position + count]:
+                subtree = cls.__new__(cls)
+                subtree.__dict__.update(state)
+                subtree.rect = (0, 0, 0, 0)
+                subtree._parent_tree = parent
+                subtree._depth = parent._depth + 1
+                subtree._expanded = False
+                if spilled is not None:
+                    subtree._subtree_list = None
+                    subtree._loader = (self,) + spilled
+                    self._paged_out.add(subtree)
+                    self._offloaded += _weight(subtree) - 1
+                else:
+                    subtree._subtree_list = []
+                    if subtree_count:
+                        stack.append((subtree, subtree_count))
+                parent._subtree_list.append(subtree)
+            position += count
+        if folder.rect != (0, 0, 0, 0):
+            folder.update_rectangles(folder.rect)
+        self.touch(folder)
+
+    # **************************************************************************
+    # ************* OBSERVER INTERFACE FOR TMTree ******************************
+    # **************************************************************************
+    def on_edit_begin(self) -> None:
+        pass
+
+    def on_edit_end(self) -> None:
+        pass
+
+    def on_load(self, tree: TMTree) -> None:
+        """Notes that the subtrees of <tree> may now be paged out.
+        """
+        self._settled = False
+
+    def on_unload(self, tree: TMTree) -> None:
+        pass
+
+    def on_display(self, tree: TMTree) -> None:
+        """Notes that other folders may now be displayed as single blocks.
+        """
+        self._settled = False
+
+    def on_resize(self, tree: TMTree, old_size: int) -> None:
+        """Pins the resized <tree>.
+        """
+        self._pin(tree)
+
+    def on_detach(self, tree: TMTree, parent: TMTree, index: int) -> None:
+        """Pins <tree> and the <parent> it was removed from, and stops
+        counting the folders paged out in <tree>, which left the tree.
+        """
+        self._pin(tree)
+        self._pin(parent)
+        for folder in self._spilled(tree):
+            self._paged_out.discard(folder)
+            self._offloaded -= _weight(folder) - 1
+
+    def on_attach(self, tree: TMTree, parent: TMTree,
+                  index: Optional[int]) -> None:
+        """Pins <tree> and the <parent> it was inserted into, and counts the
+        folders paged out in <tree> (e.g. when its removal is undone).
+        """
+        self._pin(tree)
+        self._pin(parent)
+        for folder in self._spilled(tree):
+            self._paged_out.add(folder)
+            self._offloaded += _weight(folder) - 1
+
+    def _spilled(self, tree: TMTree) -> List[TMTree]:
+        """Returns the folders at or below <tree> whose subtrees are paged
+        out to this pager. Only the nodes in memory are visited.
+        """
+        spilled = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node._loader is not None and node._loader[0] is self:
+                spilled.append(node)
+            elif node._subtree_list:
+                stack.extend(node._subtree_list)
+        return spilled
+
+    def _pin(self, tree: TMTree) -> None:
+        """Pins the edited <tree>, and forgets the records of it and its
+        ancestors, which no longer match their subtrees.
+        """
+        self._pinned.add(tree)
+        self._settled = False
+        while tree is not None:
+            self._records.pop(tree, None)
+            tree = tree._parent_tree
+
+
+def _weight(tree: TMTree) -> int:
+    """Returns the number of nodes counted for <tree> and its descendants.
+    """
+    return tree._file_count + tree._folder_count
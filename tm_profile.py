@@ -0,0 +1,219 @@
+"""
+Assignment 2: Profiling Hooks for Treemap Trees
+
+=== Module Description ===
+This module contains a lightweight profiler for the hot paths of the treemap
+visualiser. It keeps counters (nodes visited, rectangles produced, draw calls
+issued) and a timing histogram for each phase (update_rectangles,
+update_data_sizes, get_rectangles, get_tree_at_position, render_display,
+...).
+
+The profiler costs nothing while it is disabled: enabling it replaces the
+TMTree methods listed in INSTRUMENTED with wrappers that count and time
+them, and disabling it puts the original methods back. Code outside of
+TMTree (like the visualiser) checks PROFILER.enabled once per phase before
+recording anything.
+
+Typical use:
+    PROFILER.enable()
+    ... run some tree operations ...
+    PROFILER.dump('profile.json')
+"""
+from __future__ import annotations
+
+import functools
+import json
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from tm_trees import TMTree
+
+# The TMTree methods that are wrapped while profiling. The recursive ones
+# count one visited node per call, and only their outermost call is timed.
+INSTRUMENTED = ('update_rectangles', 'get_rectangles', 'get_tree_at_position',
+                'get_lod_rectangles', 'get_lod_tree_at_position',
+                'update_data_sizes', 'update_colours_and_depths', 'expand',
+                'expand_all', 'collapse', 'collapse_all', 'change_size',
+                'move', 'delete_self', 'duplicate', 'copy_paste')
+
+# The methods whose results are the rectangles to draw
+_RENDERERS = ('get_rectangles', 'get_lod_rectangles')
+
+
+class Histogram:
+    """A histogram of durations, in buckets of powers of two microseconds.
+
+    === Public Attributes ===
+    count: The number of durations recorded.
+    total: The sum of the durations, in seconds.
+    last: The most recent duration, in seconds.
+    max: The longest duration, in seconds.
+    buckets: buckets[i] is the number of durations below 2**i microseconds
+    (and at least 2**(i-1) microseconds, for i > 0).
+    """
+    count: int
+    total: float
+    last: float
+    max: float
+    buckets: List[int]
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.buckets = []
+
+    def add(self, seconds: float) -> None:
+        """Records a duration of <seconds>.
+        """
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        if bucket >= len(self.buckets):
+            self.buckets.extend([0] * (bucket + 1 - len(self.buckets)))
+        self.buckets[bucket] += 1
+
+    def to_dict(self) -> Dict[str, object]:
+        """Returns this histogram as a JSON-compatible dictionary.
+        """
+        return {'count': self.count, 'total_s': self.total,
+                'mean_s': self.total / self.count if self.count else 0.0,
+                'last_s': self.last, 'max_s': self.max,
+                'buckets_us': {f'<{1 << i}': n
+                               for i, n in enumerate(self.buckets) if n}}
+
+
+class Profiler:
+    """Counters and timing histograms for the treemap's hot paths.
+
+    === Public Attributes ===
+    enabled: Whether the profiler is recording.
+    counters: The value of each counter, e.g. 'update_rectangles.nodes'.
+    timings: The timing histogram of each phase.
+
+    === Private Attributes ===
+    _originals: The TMTree methods replaced by wrappers while enabled.
+    """
+    enabled: bool
+    counters: Dict[str, int]
+    timings: Dict[str, Histogram]
+    _originals: Dict[str, Callable]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.counters = {}
+        self.timings = {}
+        self._originals = {}
+
+    def enable(self) -> None:
+        """Starts recording, instrumenting the TMTree methods.
+        """
+        if self.enabled:
+            return
+        for name in INSTRUMENTED:
+            self._originals[name] = TMTree.__dict__[name]
+            setattr(TMTree, name, self._wrap(name, self._originals[name]))
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stops recording and removes the instrumentation.
+        """
+        for name, method in self._originals.items():
+            setattr(TMTree, name, method)
+        self._originals.clear()
+        self.enabled = False
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far.
+        """
+        self.counters.clear()
+        self.timings.clear()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Adds <amount> to the counter <name>.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name: str, seconds: float) -> None:
+        """Records that the phase <name> took <seconds>.
+        """
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.add(seconds)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times the with-block as the phase <name>, if enabled.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def _wrap(self, name: str, method: Callable) -> Callable:
+        """Returns a wrapper of the TMTree <method> that counts every call as
+        a visited node and times the outermost calls.
+        """
+        nodes = name + '.nodes'
+        active = [0]
+
+        @functools.wraps(method)
+        def wrapper(tree: TMTree, *args, **kwargs):
+            self.counters[nodes] = self.counters.get(nodes, 0) + 1
+            if active[0]:
+                return method(tree, *args, **kwargs)
+            active[0] += 1
+            start = time.perf_counter()
+            try:
+                result = method(tree, *args, **kwargs)
+            finally:
+                active[0] -= 1
+                self.record(name, time.perf_counter() - start)
+            if name in _RENDERERS:
+                self.count('rects_produced', len(result))
+            return result
+        return wrapper
+
+    def snapshot(self) -> Dict[str, object]:
+        """Returns everything recorded so far as a JSON-compatible dictionary.
+        """
+        return {'counters': dict(sorted(self.counters.items())),
+                'timings': {name: histogram.to_dict() for name, histogram
+                            in sorted(self.timings.items())}}
+
+    def summary(self) -> List[str]:
+        """Returns one short line per phase (last and mean time) and per
+        counter, e.g. for an on-screen overlay.
+        """
+        lines = []
+        for name, histogram in sorted(self.timings.items()):
+            mean = histogram.total / histogram.count
+            lines.append(f'{name}: last {histogram.last * 1000:.2f}ms '
+                         f'mean {mean * 1000:.2f}ms n={histogram.count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{name}: {value}')
+        return lines
+
+    def dump(self, path: str, extra: Optional[Dict[str, object]] = None) -> None:
+        """Writes the snapshot (and <extra>, if given) to the JSON file at
+        <path>.
+        """
+        data = self.snapshot()
+        if extra:
+            data.update(extra)
+        with open(path, 'w') as out:
+            json.dump(data, out, indent=2)
+
+
+# The profiler used by the visualiser and the benchmarks.
+PROFILER = Profiler()
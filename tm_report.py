@@ -0,0 +1,214 @@
+"""
+Assignment 2: Headless Treemap Reports
+
+=== Module Description ===
+This module scans a path into a FileSystemTree without a display, and
+
+    - streams a report of the paths, sizes and item counts in the tree as
+      JSON Lines or CSV, optionally only down to a maximum depth
+    - renders the treemap (the output of TMTree.get_rectangles) to a PNG or
+      SVG file
+
+It does not import pygame, so it can run on servers and in cron jobs, e.g.:
+    python tm_report.py /var/log --max-depth 2 --format csv -o sizes.csv
+    python tm_report.py /var/log --render treemap.png --size 1920x1080
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import struct
+import sys
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from tm_trees import TMTree, FileSystemTree, ScanOptions, expand_to_depth, \
+    extension_colour
+
+Rect = Tuple[int, int, int, int]
+Colour = Tuple[int, int, int]
+
+REPORT_FIELDS = ('path', 'type', 'depth', 'size', 'items')
+
+
+def iter_report(tree: TMTree,
+                max_depth: Optional[int] = None) -> Iterator[Dict[str, object]]:
+    """Yields one report row for <tree> and each of its descendants, in
+    pre-order, down to <max_depth> levels below <tree> (or all of them).
+    """
+    separator = tree.get_separator()
+    stack = [(tree, tree.get_full_path(), 0)]
+    while stack:
+        node, path, depth = stack.pop()
+        is_folder = bool(node._subtrees)
+        kind = 'summary' if node.is_summary() else \
+            'folder' if is_folder else 'file'
+        yield {'path': path, 'type': kind,
+               'depth': depth, 'size': node.data_size,
+               'items': len(node._subtrees)}
+        if is_folder and (max_depth is None or depth < max_depth):
+            for subtree in reversed(node._subtrees):
+                stack.append((subtree, path + separator + subtree._name,
+                              depth + 1))
+
+
+def write_report(tree: TMTree, out: TextIO, fmt: str = 'jsonl',
+                 max_depth: Optional[int] = None) -> int:
+    """Writes the report for <tree> to <out> in the format <fmt> ('jsonl' or
+    'csv') and returns the number of rows written.
+    """
+    rows = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for row in iter_report(tree, max_depth):
+            writer.writerow(row)
+            rows += 1
+    else:
+        for row in iter_report(tree, max_depth):
+            out.write(json.dumps(row) + '\n')
+            rows += 1
+    return rows
+
+
+# ******************************************************************************
+# ************* RENDERING ******************************************************
+# ******************************************************************************
+
+def rasterise(rects: List[Tuple[Rect, Colour]], width: int, height: int,
+              origin: Tuple[int, int] = (0, 0)) -> bytearray:
+    """Returns the RGB pixels of a <width> by <height> image, whose top-left
+    corner is at <origin>, filled with <rects> in order.
+    """
+    pixels = bytearray(width * height * 3)
+    ox, oy = origin
+    for (x, y, w, h), colour in rects:
+        left, right = max(x - ox, 0), min(x + w - ox, width)
+        top, bottom = max(y - oy, 0), min(y + h - oy, height)
+        if left >= right or top >= bottom:
+            continue
+        run = bytes(colour) * (right - left)
+        for row in range(top, bottom):
+            start = (row * width + left) * 3
+            pixels[start:start + len(run)] = run
+    return pixels
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    """Returns a PNG chunk of type <kind> holding <data>.
+    """
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def write_png(out: BinaryIO, width: int, height: int,
+              rows: Iterator[bytes]) -> None:
+    """Writes an 8-bit RGB PNG to <out>, whose pixel rows are produced by
+    <rows>. The rows are compressed as they arrive, so the whole image never
+    has to be in memory at once.
+    """
+    out.write(b'\x89PNG\r\n\x1a\n')
+    out.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                              8, 2, 0, 0, 0)))
+    compressor = zlib.compressobj(6)
+    for row in rows:
+        data = compressor.compress(b'\x00' + row)
+        if data:
+            out.write(_png_chunk(b'IDAT', data))
+    out.write(_png_chunk(b'IDAT', compressor.flush()))
+    out.write(_png_chunk(b'IEND', b''))
+
+
+def write_svg(out: TextIO, width: int, height: int,
+              rects: List[Tuple[Rect, Colour]]) -> None:
+    """Writes an SVG image of <rects> on a <width> by <height> canvas to
+    <out>.
+    """
+    out.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+              f'height="{height}" shape-rendering="crispEdges">\n')
+    out.write(f'<rect width="{width}" height="{height}" fill="black"/>\n')
+    for (x, y, w, h), (r, g, b) in rects:
+        if w > 0 and h > 0:
+            out.write(f'<rect x="{x}" y="{y}" width="{w}" height="{h}" '
+                      f'fill="#{r:02x}{g:02x}{b:02x}"/>\n')
+    out.write('</svg>\n')
+
+
+def render(tree: TMTree, path: str, width: int, height: int,
+           by_extension: bool = False) -> None:
+    """Lays out <tree> on a <width> by <height> canvas and renders its
+    displayed rectangles to the PNG or SVG file at <path>.
+    """
+    tree.update_rectangles((0, 0, width, height))
+    tree.update_colours_and_depths()
+    rects = tree.get_rectangles(extension_colour if by_extension else None)
+    if path.lower().endswith('.svg'):
+        with open(path, 'w') as out:
+            write_svg(out, width, height, rects)
+    else:
+        pixels = rasterise(rects, width, height)
+        stride = width * 3
+        with open(path, 'wb') as out:
+            write_png(out, width, height,
+                      (bytes(pixels[i:i + stride])
+                       for i in range(0, len(pixels), stride)))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Runs the command-line interface and returns the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Scan a path and report its sizes without a display.')
+    parser.add_argument('path', help='the file or folder to scan')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl',
+                        help='the format of the size report')
+    parser.add_argument('-o', '--output', default='-',
+                        help='where to write the report (default: stdout)')
+    parser.add_argument('--max-depth', type=int, default=None,
+                        help='only report (and render) this many levels')
+    parser.add_argument('--no-report', action='store_true',
+                        help='do not write the size report')
+    parser.add_argument('--render', metavar='FILE',
+                        help='render the treemap to a .png or .svg file')
+    parser.add_argument('--size', default='1200x670',
+                        help='the size of the rendered image, as WxH')
+    parser.add_argument('--colour-by-type', action='store_true',
+                        help='colour files by their extension class')
+    parser.add_argument('--symlinks', choices=('skip', 'link', 'follow'),
+                        default='link')
+    parser.add_argument('--one-file-system', action='store_true',
+                        help='do not scan folders on other mount points')
+    parser.add_argument('--allocated', action='store_true',
+                        help='count allocated disk space, not apparent size')
+    parser.add_argument('--count-hard-links', action='store_true',
+                        help='count every hard link to a file')
+    parser.add_argument('--scan-depth', type=int, default=None,
+                        help='summarise everything deeper than this in one '
+                             'leaf per folder')
+    parser.add_argument('--min-size', type=int, default=0,
+                        help='summarise the files smaller than this many '
+                             'bytes in one leaf per folder')
+    args = parser.parse_args(argv)
+
+    options = ScanOptions(args.symlinks, not args.one_file_system,
+                          args.allocated, not args.count_hard_links,
+                          args.scan_depth, args.min_size)
+    tree = FileSystemTree(args.path, options)
+
+    if not args.no_report:
+        if args.output == '-':
+            write_report(tree, sys.stdout, args.format, args.max_depth)
+        else:
+            with open(args.output, 'w', newline='') as out:
+                write_report(tree, out, args.format, args.max_depth)
+
+    if args.render:
+        width, height = (int(n) for n in args.size.lower().split('x'))
+        expand_to_depth(tree, args.max_depth)
+        render(tree, args.render, width, height, args.colour_by_type)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
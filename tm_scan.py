@@ -0,0 +1,705 @@
+"""
+Assignment 2: Parallel Scanning for FileSystemTree
+
+=== Module Description ===
+This module contains alternative ways of scanning a path into a
+FileSystemTree, for very large or slow (e.g. network) file systems.
+
+scan_parallel partitions the top-level folders of the scanned path across a
+pool of worker processes, so the Python-side node construction is not
+limited by the GIL. Each worker scans its folders with the usual
+FileSystemTree rules and sends back its subtree packed into a node table
+(see tm_shared). The parent process does not rebuild the nodes: it only
+makes the node of each top-level folder, whose subtrees are read from the
+table when they are first needed, so its share of the work stays small
+however many nodes the workers scanned.
+
+AsyncScan scans from asyncio code: folders are listed with os.scandir in a
+thread pool, a bounded number at a time, and each folder is yielded as soon
+as its listing has been added to the tree. The tree can be queried (its
+sizes are always the totals found so far) while the scan runs.
+
+EstimatedScan gives a first tree almost immediately, by looking up the sizes
+of only a random sample of the files in each large folder and extrapolating
+the rest with confidence bounds. The estimates are then replaced with exact
+sizes by a refinement in a background thread, re-laying out only the
+folders whose sizes changed materially.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import queue
+import random
+import stat
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from tm_trees import (TMTree, FileSystemTree, ScanOptions, ESTIMATE_Z,
+                      _ScanState)
+from tm_shared import pack_tree, read_table
+
+def _scan_partition(args: tuple) -> Tuple[bytearray, Dict[str, int], list]:
+    """Scans one top-level folder in a worker process and returns it packed
+    into a node table, with its sizes by extension and the hard-linked files
+    it counted.
+    """
+    path, st, options, root_device = args
+    state = _ScanState(options, root_device)
+    state.linked_files = []
+    tree = FileSystemTree.__new__(FileSystemTree)
+    tree._scan(path, st, state, 1)
+    return pack_tree(tree), tree._get_extension_sizes(), state.linked_files
+
+
+def scan_parallel(path: str, options: Optional[ScanOptions] = None,
+                  workers: Optional[int] = None) -> FileSystemTree:
+    """Returns the FileSystemTree of <path>, scanned with <options> by
+    <workers> processes (by default, one per CPU), each scanning some of the
+    top-level folders of <path>.
+
+    Hard links between folders scanned by different workers are still only
+    counted once; a folder reached through symbolic links from two
+    different top-level folders may be scanned twice.
+
+    The nodes below the top-level folders are read from the tables the
+    workers sent back when they are first needed (see tm_shared), so the
+    tree should not be used with a pager.
+    """
+    if options is None:
+        options = ScanOptions()
+    st = os.stat(path)
+    if not stat.S_ISDIR(st.st_mode) or options.max_depth == 0:
+        return FileSystemTree(path, options)  # nothing to split up
+
+    state = _ScanState(options, st.st_dev)
+    state.linked_files = []
+    state.enter_folder(st)
+    slots = []  # the subtrees in scan order, or the index of a partition
+    partitions = []
+    small_count = small_size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            entry_st = state.stat_entry(entry)
+            if entry_st is None:
+                continue
+            if stat.S_ISDIR(entry_st.st_mode):
+                slots.append(len(partitions))
+                partitions.append((entry.path, entry_st, options, st.st_dev))
+                continue
+            size = state.file_size(entry_st)
+            if size < options.min_size:
+                small_count += 1
+                small_size += size
+            else:
+                state.record_link(entry_st, entry.path, size)
+                slots.append(FileSystemTree._make_leaf(
+                    entry.path, entry.name, size, entry_st.st_mtime))
+
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(_scan_partition, partitions, chunksize=1))
+
+    trees = []
+    for table, extension_sizes, _ in results:
+        tree = read_table(table).root()
+        tree._extension_sizes = extension_sizes  # not totalled again
+        trees.append(tree)
+    subtrees = [trees[slot] if isinstance(slot, int) else slot
+                for slot in slots]
+    if small_count:
+        subtrees.append(FileSystemTree._make_summary(path, small_count,
+                                                     small_size, 'smaller'))
+    root = FileSystemTree._make_folder(path, os.path.basename(path), subtrees)
+    root._mtime = max([st.st_mtime] + [subtree._mtime for subtree in subtrees
+                                       if subtree._mtime is not None])
+
+    if options.dedupe_hard_links:
+        seen = {key for key, _ in state.linked_files}
+        for tree, (_, _, linked_files) in zip(trees, results):
+            for key, file_path in linked_files:
+                if key in seen:  # already counted by an earlier partition
+                    leaf = _find_path(tree, file_path)
+                    if leaf is not None:
+                        leaf._set_size(0)
+                else:
+                    seen.add(key)
+    return root
+
+
+def _find_path(tree: FileSystemTree, path: str) -> Optional[TMTree]:
+    """Returns the node of <tree> for the file at <path>, or None.
+    """
+    node = tree
+    for name in os.path.relpath(path, tree.get_full_path()).split(os.sep):
+        node = next((subtree for subtree in node._subtrees
+                     if subtree._name == name), None)
+        if node is None:
+            return None
+    return node
+
+
+# ******************************************************************************
+# ************* ASYNCIO SCANNING ***********************************************
+# ******************************************************************************
+
+def _list_folder(state: _ScanState, path: str) -> List[tuple]:
+    """Returns the (path, name, stat result) of the entries of the folder at
+    <path> that are part of the scan. This only reads <state>'s options, so
+    it is safe to run in several threads at once.
+    """
+    listing = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                entry_st = state.stat_entry(entry)
+                if entry_st is not None:
+                    listing.append((entry.path, entry.name, entry_st))
+    except OSError:  # e.g. no permission to list the folder
+        pass
+    return listing
+
+
+class AsyncScan:
+    """A scan of a path into a FileSystemTree that runs on an asyncio loop.
+
+    Iterating over the scan (async for folder in scan) runs it, and yields
+    each folder once its entries have been added to the tree. The results
+    wait in a queue of at most <max_pending> folders; when the consumer
+    falls behind, the scan pauses until it catches up. Leaving the loop
+    early, or cancelling the task iterating over it, stops the scan.
+
+    === Public Attributes ===
+    tree: The root of the tree being built. It is a complete, consistent
+    TMTree at all times, containing what has been scanned so far.
+    done: Whether the whole path has been scanned.
+
+    === Private Attributes ===
+    _state: The state shared by the whole scan.
+    _concurrency: The most folders listed at the same time.
+    _max_pending: The most scanned folders waiting to be consumed.
+    _lock: Held while _state is read or updated, by the event loop and by
+    the worker threads measuring folders beyond the depth limit, so that
+    hard links and folders are only counted once.
+    _root_st: The stat result of the scanned folder, or None if the path is
+    not a folder to scan (in which case tree is already complete).
+    _stopped: Set when the scan is stopped, so that the worker threads
+    measuring folders stop too.
+    """
+    tree: FileSystemTree
+    done: bool
+    _state: _ScanState
+    _concurrency: int
+    _max_pending: int
+    _lock: threading.Lock
+    _root_st: Optional[os.stat_result]
+    _stopped: threading.Event
+
+    def __init__(self, path: str, options: Optional[ScanOptions] = None,
+                 concurrency: int = 8, max_pending: int = 64) -> None:
+        """Prepares a scan of <path> with <options>, listing at most
+        <concurrency> folders at a time.
+        """
+        if options is None:
+            options = ScanOptions()
+        st = os.stat(path)
+        self._state = _ScanState(options, st.st_dev)
+        self._concurrency = concurrency
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.done = False
+        if stat.S_ISDIR(st.st_mode) and self._state.enter_folder(st):
+            self.tree = FileSystemTree._make_folder(
+                path, os.path.basename(path), [])
+            self._root_st = st
+        else:
+            self.tree = FileSystemTree(path, options)
+            self._root_st = None
+
+    def __aiter__(self) -> AsyncIterator[FileSystemTree]:
+        return self._run()
+
+    async def wait(self) -> FileSystemTree:
+        """Runs the scan to the end and returns the finished tree.
+        """
+        async for _ in self:
+            pass
+        return self.tree
+
+    async def _run(self) -> AsyncIterator[FileSystemTree]:
+        """Runs the scan, yielding each folder as it is completed.
+        """
+        if self._root_st is None:
+            self.done = True
+            return
+        loop = asyncio.get_running_loop()
+        work = asyncio.Queue()
+        results = asyncio.Queue(self._max_pending)
+        executor = ThreadPoolExecutor(self._concurrency)
+        work.put_nowait((self.tree, self.tree.get_full_path(), 0,
+                         self._root_st.st_mtime))
+
+        async def worker() -> None:
+            while True:
+                folder, path, depth, mtime = await work.get()
+                try:
+                    await self._scan_folder(loop, executor, work, folder,
+                                            path, depth, mtime)
+                    await results.put(folder)
+                finally:
+                    work.task_done()
+
+        async def finish() -> None:
+            await work.join()
+            await results.put(None)
+
+        tasks = [asyncio.ensure_future(worker())
+                 for _ in range(self._concurrency)]
+        tasks.append(asyncio.ensure_future(finish()))
+        try:
+            while True:
+                folder = await results.get()
+                if folder is None:
+                    self.done = True
+                    return
+                yield folder
+        finally:
+            self._stopped.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            executor.shutdown(wait=False)
+
+    async def _scan_folder(self, loop: asyncio.AbstractEventLoop,
+                           executor: ThreadPoolExecutor, work: asyncio.Queue,
+                           folder: FileSystemTree, path: str,
+                           depth: int, mtime: float) -> None:
+        """Lists the folder at <path>, modified at <mtime>, in the thread pool
+        and adds its entries to the placeholder node <folder>, queueing its
+        subfolders.
+
+        The modification time of <folder> and its ancestors is raised to the
+        newest of its entries, so that it covers everything scanned inside
+        them once the scan is done, as in a serial scan.
+        """
+        state = self._state
+        max_depth = state.options.max_depth
+        if max_depth is not None and depth >= max_depth:
+            size, count = await loop.run_in_executor(executor, self._measure,
+                                                     path)
+            if count:
+                folder._attach_all([FileSystemTree._make_summary(
+                    path, count, size, 'deeper')])
+            return
+
+        listing = await loop.run_in_executor(executor, _list_folder, state,
+                                             path)
+        subtrees = []
+        subfolders = []
+        small_count = small_size = 0
+        with self._lock:  # held for one listing only, not a whole walk
+            for entry_path, name, entry_st in listing:
+                if stat.S_ISDIR(entry_st.st_mode):
+                    subfolder = FileSystemTree._make_folder(entry_path, name,
+                                                            [])
+                    if state.enter_folder(entry_st):
+                        subfolders.append((subfolder, entry_path, depth + 1,
+                                           entry_st.st_mtime))
+                    else:  # not scanned, but still a folder
+                        subfolder._mtime = entry_st.st_mtime
+                    subtrees.append(subfolder)
+                    continue
+                size = state.file_size(entry_st)
+                if size < state.options.min_size:
+                    small_count += 1
+                    small_size += size
+                else:
+                    subtrees.append(FileSystemTree._make_leaf(
+                        entry_path, name, size, entry_st.st_mtime))
+        if small_count:
+            subtrees.append(FileSystemTree._make_summary(
+                path, small_count, small_size, 'smaller'))
+        folder._attach_all(subtrees)
+        mtime = max([mtime] + [subtree._mtime for subtree in subtrees
+                               if subtree._mtime is not None])
+        tree = folder
+        while tree is not None and (tree._mtime is None
+                                    or tree._mtime < mtime):
+            tree._mtime = mtime
+            tree = tree._parent_tree
+        for item in subfolders:
+            work.put_nowait(item)
+
+    def _measure(self, path: str) -> Tuple[int, int]:
+        """Returns the size and number of entries below <path> (see
+        _ScanState.measure), from a worker thread. Folders are listed
+        without the lock, which is only held while their entries are
+        counted, so the event loop never waits for a whole walk. Stops early
+        if the scan is stopped.
+        """
+        state = self._state
+        size = count = 0
+        stack = [path]
+        while stack:
+            listing = _list_folder(state, stack.pop())
+            with self._lock:
+                for entry_path, _, entry_st in listing:
+                    if self._stopped.is_set():
+                        return size, count
+                    count += 1
+                    if not stat.S_ISDIR(entry_st.st_mode):
+                        size += state.file_size(entry_st)
+                    elif state.enter_folder(entry_st):
+                        stack.append(entry_path)
+        return size, count
+
+
+# ******************************************************************************
+# ************* SAMPLED ESTIMATES **********************************************
+# ******************************************************************************
+
+def _list_files(state: _ScanState, path: str) -> List[TMTree]:
+    """Returns the leaves, as a scan would make them, for the files (but not
+    the folders) in the folder at <path>.
+    """
+    return _make_files(state, path, _list_folder(state, path))
+
+
+def _make_files(state: _ScanState, path: str,
+                listing: List[tuple]) -> List[TMTree]:
+    """Returns the leaves, as a scan would make them, for the files (but not
+    the folders) in <listing>, the (path, name, stat result) of entries of
+    the folder at <path>.
+    """
+    subtrees = []
+    small_count = small_size = 0
+    for entry_path, name, entry_st in listing:
+        if stat.S_ISDIR(entry_st.st_mode):
+            continue
+        size = state.file_size(entry_st)
+        if size < state.options.min_size:
+            small_count += 1
+            small_size += size
+        else:
+            state.record_link(entry_st, entry_path, size)
+            subtrees.append(FileSystemTree._make_leaf(entry_path, name, size,
+                                                      entry_st.st_mtime))
+    if small_count:
+        subtrees.append(FileSystemTree._make_summary(path, small_count,
+                                                     small_size, 'smaller'))
+    return subtrees
+
+
+def size_bounds(tree: FileSystemTree) -> Tuple[int, int]:
+    """Returns the 95% confidence bounds of the size of <tree>, which are
+    both its data_size if it is exact.
+    """
+    margin = ESTIMATE_Z * math.sqrt(tree._size_variance)
+    return max(0, math.floor(tree.data_size - margin)), \
+        math.ceil(tree.data_size + margin)
+
+
+class EstimatedScan:
+    """A quick scan of a path into a FileSystemTree whose sizes are
+    estimated, followed by a refinement that makes them exact.
+
+    The quick scan lists every folder but looks up the sizes of at most
+    <sample> files in each. The files of a folder with more files than that
+    are shown as one '(N estimated items)' summary leaf, whose size is
+    extrapolated from a random sample, with its variance stored in
+    _size_variance (folders hold the total variance of the estimates in
+    them, see size_bounds, which the scan keeps up to date as the tree is
+    edited, as an observer of it). Folders beyond ScanOptions.max_depth are
+    measured exactly, as in a normal scan.
+
+    The refinement lists the files of the estimated folders again, largest
+    variance first, in a background thread started by start(). Its results
+    are only added to the tree by apply(), on the thread that owns the tree,
+    which replaces each estimate with the folder's leaves and re-lays out
+    as little of the treemap as possible.
+
+    === Public Attributes ===
+    tree: The root of the scanned tree.
+    done: Whether every estimate has been replaced.
+
+    === Private Attributes ===
+    _state: The state shared by the whole scan. Only the refinement uses it
+    once the quick scan is over.
+    _pending: The (folder, estimate leaf) pairs to refine, in order.
+    _results: The refined (folder, estimate leaf, leaves) triples waiting to
+    be applied, followed by None once the refinement is over.
+    _thread: The thread refining the estimates, or None if it has not been
+    started.
+    _stopped: Set to stop the refinement early.
+    _laid_out: The size each folder had when its rectangle was last laid
+    out, for the folders whose sizes have changed since.
+    """
+    tree: FileSystemTree
+    done: bool
+    _state: _ScanState
+    _pending: List[Tuple[FileSystemTree, FileSystemTree]]
+    _results: queue.Queue
+    _thread: Optional[threading.Thread]
+    _stopped: threading.Event
+    _laid_out: Dict[TMTree, int]
+
+    def __init__(self, path: str, options: Optional[ScanOptions] = None,
+                 sample: int = 32, seed: Optional[int] = None) -> None:
+        """Scans <path> with <options>, looking up the sizes of at most
+        <sample> files per folder, chosen at random from <seed>.
+
+        Precondition: sample >= 2
+        """
+        if options is None:
+            options = ScanOptions()
+        st = os.stat(path)
+        self._state = _ScanState(options, st.st_dev)
+        self._pending = []
+        self._results = queue.Queue()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._laid_out = {}
+        if stat.S_ISDIR(st.st_mode) and self._state.enter_folder(st):
+            self.tree = self._estimate(path, 0, sample, random.Random(seed))
+        else:
+            self.tree = FileSystemTree(path, options)
+        self._pending.sort(key=lambda pair: pair[1]._size_variance,
+                           reverse=True)
+        self.done = not self._pending
+        self.tree._add_observer(self)
+
+    def _estimate(self, path: str, depth: int, sample: int,
+                  rng: random.Random) -> FileSystemTree:
+        """Returns the tree of the folder at <path>, <depth> levels below the
+        scanned path, with the sizes of its files estimated from <sample> of
+        them if it has more.
+        """
+        state = self._state
+        name = os.path.basename(path)
+        max_depth = state.options.max_depth
+        if max_depth is not None and depth >= max_depth:
+            size, count = state.measure(path)
+            return FileSystemTree._make_folder(path, name, [
+                FileSystemTree._make_summary(path, count, size, 'deeper')]
+                if count else [])
+
+        subtrees = []
+        files = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    # the type of an entry is known without a stat, except
+                    # for a link, which may be followed
+                    if not entry.is_symlink() \
+                            and not entry.is_dir(follow_symlinks=False):
+                        files.append(entry)
+                        continue
+                    entry_st = state.stat_entry(entry)
+                    if entry_st is None:
+                        continue
+                    if not stat.S_ISDIR(entry_st.st_mode):
+                        files.append(entry)
+                    elif state.enter_folder(entry_st):
+                        subtrees.append(self._estimate(entry.path, depth + 1,
+                                                       sample, rng))
+                    else:  # not scanned, but still a folder
+                        subtrees.append(FileSystemTree._make_folder(
+                            entry.path, entry.name, []))
+        except OSError:  # e.g. no permission to list the folder
+            pass
+
+        estimate = None
+        if len(files) <= sample:
+            # every file is measured, from the entries already listed (a
+            # DirEntry keeps the result of its stat)
+            listing = []
+            for entry in files:
+                entry_st = state.stat_entry(entry)
+                if entry_st is not None:
+                    listing.append((entry.path, entry.name, entry_st))
+            subtrees.extend(_make_files(state, path, listing))
+        else:
+            sizes = [state.stored_size(entry_st) for entry_st in
+                     (state.stat_entry(entry)
+                      for entry in rng.sample(files, sample))
+                     if entry_st is not None]
+            if sizes:
+                estimate = _make_estimate(path, sizes, len(files))
+                subtrees.append(estimate)
+        folder = FileSystemTree._make_folder(path, name, subtrees)
+        folder._size_variance = sum(subtree._size_variance
+                                    for subtree in subtrees)
+        if estimate is not None:
+            self._pending.append((folder, estimate))
+        return folder
+
+    def start(self) -> None:
+        """Starts refining the estimates in a background thread.
+        """
+        if self._thread is None and not self.done:
+            self._thread = threading.Thread(target=self._refine, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the refinement, leaving the estimates that are left.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self, threshold: float = 0.05) -> List[TMTree]:
+        """Refines every estimate (in this thread, if start() was not called),
+        applies them all and returns the trees that were re-laid out.
+        """
+        if self._thread is None:
+            self._refine()
+        else:
+            self._thread.join()
+        return self.apply(threshold)
+
+    def _refine(self) -> None:
+        """Lists the files of each estimated folder, and queues them to
+        replace its estimate.
+        """
+        for folder, estimate in self._pending:
+            if self._stopped.is_set():
+                return
+            self._results.put((folder, estimate,
+                               _list_files(self._state, estimate._path)))
+        self._results.put(None)
+
+    def apply(self, threshold: float = 0.05,
+              limit: Optional[int] = None) -> List[TMTree]:
+        """Replaces the estimates refined so far (or the first <limit> of
+        them) with the leaves of their folders, and returns the trees that
+        were re-laid out, none inside another.
+
+        Each refined folder is re-laid out within its current rectangle. When
+        the size of a folder has changed by more than <threshold> (a
+        fraction of its size) since it was laid out, its parent is re-laid
+        out instead, so that it gets a rectangle of the right size.
+        """
+        targets = []
+        applied = 0
+        while limit is None or applied < limit:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if result is None:
+                self.done = True
+                break
+            applied += 1
+            folder, estimate, leaves = result
+            if estimate._parent_tree is not folder \
+                    or not _is_within(folder, {self.tree}):
+                # deleted or moved: its variance went with it (see on_detach)
+                continue
+            tree = folder
+            while tree is not None:
+                self._laid_out.setdefault(tree, tree.data_size)
+                tree = tree._parent_tree
+            with folder._edit():
+                estimate._detach()  # which removes its variance
+                folder._attach_all(leaves)
+            targets.append(self._layout_target(folder, threshold))
+
+        target_set = set(targets)
+        relaid = [target for target in dict.fromkeys(targets)
+                  if not _is_within(target._parent_tree, target_set)]
+        for target in relaid:
+            target.update_rectangles(target.rect)
+        for tree in list(self._laid_out):
+            if _is_within(tree, target_set):
+                del self._laid_out[tree]
+        return relaid
+
+    def _layout_target(self, folder: TMTree, threshold: float) -> TMTree:
+        """Returns the tree to re-lay out after the size of <folder> changed:
+        the parent of its highest ancestor whose size changed materially, or
+        <folder> itself if none did.
+        """
+        target = folder
+        tree = folder
+        while tree is not None:
+            laid_out = self._laid_out[tree]
+            if abs(tree.data_size - laid_out) > threshold * laid_out:
+                target = tree._parent_tree or tree
+            tree = tree._parent_tree
+        return target
+
+    # **************************************************************************
+    # ************* OBSERVER INTERFACE FOR TMTree ******************************
+    # **************************************************************************
+    def on_edit_begin(self) -> None:
+        pass
+
+    def on_edit_end(self) -> None:
+        pass
+
+    def on_load(self, tree: TMTree) -> None:
+        pass
+
+    def on_unload(self, tree: TMTree) -> None:
+        pass
+
+    def on_display(self, tree: TMTree) -> None:
+        pass
+
+    def on_resize(self, tree: TMTree, old_size: int) -> None:
+        pass
+
+    def on_detach(self, tree: TMTree, parent: TMTree, index: int) -> None:
+        """Removes the variance of the estimates in <tree> from the <parent>
+        it was removed from and its ancestors.
+        """
+        _add_variance(parent, -tree._size_variance)
+
+    def on_attach(self, tree: TMTree, parent: TMTree,
+                  index: Optional[int]) -> None:
+        """Adds the variance of the estimates in <tree> to the <parent> it
+        was inserted into and its ancestors.
+        """
+        _add_variance(parent, tree._size_variance)
+
+
+def _add_variance(tree: Optional[TMTree], variance: int) -> None:
+    """Adds <variance> to the _size_variance of <tree> and its ancestors.
+    """
+    if not variance:
+        return
+    while tree is not None:
+        tree._size_variance += variance
+        tree = tree._parent_tree
+
+
+def _make_estimate(path: str, sizes: List[int],
+                   count: int) -> FileSystemTree:
+    """Returns a summary leaf for the <count> files of the folder at <path>,
+    whose size is estimated from the sizes of the random sample <sizes>.
+
+    The estimate is count times the mean of the sample, and its variance
+    is that of the mean of a sample drawn without replacement.
+    """
+    n = len(sizes)
+    mean = sum(sizes) / n
+    variance = 0
+    if n > 1:
+        spread = sum((size - mean) ** 2 for size in sizes) / (n - 1)
+        variance = round(count * count * (1 - n / count) * spread / n)
+    leaf = FileSystemTree._make_summary(path, count, round(mean * count),
+                                        'estimated')
+    leaf._size_variance = variance
+    return leaf
+
+
+def _is_within(tree: Optional[TMTree], trees: Set[TMTree]) -> bool:
+    """Returns whether <tree> or one of its ancestors is in <trees>.
+    """
+    while tree is not None:
+        if tree in trees:
+            return True
+        tree = tree._parent_tree
+    return False
@@ -0,0 +1,263 @@
+"""
+Assignment 2: Name Search for Treemap Trees
+
+=== Module Description ===
+This module contains a search index over the names of the nodes in a TMTree.
+It answers exact name, substring, extension and glob queries without walking
+the tree:
+    - every distinct (lower-case) name maps to the nodes with that name
+    - every extension maps to the distinct names with that extension
+    - every trigram (run of 3 characters) maps to the distinct names that
+      contain it, so a substring or glob query only checks the names that
+      contain all of its trigrams
+
+The index observes the tree's edits (see TMTree._add_observer), so it stays
+up to date as subtrees are moved, deleted, duplicated or restored by undo.
+
+Only the nodes in memory are indexed: the index does not descend into a
+pending copy-on-write clone or a paged out subtree, which would read it in.
+Their descendants are indexed when they are read in, and removed again when
+they are paged out, so the index never keeps dropped nodes alive.
+"""
+from __future__ import annotations
+
+import re
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from tm_trees import TMTree
+
+Match = Tuple[TMTree, int]
+
+_WILDCARDS = re.compile(r'\*|\?|\[[^\]]*\]')
+
+
+class NameIndex:
+    """An inverted index of the names in a TMTree.
+
+    Names are matched case-insensitively.
+
+    === Private Attributes ===
+    _root: The tree this index covers.
+    _nodes: Maps each lower-case name to the nodes with that name.
+    _extensions: Maps each extension (e.g. '.txt'), taken from the last dot,
+    to the lower-case names ending with it.
+    _trigrams: Maps each trigram to the lower-case names containing it.
+
+    === Representation Invariants ===
+    - every set in _nodes is non-empty
+    - a name is in _trigrams or _extensions iff it is a key of _nodes
+    """
+    _root: TMTree
+    _nodes: Dict[str, Set[TMTree]]
+    _extensions: Dict[str, Set[str]]
+    _trigrams: Dict[str, Set[str]]
+
+    def __init__(self, root: TMTree) -> None:
+        """Builds the index for every node in <root>, and keeps it up to date
+        with the edits made below <root>.
+        """
+        self._root = root
+        self._nodes = {}
+        self._extensions = {}
+        self._trigrams = {}
+        self._add_subtree(root)
+        root._add_observer(self)
+
+    def close(self) -> None:
+        """Stops following the edits to the tree.
+        """
+        self._root._remove_observer(self)
+
+    def __len__(self) -> int:
+        """Returns the number of distinct names in the index.
+        """
+        return len(self._nodes)
+
+    # **************************************************************************
+    # ************* QUERIES ****************************************************
+    # **************************************************************************
+    def find_name(self, name: str,
+                  under: Optional[TMTree] = None) -> List[Match]:
+        """Returns the nodes called <name>, with their sizes.
+        """
+        return self._matches([name.lower()], under)
+
+    def find_substring(self, text: str,
+                       under: Optional[TMTree] = None) -> List[Match]:
+        """Returns the nodes whose name contains <text>, with their sizes.
+        """
+        text = text.lower()
+        names = self._candidates([text])
+        return self._matches((name for name in names if text in name), under)
+
+    def find_extension(self, extension: str,
+                       under: Optional[TMTree] = None) -> List[Match]:
+        """Returns the leaves with the given extension (e.g. '.log' or 'log'),
+        with their sizes.
+        """
+        extension = extension.lower()
+        if not extension.startswith('.'):
+            extension = '.' + extension
+        return [match for match in
+                self._matches(self._extensions.get(extension, ()), under)
+                if match[0].get_extension() == extension]
+
+    def find_glob(self, pattern: str,
+                  under: Optional[TMTree] = None) -> List[Match]:
+        """Returns the nodes whose name matches the shell-style <pattern>
+        (e.g. '*.log' or 'report_??.csv'), with their sizes.
+        """
+        pattern = pattern.lower()
+        literals = [part for part in _WILDCARDS.split(pattern) if part]
+        if re.fullmatch(r'\*\.[^*?\[.]+', pattern):
+            names = self._extensions.get(pattern[1:], ())
+        else:
+            names = self._candidates(literals)
+        return self._matches((name for name in names
+                              if fnmatchcase(name, pattern)), under)
+
+    def _candidates(self, literals: List[str]) -> Iterable[str]:
+        """Returns the names that contain every trigram of every string in
+        <literals>. If there are no trigrams, returns every name.
+        """
+        trigrams = {literal[i:i + 3] for literal in literals
+                    for i in range(len(literal) - 2)}
+        if not trigrams:
+            return list(self._nodes)
+        buckets = sorted((self._trigrams.get(trigram, set())
+                          for trigram in trigrams), key=len)
+        names = set(buckets[0])
+        for bucket in buckets[1:]:
+            if not names:
+                break
+            names &= bucket
+        return names
+
+    def _matches(self, names: Iterable[str],
+                 under: Optional[TMTree]) -> List[Match]:
+        """Returns the nodes with one of <names> that are in <under> (if it
+        is given) with their sizes, largest first.
+        """
+        result = []
+        for name in names:
+            for node in self._nodes.get(name, ()):
+                if under is None or _is_within(node, under):
+                    result.append((node, node.data_size))
+        result.sort(key=lambda match: match[1], reverse=True)
+        return result
+
+    # **************************************************************************
+    # ************* INDEX MAINTENANCE ******************************************
+    # **************************************************************************
+    def _add_subtree(self, tree: TMTree) -> None:
+        """Adds <tree> and all of its descendants to the index.
+        """
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node.is_empty():
+                continue
+            name = node._name.lower()
+            nodes = self._nodes.get(name)
+            if nodes is None:
+                nodes = self._nodes[name] = set()
+                for i in range(len(name) - 2):
+                    self._trigrams.setdefault(name[i:i + 3], set()).add(name)
+                extension = _last_extension(name)
+                if extension:
+                    self._extensions.setdefault(extension, set()).add(name)
+            nodes.add(node)
+            if node._subtree_list:  # not a pending clone or paged out
+                stack.extend(node._subtree_list)
+
+    def _remove_subtree(self, tree: TMTree) -> None:
+        """Removes <tree> and all of its descendants from the index.
+        """
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node.is_empty():
+                continue
+            name = node._name.lower()
+            nodes = self._nodes.get(name)
+            if nodes is not None:
+                nodes.discard(node)
+                if not nodes:
+                    self._forget_name(name)
+            if node._subtree_list:
+                stack.extend(node._subtree_list)
+
+    def _forget_name(self, name: str) -> None:
+        """Removes <name>, which no node has any more, from the index.
+        """
+        del self._nodes[name]
+        for i in range(len(name) - 2):
+            names = self._trigrams.get(name[i:i + 3])
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._trigrams[name[i:i + 3]]
+        extension = _last_extension(name)
+        names = self._extensions.get(extension)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._extensions[extension]
+
+    def on_edit_begin(self) -> None:
+        """Does nothing; the index is updated change by change.
+        """
+
+    def on_edit_end(self) -> None:
+        """Does nothing; the index is updated change by change.
+        """
+
+    def on_resize(self, tree: TMTree, old_size: int) -> None:
+        """Does nothing; sizes are read from the nodes when queried.
+        """
+
+    def on_attach(self, tree: TMTree, parent: TMTree,
+                  index: Optional[int]) -> None:
+        """Adds the attached subtree <tree> to the index.
+        """
+        self._add_subtree(tree)
+
+    def on_detach(self, tree: TMTree, parent: TMTree, index: int) -> None:
+        """Removes the detached subtree <tree> from the index.
+        """
+        self._remove_subtree(tree)
+
+    def on_load(self, tree: TMTree) -> None:
+        """Adds the subtrees of <tree>, which were just read in, to the index.
+        """
+        for subtree in tree._subtree_list:
+            self._add_subtree(subtree)
+
+    def on_unload(self, tree: TMTree) -> None:
+        """Removes the subtrees of <tree>, which are about to be paged out,
+        from the index.
+        """
+        for subtree in tree._subtree_list:
+            self._remove_subtree(subtree)
+
+    def on_display(self, tree: TMTree) -> None:
+        """Does nothing; the index does not depend on what is displayed.
+        """
+
+
+def _last_extension(name: str) -> str:
+    """Returns the part of <name> from its last dot, or '' if it has none.
+    """
+    dot = name.rfind('.')
+    return name[dot:] if dot != -1 else ''
+
+
+def _is_within(tree: TMTree, ancestor: TMTree) -> bool:
+    """Returns whether <tree> is <ancestor> or one of its descendants.
+    """
+    while tree is not None:
+        if tree is ancestor:
+            return True
+        tree = tree._parent_tree
+    return False
@@ -0,0 +1,330 @@
+"""
+Assignment 2: Sharing a Scanned Tree Between Processes
+
+=== Module Description ===
+This module lets several local processes view the same scanned tree, while
+it is scanned and held in memory only once.
+
+share_tree flattens a tree into a node table in a block of shared memory
+(multiprocessing.shared_memory). The nodes are stored in pre-order, one
+entry per node in each column:
+    - the data_size, file and folder counts, height and largest leaf
+    - the extent (the number of nodes in the subtree rooted there), so that
+      the subtrees of a node are found by skipping from one to the next
+    - the number of subtrees, the summary count (-1 if it is not a summary
+      leaf) and the modification time (NaN if it is not known)
+    - where its UTF-8 encoded name starts in the block of names
+
+pack_tree flattens a tree into the same table in an ordinary byte string,
+which read_table reads back, e.g. in the process a worker sent it to (see
+tm_scan.scan_parallel).
+
+attach_tree maps a table shared by another process, read-only. Each
+process then views the table through its own TableTree nodes, which are
+only created when their parent's subtrees are first needed (through the
+same lazy _subtrees hook as paged out subtrees). So a viewer only holds
+the nodes it has displayed, with its own expansion state, layout and any
+local edits, on top of the one shared table.
+
+The process that shares a tree owns the shared memory and removes it when
+it closes the table; viewers should close theirs before then. Viewers are
+expected to be separate programs (e.g. other users' visualisers), not
+children of the owner, which would share its resource tracker.
+"""
+from __future__ import annotations
+
+import os
+import struct
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional
+
+from tm_trees import TMTree, FileSystemTree
+
+_MAGIC = 0x544d5442  # 'TMTB'
+# magic number, number of nodes, length of the names, length of the path
+_HEADER = struct.Struct('4q')
+# the int64 columns, in the order they are stored
+_COLUMNS = ('sizes', 'extents', 'children', 'files', 'folders', 'heights',
+            'max_leaves', 'summaries')
+
+
+def share_tree(tree: TMTree, name: Optional[str] = None) -> NodeTable:
+    """Returns a new node table holding <tree>, in shared memory called
+    <name> (by default, a new unique name). The caller owns the table.
+    """
+    data = pack_tree(tree)
+    memory = shared_memory.SharedMemory(name, create=True, size=len(data))
+    memory.buf[:len(data)] = data
+    return NodeTable(memory.buf, memory, owner=True)
+
+
+def read_table(data: bytes) -> NodeTable:
+    """Returns the node table packed into <data> by pack_tree, held in this
+    process only.
+    """
+    return NodeTable(memoryview(data))
+
+
+def pack_tree(tree: TMTree) -> bytearray:
+    """Returns <tree> flattened into a node table, in a byte string.
+    """
+    nodes = []
+    parents = []
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        stack.extend((subtree, len(nodes))
+                     for subtree in reversed(node._subtrees))
+        nodes.append(node)
+        parents.append(parent)
+    n = len(nodes)
+    extents = [1] * n
+    for i in range(n - 1, 0, -1):  # every subtree comes after its parent
+        extents[parents[i]] += extents[i]
+
+    names = [str(node._name).encode('utf-8', 'surrogateescape')
+             for node in nodes]
+    starts = [0] * (n + 1)
+    for i, encoded in enumerate(names):
+        starts[i + 1] = starts[i] + len(encoded)
+    path = tree.get_full_path().encode('utf-8', 'surrogateescape')
+    columns = {
+        'sizes': [node.data_size for node in nodes],
+        'extents': extents,
+        'children': [len(node._subtrees) for node in nodes],
+        'files': [node._file_count for node in nodes],
+        'folders': [node._folder_count for node in nodes],
+        'heights': [node._height for node in nodes],
+        'max_leaves': [node._max_leaf for node in nodes],
+        'summaries': [-1 if getattr(node, '_summary_count', None) is None
+                      else node._summary_count for node in nodes]}
+    mtimes = [float('nan') if getattr(node, '_mtime', None) is None
+              else node._mtime for node in nodes]
+
+    size = _HEADER.size + 8 * ((len(_COLUMNS) + 2) * n + 1) + starts[n] \
+        + len(path)
+    buffer = bytearray(size)
+    _HEADER.pack_into(buffer, 0, _MAGIC, n, starts[n], len(path))
+    offset = _HEADER.size
+    for values, typecode in [(columns[column], 'q') for column in _COLUMNS] \
+            + [(starts, 'q'), (mtimes, 'd')]:
+        data = array(typecode, values).tobytes()
+        buffer[offset:offset + len(data)] = data
+        offset += len(data)
+    buffer[offset:offset + starts[n]] = b''.join(names)
+    buffer[offset + starts[n]:] = path
+    return buffer
+
+
+def attach_tree(name: str) -> NodeTable:
+    """Returns the node table shared under <name> by another process, mapped
+    read-only.
+    """
+    # Only the owner may remove the shared memory, but before Python 3.13,
+    # mapping it registers it to be removed when this process exits.
+    try:
+        memory = shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return NodeTable(memory.buf.toreadonly(), memory, owner=False)
+
+
+class NodeTable:
+    """A tree flattened into a table of nodes, in shared memory (see
+    share_tree and attach_tree) or in this process's memory (see
+    read_table).
+
+    === Public Attributes ===
+    name: The name of the shared memory holding the table, or None if it is
+    not shared.
+    path: The path of the root of the tree.
+    owner: Whether this process created the shared table, and removes it
+    when it is closed.
+
+    === Private Attributes ===
+    _memory: The shared memory holding the table, or None if it is not
+    shared.
+    _sizes, _extents, _children, _files, _folders, _heights, _max_leaves,
+    _summaries, _name_starts, _mtimes: The columns of the table.
+    _names: The UTF-8 encoded names of the nodes, one after the other.
+    """
+    name: Optional[str]
+    path: str
+    owner: bool
+    _memory: Optional[shared_memory.SharedMemory]
+    _sizes: memoryview
+    _extents: memoryview
+    _children: memoryview
+    _files: memoryview
+    _folders: memoryview
+    _heights: memoryview
+    _max_leaves: memoryview
+    _summaries: memoryview
+    _name_starts: memoryview
+    _mtimes: memoryview
+    _names: memoryview
+
+    def __init__(self, buffer: memoryview,
+                 memory: Optional[shared_memory.SharedMemory] = None,
+                 owner: bool = False) -> None:
+        """Reads the table in <buffer>, which is a view of the shared
+        <memory>, if it is shared, of which this process may be the <owner>.
+
+        Raises ValueError if <buffer> does not hold a node table.
+        """
+        self.name = None if memory is None else memory.name
+        self.owner = owner
+        self._memory = memory
+        magic, n, names_length, path_length = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError(f'{self.name} does not hold a node table')
+        offset = _HEADER.size
+        for column in _COLUMNS:
+            setattr(self, '_' + column,
+                    buffer[offset:offset + 8 * n].cast('q'))
+            offset += 8 * n
+        self._name_starts = buffer[offset:offset + 8 * (n + 1)].cast('q')
+        offset += 8 * (n + 1)
+        self._mtimes = buffer[offset:offset + 8 * n].cast('d')
+        offset += 8 * n
+        self._names = buffer[offset:offset + names_length]
+        offset += names_length
+        self.path = bytes(buffer[offset:offset + path_length]).decode(
+            'utf-8', 'surrogateescape')
+
+    def __len__(self) -> int:
+        """Returns the number of nodes in the table.
+        """
+        return len(self._sizes)
+
+    def close(self) -> None:
+        """Stops using the table, and removes it from shared memory if this
+        process owns it. Nodes read from it must not be used afterwards.
+        """
+        for column in _COLUMNS + ('name_starts', 'mtimes', 'names'):
+            getattr(self, '_' + column).release()
+        if self._memory is not None:
+            self._memory.close()
+            if self.owner:
+                self._memory.unlink()
+
+    def root(self) -> TableTree:
+        """Returns a new view of the whole tree. Its nodes are read from the
+        table as they are needed.
+        """
+        return self._make_node(0, None)
+
+    def page_in(self, folder: TableTree) -> None:
+        """Creates the subtrees of <folder> from the table, and lays them out
+        in its rectangle.
+        """
+        del folder._loader
+        extents = self._extents
+        index = folder._index + 1
+        end = folder._index + extents[folder._index]
+        subtrees = []
+        while index < end:
+            subtrees.append(self._make_node(index, folder))
+            index += extents[index]
+        folder._subtree_list = subtrees
+        if folder.rect != (0, 0, 0, 0):
+            folder.update_rectangles(folder.rect)
+
+    def extension_sizes(self, index: int) -> Dict[str, int]:
+        """Returns the total size of the leaves below the node at <index> for
+        each extension (see TMTree.get_extension_sizes).
+        """
+        sizes = {}
+        for i in range(index + 1, index + self._extents[index]):
+            size = self._sizes[i]
+            if size and not self._children[i]:
+                extension = os.path.splitext(self._name(i))[1].lower()
+                sizes[extension] = sizes.get(extension, 0) + size
+        return sizes
+
+    def _name(self, index: int) -> str:
+        """Returns the name of the node at <index>.
+        """
+        return bytes(self._names[self._name_starts[index]:
+                                 self._name_starts[index + 1]]).decode(
+            'utf-8', 'surrogateescape')
+
+    def _make_node(self, index: int,
+                   parent: Optional[TableTree]) -> TableTree:
+        """Returns a new node for the entry at <index>, with its subtrees left
+        to be read in when they are needed.
+        """
+        node = TableTree.__new__(TableTree)
+        node._table = self
+        node._index = index
+        node._name = self._name(index)
+        node.data_size = self._sizes[index]
+        node.rect = (0, 0, 0, 0)
+        node._parent_tree = parent
+        node._depth = 0 if parent is None else parent._depth + 1
+        node._expanded = False
+        node._max_leaf = self._max_leaves[index]
+        # the most common values are left to the class defaults
+        if self._files[index] != 1:
+            node._file_count = self._files[index]
+        if self._folders[index]:
+            node._folder_count = self._folders[index]
+        if self._heights[index]:
+            node._height = self._heights[index]
+        if self._summaries[index] >= 0:
+            node._summary_count = self._summaries[index]
+        mtime = self._mtimes[index]
+        if mtime == mtime:  # not NaN
+            node._mtime = mtime
+        if self._children[index]:
+            node._subtree_list = None
+            node._loader = (self,)
+        else:
+            node._subtree_list = []
+        return node
+
+
+class TableTree(FileSystemTree):
+    """A node of a tree read from a NodeTable (see NodeTable.root).
+
+    Nodes do not store their paths, which are made from the path of the
+    table and the names of their ancestors when they are needed. The
+    extension sizes of a folder are only totalled from the table when they
+    are first needed (e.g. by an edit).
+
+    === Private Attributes ===
+    _table: The table this node was read from.
+    _index: The position of this node in the table.
+    _extension_cache: The extension sizes of this folder, once they have
+    been totalled or set.
+    """
+    _table: NodeTable
+    _index: int
+    _extension_cache: Optional[Dict[str, int]] = None
+
+    @property
+    def _extension_sizes(self) -> Optional[Dict[str, int]]:
+        sizes = self._extension_cache
+        if sizes is None and self._table._children[self._index]:
+            sizes = self._extension_cache = \
+                self._table.extension_sizes(self._index)
+        return sizes
+
+    @_extension_sizes.setter
+    def _extension_sizes(self, sizes: Optional[Dict[str, int]]) -> None:
+        self._extension_cache = sizes
+
+    def get_full_path(self) -> str:
+        """Returns the path of this tree, inside the path of the root of its
+        table (which may itself be inside a tree that is not from a table).
+        """
+        names: List[str] = []
+        tree = self
+        while tree._index and tree._parent_tree is not None:
+            names.append(tree._name)
+            tree = tree._parent_tree
+            if not isinstance(tree, TableTree):
+                return os.path.join(tree.get_full_path(), *reversed(names))
+        return os.path.join(tree._table.path, *reversed(names))
@@ -21,31 +21,102 @@ computer's file system.
 """
 from __future__ import annotations
 
+import colorsys
+import heapq
 import math
 import os
-from random import randint
-from typing import List, Tuple, Optional
+import stat
+import weakref
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Set, Tuple, Optional
 
 
-def get_colour() -> Tuple[int, int, int]:
+def _make_palette(size: int) -> List[Tuple[int, int, int]]:
+    """Returns <size> distinct colours, spread around the colour wheel by the
+    golden ratio. None of them is on or near the grey scale, so leaf
+    rectangles can't be confused with folder rectangles.
     """
-    This function picks a random colour selectively such that it is not on the
-    grey scale. The colour is close to the grey scale if the r g b values have a
-    small variance. This function checks if all the numbers are close to the
-    mean, if so, it shifts the last digit by 150.
+    palette = []
+    for i in range(size):
+        hue = (i * 0.618033988749895) % 1.0
+        saturation = 0.45 + 0.45 * (i * 7 % 11) / 10
+        value = 0.65 + 0.3 * (i * 5 % 7) / 6
+        red, green, blue = colorsys.hsv_to_rgb(hue, saturation, value)
+        palette.append((round(red * 255), round(green * 255),
+                        round(blue * 255)))
+    return palette
 
-    This way you can't confuse the leaf rectangles with folder rectangles,
-    because the leaves will always be a colour, never close to black / white.
+
+PALETTE = _make_palette(256)
+
+
+def get_colour(key: str) -> Tuple[int, int, int]:
+    """Returns the colour from PALETTE for <key> (e.g. the path of a tree).
+
+    The colour is picked with a CRC-32 of <key>, so the same key gets the
+    same colour in every scan and every process.
     """
-    rgb = [randint(0, 255), randint(0, 255), randint(0, 255)]
-    avg = sum(rgb) // 3
-    count = 0
-    for item in rgb:
-        if abs(item - avg) < 20:
-            count += 1
-    if count == 3:
-        rgb[2] = (rgb[2] + 150) % 255
-    return tuple(rgb)
+    return PALETTE[zlib.crc32(key.encode('utf-8', 'surrogateescape'))
+                   % len(PALETTE)]
+
+
+# The colours used for leaves when colouring by extension class, and the
+# extensions in each class. Any other extension is in the 'other' class.
+EXTENSION_CLASSES = {
+    'code': ((86, 156, 214), ('.py', '.c', '.h', '.cpp', '.java', '.js',
+                              '.ts', '.go', '.rs', '.rb', '.sh', '.html',
+                              '.css', '.jar', '.class', '.so', '.dll')),
+    'document': ((220, 200, 90), ('.txt', '.md', '.pdf', '.doc', '.docx',
+                                  '.ppt', '.pptx', '.xls', '.xlsx', '.odt',
+                                  '.rtf', '.tex')),
+    'image': ((90, 190, 110), ('.png', '.jpg', '.jpeg', '.gif', '.bmp',
+                               '.svg', '.tif', '.tiff', '.webp', '.ico')),
+    'media': ((200, 90, 200), ('.mp3', '.wav', '.flac', '.ogg', '.mp4',
+                               '.mkv', '.avi', '.mov', '.webm')),
+    'archive': ((230, 130, 50), ('.zip', '.tar', '.gz', '.tgz', '.bz2',
+                                 '.xz', '.7z', '.rar', '.zst', '.iso')),
+    'data': ((60, 200, 200), ('.csv', '.json', '.xml', '.yaml', '.yml',
+                              '.parquet', '.db', '.sqlite', '.h5', '.npy',
+                              '.pkl')),
+    'log': ((210, 70, 70), ('.log', '.out', '.err')),
+    'other': ((150, 110, 80), ()),
+}
+_EXTENSION_CLASS_OF = {extension: name
+                       for name, (_, extensions) in EXTENSION_CLASSES.items()
+                       for extension in extensions}
+
+
+def get_extension_class(extension: str) -> str:
+    """Returns the name of the class in EXTENSION_CLASSES that <extension>
+    (e.g. '.log') belongs to.
+    """
+    return _EXTENSION_CLASS_OF.get(extension, 'other')
+
+
+def extension_colour(tree: TMTree) -> Tuple[int, int, int]:
+    """Returns the colour of the extension class of the leaf <tree>, or the
+    tree's own colour if it is a folder. This can be passed as the colouring
+    to TMTree.get_rectangles.
+    """
+    if tree._folder_count:  # does not read in the subtrees of a folder
+        return tree._colour
+    return EXTENSION_CLASSES[get_extension_class(tree.get_extension())][0]
+
+
+def expand_to_depth(tree: TMTree, max_depth: Optional[int]) -> None:
+    """Expands <tree> and its folders down to <max_depth> levels below it,
+    or all of them if <max_depth> is None.
+    """
+    if max_depth is None:
+        tree.expand_all()
+        return
+    level = [tree]
+    for _ in range(max_depth):
+        level = [node for node in level if node._subtrees]
+        for node in level:
+            node.expand()
+        level = [subtree for node in level for subtree in node._subtrees]
 
 
 class TMTree:
@@ -66,13 +137,39 @@ class TMTree:
     data_size: The size of the data represented by this tree.
 
     === Private Attributes ===
-    _colour: The RGB colour value of the root of this tree.
+    _colour: The RGB colour value of the root of this tree. Unless it is set,
+    it is picked from its path (see get_colour) when it is first read.
+    _colour_value: The colour that was picked or set, or None if there is
+    none yet.
     _name: The root value of this tree, or None if this tree is empty.
     _subtrees: The subtrees of this tree.
     _parent_tree: The parent tree of this tree; i.e., the tree that contains
     this tree as a subtree, or None if this tree is not part of a larger tree.
     _expanded: Whether this tree is considered expanded for visualization.
     _depth: The depth of this tree node in relation to the root.
+    _max_leaf: The data_size of the largest leaf in this tree.
+    _file_count: The number of files (leaves) in this tree. A leaf standing
+    for several items counts them all.
+    _folder_count: The number of folders in this tree, including this tree
+    if it is one.
+    _height: The number of levels of subtrees below this tree.
+    _extension_sizes: For a folder, maps each extension (see get_extension)
+    to the total data_size of the leaves in this tree with that extension.
+    None for leaves, whose only extension is their own.
+    _subtree_list: The list backing _subtrees, or None while this tree is a
+    copy-on-write clone whose subtrees have not been materialised yet.
+    _subtree_source: The tree whose subtrees this clone will copy when they
+    are first accessed, or None once they have been materialised.
+    _cow_dependents: The pending clones reading their subtrees from this
+    tree, or None if there are none.
+    _observers: The edit observers (e.g. an undo journal) registered on this
+    tree, or None. Only the observers of the root are notified.
+    _expanded_subtrees: The expanded subtrees of this expanded tree, so that
+    collapsing visits only expanded trees, or None if there are none yet.
+    _loader: A tuple starting with the object whose page_in(tree) reads the
+    subtrees of this tree in when they are first needed: the pager they were
+    paged out to (see tm_paging), or the shared node table they are read
+    from (see tm_shared). None if they are in memory.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -91,16 +188,26 @@ class TMTree:
 
     rect: Tuple[int, int, int, int]
     data_size: int
-    _colour: Tuple[int, int, int]
+    _colour_value: Optional[Tuple[int, int, int]] = None
     _name: str
-    _subtrees: List[TMTree]
+    _subtree_list: Optional[List[TMTree]]
     _parent_tree: Optional[TMTree]
     _expanded: bool
     _depth: int
+    _max_leaf: int
+    _file_count: int = 1
+    _folder_count: int = 0
+    _height: int = 0
+    _subtree_source: Optional[TMTree] = None
+    _cow_dependents: Optional[weakref.WeakSet] = None
+    _observers: Optional[list] = None
+    _extension_sizes: Optional[Dict[str, int]] = None
+    _expanded_subtrees: Optional[Set[TMTree]] = None
+    _loader: Optional[tuple] = None
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
-        """Initializes a new TMTree with a random colour, the provided name
+        """Initializes a new TMTree with the provided name
         and sets the subtrees to the list of provided subtrees. Sets this tree
         as the parent for each of its subtrees.
 
@@ -113,7 +220,7 @@ class TMTree:
         self._expanded = False
 
         # 1. Initialize: - self._name
-        #                - self._colour (use the get_colour() function)
+        #                - self._colour (picked when it is first read)
         #                - self._subtrees
         #                - self.data_size
         # 2. Set this tree as the parent for each of its subtrees.
@@ -124,19 +231,86 @@ class TMTree:
         #           -> this needs to be updated based on the sizes of subtrees
         #
         self._name = name
-        self._colour = get_colour()
         self._subtrees = subtrees
         self.data_size = data_size
+        files = folders = 0
         for subtree in self._subtrees:  # data_size = sum of data_size of subtre
             self.data_size += subtree.data_size
+            files += subtree._file_count
+            folders += subtree._folder_count
         for subtree in self._subtrees:
             subtree._parent_tree = self
+        self._update_summaries()
+        if name is None:
+            self._file_count = 0
+        if subtrees:
+            self._file_count = files
+            self._folder_count = folders + 1
+            self._extension_sizes = {}
+            for subtree in subtrees:
+                _add_sizes(self._extension_sizes,
+                           subtree._get_extension_sizes(), 1)
+
+    @property
+    def _colour(self) -> Tuple[int, int, int]:
+        """The colour of this tree. Unless it has been set, it is picked from
+        the path of names from the root to this tree when it is first read,
+        i.e. when this tree is first drawn.
+        """
+        colour = self._colour_value
+        if colour is None:
+            names = []
+            tree = self
+            while tree is not None:
+                names.append(str(tree._name))
+                tree = tree._parent_tree
+            colour = get_colour('/'.join(reversed(names)))
+            self._colour_value = colour
+        return colour
+
+    @_colour.setter
+    def _colour(self, colour: Tuple[int, int, int]) -> None:
+        self._colour_value = colour
+
+    @property
+    def _subtrees(self) -> List[TMTree]:
+        """The subtrees of this tree. A pending copy-on-write clone copies
+        its source's subtrees (one level only) on first access, and subtrees
+        that were paged out to disk are read back in.
+        """
+        if self._subtree_list is None:
+            if self._subtree_source is not None:
+                self._materialise()
+            else:
+                self._page_in()
+        return self._subtree_list
+
+    @_subtrees.setter
+    def _subtrees(self, subtrees: List[TMTree]) -> None:
+        if self._subtree_source is not None:
+            self._subtree_source._cow_dependents.discard(self)
+            del self._subtree_source
+        if self._loader is not None:
+            del self._loader
+        self._subtree_list = subtrees
 
     def is_empty(self) -> bool:
         """Returns True iff this tree is empty.
         """
         return self._name is None
 
+    def _is_leaf(self) -> bool:
+        """Returns whether this tree is a leaf (a file), and not a folder,
+        even an empty one. Its subtrees are not read in.
+        """
+        return not self._folder_count
+
+    def is_summary(self) -> bool:
+        """Returns whether this is a synthetic leaf summarising several items
+        that have no nodes of their own. Summary leaves cannot be expanded.
+        """
+        return False
+
     def get_parent(self) -> Optional[TMTree]:
         """Returns the parent of this tree.
         """
@@ -160,34 +334,58 @@ class TMTree:
         #        - tip: use "tuple unpacking assignment" for easy extraction:
         #           -> x, y, width, height = rect
         #
-        x, y, width, height = self.rect
         self.rect = rect
-        total = sum(tree.data_size for tree in self._subtrees)
-
+        if self._subtree_list is None:
+            return  # laid out when they are materialised or paged in
+        subtrees = self._subtrees
+        for subtree, subtree_rect in zip(subtrees,
+                                         self._layout_subtrees(rect)):
+            subtree.update_rectangles(subtree_rect)
+
+    def _layout_subtrees(self, rect: Tuple[int, int, int, int]) \
+            -> List[Tuple[int, int, int, int]]:
+        """Returns the rectangles of the subtrees of this tree, in order, when
+        this tree fills <rect>.
+        """
+        x, y, width, height = rect
+        subtrees = self._subtrees
+        total = sum(tree.data_size for tree in subtrees)
+        if total == 0:  # empty folders don't take up any space
+            return [(x, y, 0, 0)] * len(subtrees)
+
+        rects = []
+        last = len(subtrees) - 1
         if width > height:  # horizontal rectangles
             temp_x = x
-            for subtree in self._subtrees:
-                if subtree == self._subtrees[-1]:
+            for i, subtree in enumerate(subtrees):
+                if i == last:
                     new_width = width + x - temp_x
                 else:
                     new_width = math.floor(subtree.data_size * width / total)
-                subtree.update_rectangles((temp_x, y, new_width, height))
+                rects.append((temp_x, y, new_width, height))
                 temp_x += new_width
         else:  # vertical rectangles
             temp_y = y
-            for subtree in self._subtrees:
-                if subtree == self._subtrees[-1]:
+            for i, subtree in enumerate(subtrees):
+                if i == last:
                     new_height = height + y - temp_y
                 else:
                     new_height = math.floor(subtree.data_size * height / total)
-                subtree.update_rectangles((x, temp_y, width, new_height))
+                rects.append((x, temp_y, width, new_height))
+                temp_y += new_height
+        return rects
 
-    def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
-                                           Tuple[int, int, int]]]:
+    def get_rectangles(self, colouring: Optional[
+            Callable[[TMTree], Tuple[int, int, int]]] = None) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
         """Returns a list with tuples for every leaf in the displayed-tree
         rooted at this tree. Each tuple consists of a tuple that defines the
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
+
+        If <colouring> is given, each displayed tree is filled with the
+        colour it returns for it (e.g. extension_colour) instead of its own
+        colour.
         """
         #
         # NOTES: - This method will be modified in Task 6 to return both leaf
@@ -196,13 +394,74 @@ class TMTree:
         if self._name is None:
             return [((0, 0, 0, 0), (0, 0, 0))]
         elif not self._expanded:
+            if colouring is not None:
+                return [(self.rect, colouring(self))]
             return [(self.rect, self._colour)]
         else:
             list_of_tuples = []
             for subtree in self._subtrees:
-                list_of_tuples.extend(subtree.get_rectangles())
+                list_of_tuples.extend(subtree.get_rectangles(colouring))
             return list_of_tuples
 
+    def get_lod_rectangles(self, rect: Tuple[int, int, int, int],
+                           threshold: int, colouring: Optional[
+                               Callable[[TMTree], Tuple[int, int, int]]] = None) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Lays out this tree in <rect> and returns the rectangles to draw
+        it at the level of detail of the screen, ignoring which trees are
+        expanded: a folder is drawn expanded while its rectangle is at least
+        <threshold> pixels wide and high, and as a single block otherwise.
+        Trees with no area are not drawn.
+
+        Only the trees that are drawn, and the subtrees of the folders that
+        are drawn expanded, are visited. The rectangles do not overlap, so
+        there are never more of them than there are pixels in <rect>.
+        """
+        rectangles = []
+        stack = [(self, rect)]
+        while stack:
+            tree, tree_rect = stack.pop()
+            tree.rect = tree_rect
+            if tree_rect[2] <= 0 or tree_rect[3] <= 0:
+                continue
+            if tree._shown_expanded_at(threshold):
+                stack.extend(reversed(list(zip(
+                    tree._subtrees, tree._layout_subtrees(tree_rect)))))
+            elif colouring is not None:
+                rectangles.append((tree_rect, colouring(tree)))
+            else:
+                rectangles.append((tree_rect, tree._colour))
+        return rectangles
+
+    def get_lod_tree_at_position(self, pos: Tuple[int, int],
+                                 threshold: int) -> Optional[TMTree]:
+        """Returns the tree drawn at <pos> by the last call to
+        get_lod_rectangles with <threshold> on this tree, or None if <pos>
+        is outside of this tree's rectangle.
+
+        If <pos> is on the shared edge between two or more rectangles,
+        the leftmost and topmost rectangle is returned.
+        """
+        if self.is_empty() or not _contains(self.rect, pos):
+            return None
+        tree = self
+        while tree._shown_expanded_at(threshold):
+            for subtree in tree._subtrees:
+                if subtree.rect[2] > 0 and subtree.rect[3] > 0 \
+                        and _contains(subtree.rect, pos):
+                    tree = subtree
+                    break
+            else:
+                return None
+        return tree
+
+    def _shown_expanded_at(self, threshold: int) -> bool:
+        """Returns whether this tree is drawn expanded by get_lod_rectangles
+        with <threshold>, given its current rectangle.
+        """
+        return bool(self._subtrees) and self.rect[2] >= threshold \
+            and self.rect[3] >= threshold and self.data_size > 0
+
     # **************************************************************************
     # **************** TASK 3: GET_TREE_AT_POSITION ****************************
     # **************************************************************************
@@ -221,24 +480,18 @@ class TMTree:
         #
         if self.is_empty():
             return None
-        elif not self._subtrees:  # self is a leaf
-            if self.rect[0] <= pos[0] <= self.rect[2] + self.rect[0] \
-                    and self.rect[1] <= pos[1] <= self.rect[3] + self.rect[1]:
-                # if <pos> is between x value and x + width and between y value
-                # and y + height
-                return self
-            else:
-                return None
-        else:
-            if self.rect[0] <= pos[0] <= self.rect[2] + self.rect[0] \
-                    and self.rect[1] <= pos[1] <= self.rect[3] + self.rect[1]:
-                if self._expanded is False:
-                    return self
-
-            for subtree in self._subtrees:
-                tree = subtree.get_tree_at_position(pos)
-                if tree is not None:
-                    return tree
+        elif not (self.rect[0] <= pos[0] <= self.rect[2] + self.rect[0]
+                  and self.rect[1] <= pos[1] <= self.rect[3] + self.rect[1]):
+            # <pos> is not between x value and x + width and between y value
+            # and y + height, so it is not in any subtree's rectangle either
+            return None
+        elif not self._expanded:  # a leaf or a collapsed folder
+            return self
+        for subtree in self._subtrees:
+            tree = subtree.get_tree_at_position(pos)
+            if tree is not None:
+                return tree
+        return None
 
     # **************************************************************************
     # ********* TASK 4: MOVE, CHANGE SIZE, DELETE, UPDATE SIZES ****************
@@ -259,14 +512,16 @@ class TMTree:
         #
         if self.is_empty():
             return 0
+        elif self._subtree_list is None:  # a pending clone or paged out
+            return self.data_size
         elif not self._subtrees:  # if TMT object is a leaf
             return self.data_size
         else:
             total_size = 0
             for subtree in self._subtrees:
                 total_size += subtree.update_data_sizes()
-            if self._parent_tree is not None:
-                self._parent_tree.data_size = total_size
+            self.data_size = total_size
+            self._update_summaries()
             return total_size
 
     def change_size(self, factor: float) -> None:
@@ -282,18 +537,20 @@ class TMTree:
         #        - the lower limit on data_size is 1 (i.e., you can't let the
         #          size decrease below 1)
         #
+        if self.is_empty() or not self._is_leaf():
+            return
         if factor < 0:
             amount_change = math.floor(self.data_size * factor)
         else:
             amount_change = math.ceil(self.data_size * factor)
 
         if not (amount_change + self.data_size) < 1:
-            self.data_size += amount_change
+            new_size = self.data_size + amount_change
         else:
-            self.data_size = 1
+            new_size = 1
 
-        # Update data sizes
-        self.update_data_sizes()
+        with self._edit():
+            self._set_size(new_size)
         # Reapply rect algorithm
         self.update_rectangles(self.rect)
 
@@ -310,31 +567,22 @@ class TMTree:
         #          recursively keep deleting the empty folder above
         #        - the root node should not be deleted, and the size won't be
         #          updated if the root node is attempted to be deleted
-
-        # first delete the self (intended file)
-        temp = False
         parent_tree = self._parent_tree
-        parent_tree._subtrees.remove(self)
-        self._parent_tree = None
-        if self not in parent_tree._subtrees:
-            temp = True
-
-        # recursively delete parent, if parent has no files
-        while parent_tree._parent_tree is not None:  # recurse till root
-            if not parent_tree._subtrees:  # if folder had no more files
-                deleted = parent_tree.delete_helper()
-                if not deleted:
-                    return False
-            parent_tree = parent_tree._parent_tree
-        return temp
-
-    def delete_helper(self):
-        self._parent_tree._subtrees.remove(self)
-        if self not in self._parent_tree._subtrees:
-            return True
-        else:
+        if parent_tree is None:
             return False
 
+        with self._edit():
+            # first delete the self (intended file)
+            self._detach()
+
+            # recursively delete parent, if parent has no files
+            while not parent_tree._subtrees \
+                    and parent_tree._parent_tree is not None:
+                grandparent = parent_tree._parent_tree
+                parent_tree._detach()
+                parent_tree = grandparent
+        return True
+
     # **************************************************************************
     # ************* TASK 5: UPDATE_COLOURS_AND_DEPTHS **************************
     # **************************************************************************
@@ -345,7 +593,8 @@ class TMTree:
         """
         if self.is_empty():
             pass
-        elif not self._subtrees:  # self is a leaf
+        elif self._loader is not None or not self._subtrees:
+            # paged out (the depths are set when it is paged in) or a leaf
             if self._parent_tree is not None:
                 self._depth = self._parent_tree._depth + 1
             else:
@@ -364,15 +613,7 @@ class TMTree:
         """
         if self.is_empty():
             return 0
-        elif not self._subtrees:
-            return self._depth
-        else:
-            largest_depth = 0
-            for subtree in self._subtrees:
-                new_depth = subtree.max_depth()
-                if new_depth > largest_depth:
-                    largest_depth = new_depth
-            return largest_depth
+        return self._depth + self._height
 
     def update_colours(self, step_size: int) -> None:
         """Updates the colours so that the internal tree nodes are
@@ -383,11 +624,13 @@ class TMTree:
         """
         if self.is_empty():
             return
-        elif not self._subtrees:
+        elif self._loader is None and not self._subtrees:
             pass
         else:
             self._colour = (step_size * self._depth, step_size * self._depth,
                             step_size * self._depth)
+            if self._loader is not None:
+                return  # paged out subtrees keep the colours they had
             for subtree in self._subtrees:
                 subtree.update_colours(step_size)
 
@@ -402,7 +645,7 @@ class TMTree:
         # 4. Call the update_colours method and use step_size as the parameter.
         self.update_depths()
         max_depth = self.max_depth()
-        step_size = 200 // max_depth
+        step_size = 200 // max_depth if max_depth else 0
         self.update_colours(step_size)
 
     # **************************************************************************
@@ -411,36 +654,35 @@ class TMTree:
 
     def expand(self) -> None:
         """Sets this tree to be expanded. But not if it is a leaf.
-        """
-        if self.is_empty():
-            pass
-        elif not self._subtrees:  # self is a leaf
-            pass
-        else:
-            self._expanded = True
-            if self._parent_tree is not None:
-                self._parent_tree._expanded = True
 
-        self.update_data_sizes()
-        self.update_rectangles(self.rect)
+        Its ancestors are expanded too, so that it is displayed. The
+        rectangles are already laid out, so this takes O(1) time per tree
+        whose state changes.
+        """
+        if self.is_empty() or not self._subtrees:  # a leaf
+            return
+        self._expand_path()
+        for observer in self._get_observers():
+            observer.on_display(self)
 
     def expand_all(self) -> None:
         """Sets this tree and all its descendants to be expanded, apart from the
         leaf nodes.
         """
-        if self.is_empty():
-            pass
-        elif not self._subtrees:  # self is a leaf
-            pass
-        else:
-            self._expanded = True
-            if self._parent_tree is not None:
-                self._parent_tree._expanded = True
-            for subtree in self._subtrees:
-                subtree.expand_all()
-
-        self.update_data_sizes()
-        self.update_rectangles(self.rect)
+        if self.is_empty() or not self._subtrees:  # a leaf
+            return
+        self._expand_path()
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            for subtree in tree._subtrees:
+                # reading _subtree_list skips the property call for leaves
+                if subtree._subtree_list is None or subtree._subtree_list:
+                    if not subtree._expanded:
+                        subtree._mark_expanded()
+                    stack.append(subtree)
+        for observer in self._get_observers():
+            observer.on_display(self)
 
     def collapse(self) -> None:
         """Collapses the parent tree of the given tree node and also collapse
@@ -452,19 +694,10 @@ class TMTree:
         #          should not be expanded, and any node underneath this tree
         #          should not be expanded.
         #
-        if self.is_empty():
-            pass
-        elif not self._subtrees:  # self is a leaf
-            pass
+        if self._parent_tree is not None:
+            self._parent_tree._collapse_subtree()
         else:
-            self._expanded = False
-            if self._parent_tree is not None:
-                self._parent_tree._expanded = False
-            for subtree in self._subtrees:
-                subtree.collapse()
-
-        self.update_data_sizes()
-        self.update_rectangles(self.rect)
+            self._collapse_subtree()
 
     def collapse_all(self) -> None:
         """ Collapses ALL nodes in the tree.
@@ -473,26 +706,52 @@ class TMTree:
         # NOTES - This should work if it is called on any node in the tree.
         #       - After this method is called, _expanded should be set to false
         #         for all nodes in the tree.
-        if self.is_empty():
-            pass
-        elif not self._subtrees:  # self is a leaf
-            pass
-        else:
-            temp_self = self
-            while temp_self._parent_tree is not None:
-                temp_self = temp_self._parent_tree
-                temp_self._helper_collapse()
-
-            self.update_data_sizes()
-            self.update_rectangles(self.rect)
-
-    def _helper_collapse(self) -> None:
+        root = self
+        while root._parent_tree is not None:
+            root = root._parent_tree
+        root._collapse_subtree()
+
+    def _mark_expanded(self) -> None:
+        """Sets this folder to be expanded, and records it in the expanded
+        subtrees of its parent, which must already be expanded.
         """
-        Helper to <collapse_all>. Collapses <self>'s subtrees including <self>.
+        self._expanded = True
+        parent = self._parent_tree
+        if parent is not None:
+            if parent._expanded_subtrees is None:
+                parent._expanded_subtrees = set()
+            parent._expanded_subtrees.add(self)
+
+    def _expand_path(self) -> None:
+        """Expands this folder and each of its ancestors that is not expanded
+        yet. Only the trees whose state changes are visited.
         """
-        self._expanded = False
-        for subtree in self._subtrees:
-            subtree._helper_collapse()
+        path = []
+        tree = self
+        while tree is not None and not tree._expanded:
+            path.append(tree)
+            tree = tree._parent_tree
+        for tree in reversed(path):  # parents first
+            tree._mark_expanded()
+
+    def _collapse_subtree(self) -> None:
+        """Collapses this tree and every expanded tree in it, visiting only
+        the expanded trees.
+        """
+        if not self._expanded:
+            return
+        if self._parent_tree is not None \
+                and self._parent_tree._expanded_subtrees:
+            self._parent_tree._expanded_subtrees.discard(self)
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree._expanded = False
+            if tree._expanded_subtrees is not None:
+                stack.extend(tree._expanded_subtrees)
+                del tree._expanded_subtrees
+        for observer in self._get_observers():
+            observer.on_display(self)
 
     # **************************************************************************
     # ************* TASK 7 : DUPLICATE MOVE COPY_PASTE *************************
@@ -502,19 +761,15 @@ class TMTree:
         """If this tree is a leaf, and <destination> is not a leaf, moves this
         tree to be the last subtree of <destination>. Otherwise, does nothing.
         """
-        if not self._subtrees and destination._subtrees:  # self is a leaf
-            self._parent_tree._subtrees.remove(self)
-            self.update_data_sizes()
-
-            # Transferring to Destination
-            destination._subtrees.append(self)
+        if self._is_leaf() and destination is not None \
+                and not destination._is_leaf() \
+                and self._parent_tree is not None:
+            with self._edit():
+                self._detach()
+
+                # Transferring to Destination
+                self._attach(destination)
             destination.expand()
-            self._parent_tree = destination
-
-            # change data sizes and rectangle of respective nodes to account
-            # for the change
-            self.update_data_sizes()
-            self.update_rectangles(self.rect)
 
     def duplicate(self) -> Optional[TMTree]:
         """Duplicates the given tree, if it is a leaf node. It stores
@@ -522,15 +777,13 @@ class TMTree:
         new node. If the given tree is not a leaf, does nothing.
         """
         #
-        # NOTES: - make good use of the FileSystemTree constructor to
-        #          instantiate a new node.
-        if not self._subtrees:  # if self is a leaf
-            path = self.get_full_path()
-            tree_object = FileSystemTree(path)  # duplicate of self
-            tree_object._parent_tree = self._parent_tree
-            self._parent_tree._subtrees.append(tree_object)
-            self.update_data_sizes()
-            self.update_rectangles(self.rect)
+        # NOTES: - the copy is cloned from this node in memory, so it keeps
+        #          any size that was changed in the visualiser and does not
+        #          touch the file system.
+        if self._is_leaf() and self._parent_tree is not None:
+            tree_object = self._clone()  # duplicate of self
+            with self._edit():
+                tree_object._attach(self._parent_tree)
             return tree_object
         else:
             return None
@@ -540,17 +793,363 @@ class TMTree:
         copies the given, and moves the copy to the last subtree of
         <destination>. Otherwise, does nothing.
         """
-        if not self._subtrees and destination._subtrees:  # self is a leaf
-            # duplicate the file:
-            copy_of_self = self.duplicate()
+        if self._is_leaf() and destination is not None \
+                and not destination._is_leaf():
+            # clone the file straight into its new location
+            copy_of_self = self._clone()
+            with self._edit():
+                copy_of_self._attach(destination)
+            destination.expand()
+
+    # **************************************************************************
+    # ************* HELPERS FOR IN-MEMORY CLONES AND EDITS *********************
+    # **************************************************************************
+    def _clone(self) -> TMTree:
+        """Returns a copy of this tree that is not attached to any parent.
 
-            # move the copy to different location
-            copy_of_self.move(destination)
+        Only this node is copied straight away, without any file system
+        access. The subtrees of a folder are shared with this tree and copied
+        one level at a time the first time the clone's subtrees are accessed,
+        so cloning a folder of any size takes O(1) time and memory.
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.__dict__.pop('_cow_dependents', None)
+        clone.__dict__.pop('_observers', None)
+        clone.__dict__.pop('_expanded_subtrees', None)
+        clone.__dict__.pop('_loader', None)  # the clone reads from this tree
+        clone._parent_tree = None
+        clone._expanded = False
+        if self._extension_sizes is not None:
+            clone._extension_sizes = dict(self._extension_sizes)
+        source = self._subtree_source
+        if source is None and (self._subtree_list is None
+                               or self._subtree_list):
+            source = self  # read back in from the spill file if paged out
+        if source is not None:
+            clone._subtree_list = None
+            clone._subtree_source = source
+            if source._cow_dependents is None:
+                source._cow_dependents = weakref.WeakSet()
+            source._cow_dependents.add(clone)
+        else:
+            clone._subtree_list = []
+        return clone
 
-            # change data sizes and rectangle of respective nodes to account
-            # for the change
-            self.update_data_sizes()
+    def _materialise(self) -> None:
+        """Copies the subtrees of this pending clone from its source. The new
+        subtrees are themselves pending clones of the source's subtrees.
+        """
+        source = self._subtree_source
+        source._cow_dependents.discard(self)
+        del self._subtree_source
+        self._subtree_list = [subtree._clone() for subtree in source._subtrees]
+        for subtree in self._subtree_list:
+            subtree._parent_tree = self
+            subtree._depth = self._depth + 1
+        if self.rect != (0, 0, 0, 0):
             self.update_rectangles(self.rect)
+        for observer in self._get_observers():
+            observer.on_load(self)
+
+    def _page_in(self) -> None:
+        """Reads the subtrees of this tree in from its loader (a pager or a
+        shared node table).
+        """
+        self._loader[0].page_in(self)
+        for observer in self._get_observers():
+            observer.on_load(self)
+
+    def _unshare_path(self) -> None:
+        """Materialises every pending clone that still reads its subtrees from
+        this tree or one of its ancestors, so that an edit here is not seen
+        by those clones. Ancestors are handled from the root down, so each
+        clone created along the way is materialised in turn.
+        """
+        path = []
+        tree = self
+        while tree is not None:
+            path.append(tree)
+            tree = tree._parent_tree
+        for tree in reversed(path):
+            if tree._cow_dependents:
+                for clone in list(tree._cow_dependents):
+                    clone._materialise()
+
+    def _propagate_size(self, delta: int, files: int = 0,
+                        folders: int = 0) -> None:
+        """Adds <delta> to the data_size, and <files> and <folders> to the
+        file and folder counts, of every ancestor of this tree.
+        """
+        parent = self._parent_tree
+        while parent is not None:
+            parent.data_size += delta
+            if files or folders:
+                parent._file_count += files
+                parent._folder_count += folders
+            parent = parent._parent_tree
+
+    def _attach(self, parent: TMTree, index: Optional[int] = None) -> None:
+        """Inserts this detached tree into the subtrees of <parent> at
+        <index> (or last, if <index> is None) and updates the ancestor sizes.
+        """
+        parent._unshare_path()
+        if self._expanded and not parent._expanded:
+            self._collapse_subtree()  # it would not be displayed
+        if index is None:
+            parent._subtrees.append(self)
+        else:
+            parent._subtrees.insert(index, self)
+        self._parent_tree = parent
+        self._depth = parent._depth + 1
+        if self._expanded:
+            self._mark_expanded()
+        self._propagate_size(self.data_size, self._file_count,
+                             self._folder_count)
+        if parent._extension_sizes is None:  # parent was an empty folder
+            parent._extension_sizes = {}
+        parent._add_extension_sizes(self._get_extension_sizes(), 1)
+        parent._refresh_summaries()
+        for observer in parent._get_observers():
+            observer.on_attach(self, parent, index)
+
+    def _attach_all(self, subtrees: List[TMTree]) -> None:
+        """Appends the detached <subtrees> to the subtrees of this tree,
+        updating the sizes and aggregates of the ancestors once for all of
+        them rather than once per subtree.
+        """
+        if not subtrees:
+            return
+        self._unshare_path()
+        if self._extension_sizes is None:  # this was an empty folder
+            self._extension_sizes = {}
+        total = files = folders = 0
+        extension_sizes = {}
+        for subtree in subtrees:
+            if subtree._expanded and not self._expanded:
+                subtree._collapse_subtree()
+            subtree._parent_tree = self
+            subtree._depth = self._depth + 1
+            if subtree._expanded:
+                subtree._mark_expanded()
+            total += subtree.data_size
+            files += subtree._file_count
+            folders += subtree._folder_count
+            _add_sizes(extension_sizes, subtree._get_extension_sizes(), 1)
+        first = len(self._subtrees)
+        self._subtrees.extend(subtrees)
+        self.data_size += total
+        self._file_count += files
+        self._folder_count += folders
+        self._propagate_size(total, files, folders)
+        self._add_extension_sizes(extension_sizes, 1)
+        self._refresh_summaries()
+        for observer in self._get_observers():
+            for i, subtree in enumerate(subtrees):
+                observer.on_attach(subtree, self, first + i)
+
+    def _detach(self) -> int:
+        """Removes this tree from its parent, updates the ancestor sizes and
+        returns the index this tree had in its parent's subtrees.
+        """
+        parent = self._parent_tree
+        parent._unshare_path()
+        index = next(i for i, subtree in enumerate(parent._subtrees)
+                     if subtree is self)
+        del parent._subtrees[index]
+        if self._expanded and parent._expanded_subtrees:
+            parent._expanded_subtrees.discard(self)
+        self._propagate_size(-self.data_size, -self._file_count,
+                             -self._folder_count)
+        self._parent_tree = None
+        parent._add_extension_sizes(self._get_extension_sizes(), -1)
+        parent._refresh_summaries()
+        for observer in parent._get_observers():
+            observer.on_detach(self, parent, index)
+        return index
+
+    def _update_summaries(self) -> bool:
+        """Recomputes the aggregates this tree keeps about its subtrees from
+        the aggregates of its direct subtrees, and returns whether any of
+        them changed.
+        """
+        if self._subtree_list:
+            max_leaf = max(subtree._max_leaf for subtree in self._subtree_list)
+            height = 1 + max(subtree._height for subtree in self._subtree_list)
+        elif self._subtree_list is None:  # unchanged since cloned or paged out
+            return False
+        else:
+            max_leaf = self.data_size
+            height = 0
+        changed = max_leaf != getattr(self, '_max_leaf', None)
+        self._max_leaf = max_leaf
+        if height != self._height:  # leaves keep the class default
+            self._height = height
+            changed = True
+        return changed
+
+    def _refresh_summaries(self) -> None:
+        """Updates the aggregates of this tree and its ancestors after one of
+        its subtrees changed, stopping at the first tree that is unaffected.
+        """
+        tree = self
+        while tree is not None and tree._update_summaries():
+            tree = tree._parent_tree
+
+    def _get_extension_sizes(self) -> Dict[str, int]:
+        """Returns the total data_size of the leaves in this tree for each
+        extension. The result must not be modified.
+        """
+        if self._extension_sizes is not None:
+            return self._extension_sizes
+        elif self.is_empty() or not self.data_size:
+            return {}
+        return {self.get_extension(): self.data_size}
+
+    def _add_extension_sizes(self, sizes: Dict[str, int], sign: int) -> None:
+        """Adds <sizes> times <sign> to the extension sizes of this folder
+        and all of its ancestors.
+        """
+        tree = self
+        while tree is not None:
+            _add_sizes(tree._extension_sizes, sizes, sign)
+            tree = tree._parent_tree
+
+    def _set_size(self, size: int) -> None:
+        """Sets the data_size of this leaf to <size> and updates the ancestor
+        sizes.
+        """
+        self._unshare_path()
+        old_size = self.data_size
+        self.data_size = size
+        self._propagate_size(size - old_size)
+        if self._parent_tree is not None:
+            self._parent_tree._add_extension_sizes(
+                {self.get_extension(): size - old_size}, 1)
+        self._refresh_summaries()
+        for observer in self._get_observers():
+            observer.on_resize(self, old_size)
+
+    # **************************************************************************
+    # ************* HELPERS FOR EDIT OBSERVERS *********************************
+    # **************************************************************************
+    def _get_root(self) -> TMTree:
+        """Returns the root of the tree containing this tree.
+        """
+        tree = self
+        while tree._parent_tree is not None:
+            tree = tree._parent_tree
+        return tree
+
+    def _get_observers(self) -> list:
+        """Returns the edit observers registered on the root of this tree.
+        """
+        observers = self._get_root()._observers
+        return observers if observers is not None else []
+
+    def _add_observer(self, observer) -> None:
+        """Registers <observer> on this tree, which should be a root.
+
+        An observer is told about every structural edit made below this tree
+        through its on_attach(tree, parent, index), on_detach(tree, parent,
+        index) and on_resize(tree, old_size) methods, and about the start and
+        end of each user-level edit through on_edit_begin() and on_edit_end().
+        It is also told when the subtrees of a tree are read into memory
+        (materialised or paged in) through on_load(tree), and just before they
+        are dropped from memory (paged out) through on_unload(tree), and when
+        trees are expanded or collapsed at or below a tree through
+        on_display(tree); these are not edits.
+        """
+        if self._observers is None:
+            self._observers = []
+        self._observers.append(observer)
+
+    def _remove_observer(self, observer) -> None:
+        """Unregisters <observer> from this tree.
+        """
+        if self._observers is not None and observer in self._observers:
+            self._observers.remove(observer)
+
+    @contextmanager
+    def _edit(self) -> Iterator[None]:
+        """Groups the structural changes made inside the with-block into one
+        user-level edit for the observers of this tree.
+        """
+        observers = list(self._get_observers())
+        for observer in observers:
+            observer.on_edit_begin()
+        try:
+            yield
+        finally:
+            for observer in observers:
+                observer.on_edit_end()
+
+    # **************************************************************************
+    # ************* SIZES BY EXTENSION *****************************************
+    # **************************************************************************
+    def get_extension_sizes(self) -> Dict[str, int]:
+        """Returns a dictionary mapping each extension (see get_extension) to
+        the total data_size of the leaves in this tree with that extension.
+
+        This is read from the totals kept by each folder, so it does not walk
+        the tree.
+        """
+        return dict(self._get_extension_sizes())
+
+    def get_extension_class_sizes(self) -> Dict[str, int]:
+        """Returns a dictionary mapping the name of each class in
+        EXTENSION_CLASSES to the total data_size of the leaves in this tree
+        whose extension is in that class.
+        """
+        sizes = {}
+        for extension, size in self._get_extension_sizes().items():
+            name = get_extension_class(extension)
+            sizes[name] = sizes.get(name, 0) + size
+        return sizes
+
+    # **************************************************************************
+    # ************* LARGEST FILES AND FOLDERS **********************************
+    # **************************************************************************
+    def largest_files(self, k: int) -> List[TMTree]:
+        """Returns the <k> largest leaves in this tree, largest first.
+
+        The search is best-first on the size of the largest leaf kept by every
+        subtree, so only the subtrees that can hold one of the <k> largest
+        leaves are visited.
+        """
+        result = []
+        heap = [(-self._max_leaf, 0, self)]
+        counter = 1
+        while heap and len(result) < k:
+            _, _, tree = heapq.heappop(heap)
+            if not tree._subtrees:
+                if not tree.is_empty():
+                    result.append(tree)
+                continue
+            for subtree in tree._subtrees:
+                heapq.heappush(heap, (-subtree._max_leaf, counter, subtree))
+                counter += 1
+        return result
+
+    def largest_folders(self, k: int) -> List[TMTree]:
+        """Returns the <k> largest folders below this tree, largest first.
+
+        A folder is never larger than the folder containing it, so the search
+        visits the folders in decreasing order of size and stops after <k>.
+        """
+        result = []
+        heap = []
+        counter = 0
+        tree = self
+        while True:
+            for subtree in tree._subtrees:
+                if subtree._subtrees:
+                    heapq.heappush(heap, (-subtree.data_size, counter, subtree))
+                    counter += 1
+            if not heap or len(result) == k:
+                return result
+            _, _, tree = heapq.heappop(heap)
+            result.append(tree)
 
     # **************************************************************************
     # ************* HELPER FUNCTION FOR TESTING PURPOSES  **********************
@@ -593,6 +1192,14 @@ class TMTree:
         """
         raise NotImplementedError
 
+    def get_extension(self) -> str:
+        """Returns the lower-case extension of this leaf's name, including the
+        dot (e.g. '.txt'), or '' if it has none or this tree is not a leaf.
+        """
+        if self.is_empty() or self._folder_count:
+            return ''
+        return os.path.splitext(self._name)[1].lower()
+
     # **************************************************************************
     # **************** HELPER FUNCTION FOR TASK 7  *****************************
     # **************************************************************************
@@ -602,6 +1209,176 @@ class TMTree:
         raise NotImplementedError
 
 
+def _contains(rect: Tuple[int, int, int, int], pos: Tuple[int, int]) -> bool:
+    """Returns whether <pos> is in <rect>, including its edges.
+    """
+    return rect[0] <= pos[0] <= rect[0] + rect[2] \
+        and rect[1] <= pos[1] <= rect[1] + rect[3]
+
+
+def _add_sizes(totals: Dict[str, int], sizes: Dict[str, int],
+               sign: int) -> None:
+    """Adds each value in <sizes> times <sign> to the value with the same key
+    in <totals>, removing the keys whose total drops to 0.
+    """
+    for key, size in sizes.items():
+        total = totals.get(key, 0) + sign * size
+        if total:
+            totals[key] = total
+        else:
+            totals.pop(key, None)
+
+
+# the z-score of the 95% confidence bounds of estimated sizes
+ESTIMATE_Z = 1.96
+
+
+class ScanOptions:
+    """The options controlling how a FileSystemTree scans the file system.
+
+    === Public Attributes ===
+    symlinks: What to do with symbolic links. 'skip' leaves them out,
+    'link' counts each link as a file of its own (small) size, and 'follow'
+    scans what they point to, never entering the same folder twice.
+    cross_mounts: Whether to scan folders on a different device (mount
+    point) than the scanned path. Folders that are not entered are shown as
+    empty.
+    allocated: Whether file sizes are the space allocated on disk
+    (st_blocks) rather than the apparent size (st_size).
+    dedupe_hard_links: Whether a file with several hard links is counted
+    once only, on the first path found. The other paths have size 0.
+    max_depth: How many levels of folders below the scanned path get a node
+    of their own, or None for no limit. The contents of the folders at this
+    depth are summed into a single summary leaf.
+    min_size: Files smaller than this are summed into a single summary leaf
+    per folder instead of getting a node of their own.
+    """
+    symlinks: str
+    cross_mounts: bool
+    allocated: bool
+    dedupe_hard_links: bool
+    max_depth: Optional[int]
+    min_size: int
+
+    def __init__(self, symlinks: str = 'link', cross_mounts: bool = True,
+                 allocated: bool = False, dedupe_hard_links: bool = True,
+                 max_depth: Optional[int] = None, min_size: int = 0) -> None:
+        """Initializes the scan options.
+
+        Precondition: <symlinks> is one of 'skip', 'link' or 'follow'.
+        """
+        self.symlinks = symlinks
+        self.cross_mounts = cross_mounts
+        self.allocated = allocated
+        self.dedupe_hard_links = dedupe_hard_links
+        self.max_depth = max_depth
+        self.min_size = min_size
+
+
+class _ScanState:
+    """The state shared by all of the nodes built during one scan.
+
+    === Public Attributes ===
+    options: The options of the scan.
+    root_device: The device of the scanned path.
+    seen_files: The (st_dev, st_ino) of the hard-linked files counted so far.
+    seen_folders: The (st_dev, st_ino) of the folders entered so far.
+    linked_files: If not None, the ((st_dev, st_ino), path) of every
+    hard-linked file given a node of its own and counted, in scan order.
+    """
+    options: ScanOptions
+    root_device: int
+    seen_files: set
+    seen_folders: set
+    linked_files: Optional[list]
+
+    def __init__(self, options: ScanOptions, root_device: int) -> None:
+        self.options = options
+        self.root_device = root_device
+        self.seen_files = set()
+        self.seen_folders = set()
+        self.linked_files = None
+
+    def stat_entry(self, entry: os.DirEntry) -> Optional[os.stat_result]:
+        """Returns the stat result to use for <entry>, or None if it should
+        be left out of the scan.
+        """
+        try:
+            if not entry.is_symlink():
+                return entry.stat(follow_symlinks=False)
+            elif self.options.symlinks == 'skip':
+                return None
+            elif self.options.symlinks == 'follow':
+                try:
+                    return entry.stat()
+                except OSError:  # a broken link
+                    pass
+            return entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+
+    def enter_folder(self, st: os.stat_result) -> bool:
+        """Returns whether the folder with stat result <st> should be scanned.
+        """
+        if not self.options.cross_mounts and st.st_dev != self.root_device:
+            return False
+        key = (st.st_dev, st.st_ino)
+        if st.st_ino and key in self.seen_folders:  # a symlink loop
+            return False
+        self.seen_folders.add(key)
+        return True
+
+    def file_size(self, st: os.stat_result) -> int:
+        """Returns the size to count for the file with stat result <st>.
+        """
+        if stat.S_ISDIR(st.st_mode):
+            return 0
+        if self.options.dedupe_hard_links and st.st_nlink > 1 and st.st_ino:
+            key = (st.st_dev, st.st_ino)
+            if key in self.seen_files:
+                return 0
+            self.seen_files.add(key)
+        return self.stored_size(st)
+
+    def stored_size(self, st: os.stat_result) -> int:
+        """Returns the size of the file with stat result <st>, without
+        counting it as seen for hard link deduplication.
+        """
+        if self.options.allocated and hasattr(st, 'st_blocks'):
+            return st.st_blocks * 512
+        return st.st_size
+
+    def record_link(self, st: os.stat_result, path: str, size: int) -> None:
+        """Records the file at <path> in linked_files if they are being
+        collected and it is a hard-linked file that was counted with <size>.
+        """
+        if self.linked_files is not None and size and st.st_nlink > 1:
+            self.linked_files.append(((st.st_dev, st.st_ino), path))
+
+    def measure(self, path: str) -> Tuple[int, int]:
+        """Returns the total size and the number of entries below the folder
+        at <path>, counted with the same rules as a scan but without building
+        any nodes.
+        """
+        size = count = 0
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        st = self.stat_entry(entry)
+                        if st is None:
+                            continue
+                        count += 1
+                        if not stat.S_ISDIR(st.st_mode):
+                            size += self.file_size(st)
+                        elif self.enter_folder(st):
+                            stack.append(entry.path)
+            except OSError:
+                pass
+        return size, count
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -611,49 +1388,153 @@ class FileSystemTree(TMTree):
     The _name attribute stores the *name* of the folder or file, not its full
     path. E.g., store 'assignments', not '/Users/Diane/csc148/assignments'
 
-    The data_size attribute for regular files is simply the size of the file,
-    as reported by os.path.getsize.
+    The data_size attribute for regular files is the size of the file as
+    reported by its stat result (see ScanOptions for which size is used, and
+    how hard links and symbolic links are counted).
 
     === Private Attributes ===
-    _path: the path that was used to instantiate this tree.
+    _path: the path that was used to instantiate this tree. For a summary
+    leaf, the path of the folder it is in.
+    _summary_count: the number of items this summary leaf stands for, or None
+    if this is not a summary leaf.
+    _mtime: the newest modification time of this file, or of this folder and
+    everything scanned inside it, or None if it is not known.
+    _size_variance: the variance of data_size, in bytes squared, if it was
+    estimated from a sample (see tm_scan.EstimatedScan). 0 if it is exact.
     """
     _path: str
+    _summary_count: Optional[int] = None
+    _mtime: Optional[float] = None
+    _size_variance: int = 0
 
-    def __init__(self, my_path: str) -> None:
+    def __init__(self, my_path: str,
+                 options: Optional[ScanOptions] = None) -> None:
         """Stores the directory given by <my_path> into a tree data structure
-        using the TMTree class.
+        using the TMTree class, scanning it with the given <options>.
 
         Precondition: <my_path> is a valid path for this computer.
         """
-        # 1. Initialize the single attribute: self._path
-        # 2. Implement the algorithm described in the handout.
-        #
-        # NOTES: - Review OS module documentation summary provided!
-        #        - Remember to make good use of the superclass constructor!
-        #        - Notice that the size of folders is calculated in the TMTree
-        #          initializer. Thus, set data_size = 0 for the folders
-        #
+        if options is None:
+            options = ScanOptions()
+        st = os.stat(my_path)
+        self._scan(my_path, st, _ScanState(options, st.st_dev))
+
+    def _scan(self, my_path: str, st: os.stat_result, state: _ScanState,
+              depth: int = 0) -> None:
+        """Initializes this tree from <my_path>, whose stat result is <st>,
+        at <depth> levels below the scanned path.
+
+        Each directory is listed once with os.scandir, and the stat results
+        it caches are reused for the entries, so no path is looked up twice.
+        """
         self._path = my_path
-        #
-        if not os.path.isdir(self._path):  # if path is a file (leaf)
+        name = os.path.basename(my_path)
+        if not stat.S_ISDIR(st.st_mode):
             # this is base case which returns a file or leaf of the
-            # FileSystemTree, which is then appended into <lst_subtrees> later.
-            super().__init__(os.path.basename(self._path), [],
-                             os.path.getsize(self._path))
-        else:  # if it is a folder or (Tree node)
-            lst = os.listdir(self._path)
-            lst_subtrees = []
-            for item in lst:
-                new_path = os.path.join(self._path, item)
-                # my bug was that I wasn't sure how to return the FileSystemTree
-                # object I created below and save it somewhere, because the
-                # initializer doesn;t return anything. So how do I save what I
-                # created in the recursive step? I simply append the
-                # instantiation code (FileSystemTree object) into our subtree
-                # list.
-                lst_subtrees.append(FileSystemTree(new_path))  # recursion
-            # now we instantiate the folder
-            super().__init__(os.path.basename(self._path), lst_subtrees, 0)
+            # FileSystemTree, which is then appended into the subtrees later.
+            size = state.file_size(st)
+            state.record_link(st, my_path, size)
+            super().__init__(name, [], size)
+            self._mtime = st.st_mtime
+            return
+        if not state.enter_folder(st):
+            # already scanned through another path (e.g. a symbolic link
+            # loop), or on another file system: shown as an empty folder
+            self._init_folder(name, [])
+            self._mtime = st.st_mtime
+            return
+
+        max_depth = state.options.max_depth
+        if max_depth is not None and depth >= max_depth:
+            size, count = state.measure(my_path)
+            lst_subtrees = [self._make_summary(my_path, count, size, 'deeper')] \
+                if count else []
+            self._init_folder(name, lst_subtrees)
+            return
+
+        lst_subtrees = []
+        small_count = small_size = 0
+        try:
+            with os.scandir(my_path) as entries:
+                for entry in entries:
+                    entry_st = state.stat_entry(entry)
+                    if entry_st is None:
+                        continue
+                    if stat.S_ISDIR(entry_st.st_mode):
+                        subtree = self.__class__.__new__(self.__class__)
+                        subtree._scan(entry.path, entry_st, state,
+                                      depth + 1)  # recursion
+                        lst_subtrees.append(subtree)
+                        continue
+                    size = state.file_size(entry_st)
+                    if size < state.options.min_size:
+                        small_count += 1
+                        small_size += size
+                    else:
+                        state.record_link(entry_st, entry.path, size)
+                        lst_subtrees.append(
+                            self._make_leaf(entry.path, entry.name, size,
+                                            entry_st.st_mtime))
+        except OSError:  # e.g. no permission to list the folder
+            pass
+        if small_count:
+            lst_subtrees.append(self._make_summary(my_path, small_count,
+                                                   small_size, 'smaller'))
+        # now we instantiate the folder
+        self._init_folder(name, lst_subtrees)
+        self._mtime = max([st.st_mtime] + [
+            subtree._mtime for subtree in lst_subtrees
+            if subtree._mtime is not None])
+
+    @classmethod
+    def _make_leaf(cls, path: str, name: str, size: int,
+                   mtime: Optional[float] = None) -> FileSystemTree:
+        """Returns a new leaf of this class for the file at <path>, modified
+        at <mtime>, without accessing the file system.
+        """
+        leaf = cls.__new__(cls)
+        leaf._path = path
+        TMTree.__init__(leaf, name, [], size)
+        if mtime is not None:
+            leaf._mtime = mtime
+        return leaf
+
+    @classmethod
+    def _make_folder(cls, path: str, name: str,
+                     subtrees: List[TMTree]) -> FileSystemTree:
+        """Returns a new folder of this class for the folder at <path>
+        holding <subtrees>, without accessing the file system.
+        """
+        folder = cls.__new__(cls)
+        folder._path = path
+        folder._init_folder(name, subtrees)
+        return folder
+
+    def _init_folder(self, name: str, subtrees: List[TMTree]) -> None:
+        """Initializes this tree as the folder <name> holding <subtrees>.
+        An empty folder is counted as a folder rather than as a file.
+        """
+        TMTree.__init__(self, name, subtrees, 0)
+        if not subtrees:
+            self._file_count = 0
+            self._folder_count = 1
+
+    @classmethod
+    def _make_summary(cls, folder: str, count: int, size: int,
+                      kind: str) -> FileSystemTree:
+        """Returns a summary leaf standing for <count> items of total <size>
+        in the folder at <folder> that were not given nodes of their own.
+        """
+        leaf = cls._make_leaf(folder, f'({count} {kind} items)', size)
+        leaf._summary_count = count
+        leaf._file_count = count
+        return leaf
+
+    def is_summary(self) -> bool:
+        """Returns whether this is a summary leaf standing for several items
+        that were not scanned individually (see ScanOptions).
+        """
+        return self._summary_count is not None
 
     def get_full_path(self) -> str:
         """Returns the file path for the tree object.
@@ -676,12 +1557,26 @@ class FileSystemTree(TMTree):
             return convert_size(data_size / 1024, suffixes[suffix])
 
         components = []
-        if len(self._subtrees) == 0:
+        if self.is_summary():
+            components.append(f'summary of {self._summary_count} items')
+        elif not self._folder_count:
             components.append('file')
         else:
             components.append('folder')
-            components.append(f'{len(self._subtrees)} items')
+            subtrees = self._subtree_list
+            tree = self
+            while subtrees is None and tree._subtree_source is not None:
+                tree = tree._subtree_source  # a pending copy-on-write clone
+                subtrees = tree._subtree_list
+            if subtrees is not None:  # unknown while paged out
+                components.append(f'{len(subtrees)} items')
+            components.append(f'{self._file_count} files')
+            components.append(f'{self._folder_count - 1} subfolders')
+            components.append(f'{self._height} levels')
         components.append(convert_size(self.data_size))
+        if self._size_variance:
+            components.append('estimated ± ' + convert_size(
+                ESTIMATE_Z * math.sqrt(self._size_variance)))
         return f' ({", ".join(components)})'
 
 
@@ -690,6 +1585,7 @@ if __name__ == '__main__':
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'math', 'os', '__future__', 'weakref',
+            'heapq', 'stat', 'contextlib', 'colorsys', 'zlib'
         ]
     })
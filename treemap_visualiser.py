@@ -19,15 +19,41 @@ It is responsible for initializing an instance of TMTree (using a
 concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
+
+pygame is only imported when a window is first opened, so importing this
+module (and the tree modules it uses) stays fast and works without a
+display. Likewise, the modules behind optional features (archives, growth,
+estimated scans, paging and sharing) are only imported when they are used.
 """
+from __future__ import annotations
 
-from os import getcwd
+import os
+import sys
 from sys import platform
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
+
+from tm_trees import TMTree, FileSystemTree, ScanOptions, extension_colour
+from tm_journal import EditJournal
+from tm_profile import PROFILER
+
+if TYPE_CHECKING:  # the other modules are imported when they are first used
+    from tm_diff import TreeDiff
+    from tm_paging import SubtreePager
+    from tm_scan import EstimatedScan
 
-import pygame
+PROFILE_PATH = 'treemap_profile.json'  # where "W" writes the profile
+DETAIL_THRESHOLD = 6  # the smallest folder, in pixels, that "O" expands
 
-from tm_trees import TMTree, FileSystemTree
+pygame = None  # the pygame module, once _load_pygame has imported it
+
+
+def _load_pygame() -> None:
+    """Imports pygame into this module's namespace, if it isn't already.
+    """
+    global pygame
+    if pygame is None:
+        import pygame as module
+        pygame = module
 
 
 class Visualiser:
@@ -41,6 +67,16 @@ class Visualiser:
     screen: Optional[pygame.Surface]
     hover_node: Optional[TMTree]
     selected_node: Optional[TMTree]
+    journal: Optional[EditJournal]
+    colour_by_extension: bool
+    show_profile: bool
+    baseline: Optional[TMTree]
+    growth: Optional[TreeDiff]
+    detail_threshold: Optional[int]
+    refinement: Optional[EstimatedScan]
+    node_budget: Optional[int]
+    pager: Optional[SubtreePager]
+    _font: Optional[pygame.font.Font]
 
     def __init__(self) -> None:
         # You may adjust the height and width as you'd like, depending on your screen resolution
@@ -53,30 +89,78 @@ class Visualiser:
         self.screen = None
         self.hover_node = None
         self.selected_node = None
+        self.journal = None
+        self.colour_by_extension = False
+        self.show_profile = False
+        self.baseline = None
+        self.growth = None
+        self.detail_threshold = None
+        self.refinement = None
+        self.node_budget = None
+        self.pager = None
+        self._font = None
 
     def run_visualisation(self, tree: TMTree) -> None:
         """Display an interactive graphical display of the given tree's treemap.
         """
 
         # Setup pygame
-        pygame.init()
-        self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
+        self.open_window()
         self.tree = tree
 
         # Render the initial display of the static treemap.
-        self.render_display()
         tree.update_rectangles((0, 0, self.width, self.height - self.font_height))
         tree.update_colours_and_depths()
+        self.render_display()
 
         # Start an event loop to respond to events.
         self.event_loop()
 
+    def open_window(self) -> None:
+        """Import and initialise pygame if needed, and open a window of this
+        visualiser's size (or resize the one that is open).
+        """
+        _load_pygame()
+        if not pygame.get_init():
+            pygame.init()
+        if self.screen is None or self.screen.get_size() != (self.width, self.height):
+            self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
+
+    def show_message(self, text: str) -> None:
+        """Open the window and show <text> in it, e.g. while a tree is being
+        scanned.
+        """
+        self.open_window()
+        pygame.draw.rect(self.screen, pygame.Color('black'),
+                         (0, 0, self.width, self.height))
+        text_surface = self._get_font().render(text, True, pygame.Color('white'))
+        self.screen.blit(text_surface, (8, self.height // 2))
+        pygame.display.flip()
+        pygame.event.pump()
+
+    def _get_font(self) -> pygame.font.Font:
+        """Return the font for the text display, loading it the first time.
+        """
+        if self._font is None:
+            self._font = pygame.font.SysFont('Consolas', self.font_height - 8)
+        return self._font
+
     def render_display(self) -> None:
         """Render a treemap and text display to the given screen.
 
         Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
         screen vertically into the treemap and text comments.
         """
+        with PROFILER.phase('render_display'):
+            self._draw_frame()
+        if self.show_profile:
+            self._render_profile()
+        # This must be called *after* all other pygame functions have run.
+        pygame.display.flip()
+
+    def _draw_frame(self) -> None:
+        """Draw the treemap and the text display, without showing them yet.
+        """
         # First, clear the screen
         pygame.draw.rect(self.screen, pygame.Color('black'),
                          (0, 0, self.width, self.height))
@@ -86,9 +170,21 @@ class Visualiser:
         except ValueError:
             return
 
-        for rect, colour in self.tree.get_rectangles():
+        colouring = extension_colour if self.colour_by_extension else None
+        if self.growth is not None:
+            colouring = self.growth.growth_colour
+        if self.detail_threshold is None:
+            rectangles = self.tree.get_rectangles(colouring)
+        else:
+            rectangles = self.tree.get_lod_rectangles(
+                (0, 0, self.width, self.height - self.font_height),
+                self.detail_threshold, colouring)
+        for rect, colour in rectangles:
             # Note that the arguments are in the opposite order
             pygame.draw.rect(subscreen, colour, rect)
+        if PROFILER.enabled:
+            PROFILER.count('draw_calls', len(rectangles) + 3)
+            PROFILER.count('frames')
 
         # add the hover rectangle
         if self.selected_node is not None:
@@ -98,15 +194,23 @@ class Visualiser:
 
         self._render_text()
 
-        # This must be called *after* all other pygame functions have run.
-        pygame.display.flip()
+    def _render_profile(self) -> None:
+        """Render the profiler's summary over the top-left of the treemap.
+        """
+        font = self._get_font()
+        lines = PROFILER.summary()
+        line_height = font.get_linesize()
+        background = pygame.Surface((self.width, line_height * len(lines)))
+        background.set_alpha(180)
+        self.screen.blit(background, (0, 0))
+        for i, line in enumerate(lines):
+            text_surface = font.render(line, True, pygame.Color('yellow'))
+            self.screen.blit(text_surface, (4, i * line_height))
 
     def _render_text(self) -> None:
         """Render text at the bottom of the display.
         """
-        # The font we want to use
-        font = pygame.font.SysFont('Consolas', self.font_height - 8)
-        text_surface = font.render(self._get_display_text(), True, pygame.Color('white'))
+        text_surface = self._get_font().render(self._get_display_text(), True, pygame.Color('white'))
 
         # Where to render the text_surface
         text_pos = (0, self.height - self.font_height + 4)
@@ -123,6 +227,9 @@ class Visualiser:
         selected_node = self.tree
 
         while True:
+            if self.refinement is not None:
+                self._apply_refinement()
+
             # Wait for an event
             event = pygame.event.poll()
             if event.type == pygame.QUIT:
@@ -135,7 +242,7 @@ class Visualiser:
                 return
 
             # get the hover position and the corresponding node
-            hover_node = self.tree.get_tree_at_position(pygame.mouse.get_pos())
+            hover_node = self._get_tree_at(pygame.mouse.get_pos())
 
             if event.type == pygame.MOUSEBUTTONUP:
                 selected_node = \
@@ -172,6 +279,21 @@ class Visualiser:
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
                     selected_node = hover_node
 
+                elif k in (pygame.K_e, pygame.K_a) and selected_node.is_summary():
+                    print(f'{selected_node.get_path_string()} summarises items that '
+                          f'were not scanned; rescan with a larger limit to see them')
+
+                elif k == pygame.K_e and _is_archive_leaf(selected_node):
+                    from tm_archive import open_archive_leaf
+                    archive = open_archive_leaf(selected_node)
+                    if archive is None:
+                        print(f'{selected_node.get_path_string()} could not be '
+                              f'read as an archive')
+                    else:
+                        self.tree.update_rectangles((0, 0, self.width, drawable_height))
+                        archive.expand()
+                        selected_node = None
+
                 elif k == pygame.K_e:
                     selected_node.expand()
                     selected_node = None
@@ -196,10 +318,52 @@ class Visualiser:
                     selected_node.collapse_all()
                     selected_node = self.tree
 
+                elif k == pygame.K_l:
+                    print_largest(selected_node)
+
                 elif k == pygame.K_q and selected_node is not self.tree:
                     self.run_visualisation(selected_node)
                     return
 
+            if event.type == pygame.KEYUP and self.journal is not None \
+                    and event.key in (pygame.K_z, pygame.K_y):
+                if event.key == pygame.K_z:
+                    changed = self.journal.undo()
+                else:
+                    changed = self.journal.redo()
+                if changed:
+                    self.tree.update_rectangles(
+                        (0, 0, self.width, self.height - self.font_height))
+                    selected_node = None
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_t:
+                self.colour_by_extension = not self.colour_by_extension
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_g \
+                    and self.baseline is not None:
+                if self.growth is not None:
+                    self.growth.close()
+                    self.growth = None
+                else:
+                    self.growth = self._diff_from_baseline()
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_o:
+                self.detail_threshold = DETAIL_THRESHOLD \
+                    if self.detail_threshold is None else None
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_p:
+                self.show_profile = not self.show_profile
+                if self.show_profile:
+                    PROFILER.reset()
+                    PROFILER.enable()
+                else:
+                    PROFILER.disable()
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_w \
+                    and PROFILER.enabled:
+                PROFILER.dump(PROFILE_PATH, {'window': [self.width, self.height]})
+                print(f'Profile written to {os.path.abspath(PROFILE_PATH)}')
+
             if event.type == pygame.KEYUP and event.key == pygame.K_b:
                 if self.tree.get_parent():
                     self.tree.get_parent().collapse_all()
@@ -208,10 +372,62 @@ class Visualiser:
 
             self.selected_node = selected_node
             self.hover_node = hover_node
+            if self.pager is not None:
+                self.pager.touch(selected_node)
+                self.pager.touch(hover_node)
+                self.pager.enforce()
 
             # Update display
             self.render_display()
 
+    def _apply_refinement(self) -> None:
+        """Add the exact sizes refined since the last call to the tree.
+
+        Undo and the growth baseline only start once the sizes are exact,
+        so that the refinement itself is never undone or shown as growth.
+        """
+        scan = self.refinement
+        if scan.apply() and self.growth is not None:
+            # the refined leaves are matched to the baseline by name
+            self.growth.close()
+            self.growth = self._diff_from_baseline()
+        if scan.done:
+            self.refinement = None
+            self.journal = EditJournal(scan.tree)
+            if self.baseline is None:
+                self.baseline = scan.tree._clone()
+            self._start_paging(scan.tree)
+
+    def _start_paging(self, root: TMTree) -> None:
+        """Keep the nodes of <root> in memory within the node budget, if there
+        is one, by paging out the subtrees that are not being looked at.
+        """
+        if self.node_budget is not None:
+            from tm_paging import SubtreePager
+            self.pager = SubtreePager(root, self.node_budget)
+
+    def _get_tree_at(self, pos: tuple[int, int]) -> Optional[TMTree]:
+        """Return the tree drawn at <pos>, at the current level of detail.
+        """
+        if self.detail_threshold is None:
+            return self.tree.get_tree_at_position(pos)
+        return self.tree.get_lod_tree_at_position(pos, self.detail_threshold)
+
+    def _diff_from_baseline(self) -> TreeDiff:
+        """Return the differences from the baseline to the whole tree, which
+        follow the edits made to it from then on.
+
+        The tree may have been edited since it was scanned, so modification
+        times cannot be trusted; hashes of the names and sizes are used
+        instead.
+        """
+        from tm_diff import diff_trees
+        root = self.tree
+        while root.get_parent() is not None:
+            root = root.get_parent()
+        return diff_trees(self.baseline, root, use_mtime=False, use_hashes=True,
+                          follow_edits=True)
+
     def _handle_click(self, button: int, pos: tuple[int, int],
                       old_selected_leaf: Optional[TMTree]) -> Optional[TMTree]:
         """Return the new selection after handling the mouse event.
@@ -222,7 +438,7 @@ class Visualiser:
 
         # left mouse click
         if button == 1:
-            selected_leaf = self.tree.get_tree_at_position(pos)
+            selected_leaf = self._get_tree_at(pos)
             if selected_leaf is None:
                 return old_selected_leaf
             elif selected_leaf is old_selected_leaf:
@@ -254,36 +470,140 @@ class Visualiser:
             return leaf_path + leaf.get_suffix()
 
 
-def run_treemap_file_system(path: str) -> None:
-    """Run a treemap visualisation for the given path's file structure.
+INSTRUCTIONS = '\n==== Instructions for use ====\n' \
+               'When a folder/file is selected, the following keys can be pressed:\n' \
+               '"E" to expand the folder, or to open a .zip or .tar file\n' \
+               '"A" to expand the folder and all folders inside\n' \
+               '"C" to collapse the parent folder\n' \
+               '"X" to collapse the entire display\n' \
+               '"Q" to visualize the selected folder/file\n' \
+               '"B" to go back to parent folder (if Q was pressed)\n' \
+               '"Up" and "Down" arrow keys to change the size of a file (in visualization)\n' \
+               '"M" to move a file (while selecting a file and hovering over a folder)\n' \
+               '"Del" to delete a file or folder from the visualization\n' \
+               '"D" to duplicate a file\n' \
+               '"V" to duplicate a copy and paste a file (while selecting a file and hovering over a folder)\n' \
+               '"Z" to undo the last edit, "Y" to redo it\n' \
+               '"L" to list the largest files and folders in the selection\n' \
+               '"T" to toggle colouring files by type (extension)\n' \
+               '"P" to toggle the profiling overlay, "W" to write the profile to a file\n' \
+               '"G" to toggle colouring by growth since the baseline\n' \
+               '"O" to toggle showing every folder large enough to see\n' \
+               '(Drag window to resize)'
+
+
+def print_largest(tree: TMTree, k: int = 10) -> None:
+    """Print the <k> largest files and folders in <tree> to the console.
+    """
+    print(f'\n==== Largest in {tree.get_path_string()} ====')
+    by_class = sorted(tree.get_extension_class_sizes().items(),
+                      key=lambda item: item[1], reverse=True)
+    print('By type: ' + ', '.join(f'{name} {size}B' for name, size in by_class))
+    for title, nodes in (('Files', tree.largest_files(k)),
+                         ('Folders', tree.largest_folders(k))):
+        print(title + ':')
+        for node in nodes:
+            print('  ' + node.get_path_string() + node.get_suffix())
+
+
+def _is_archive_leaf(tree: TMTree) -> bool:
+    """Return whether <tree> is a leaf that "E" opens as an archive.
+    """
+    if tree.get_parent() is None or tree._subtrees:
+        return False
+    from tm_archive import is_archive
+    return is_archive(tree.get_full_path())
+
+
+def run_treemap_file_system(path: str, options: Optional[ScanOptions] = None,
+                            baseline: Optional[str] = None,
+                            estimate: bool = False,
+                            node_budget: Optional[int] = None,
+                            share: Optional[str] = None) -> None:
+    """Run a treemap visualisation for the given path's file structure,
+    scanned with the given <options> (e.g. depth and size limits).
+
+    "G" colours the treemap by growth since the scan of the <baseline> path
+    (e.g. a snapshot of <path>), or since the start if <baseline> is None.
+    If <estimate> is True, the treemap is first drawn with estimated sizes
+    (see tm_scan.EstimatedScan), which are made exact in the background.
+    If <node_budget> is given, about that many nodes are kept in memory, and
+    the rest are paged out to disk (see tm_paging) until they are needed.
+    If <share> is given, the scanned tree is viewed from a node table in
+    shared memory with that name, which other processes can view too (see
+    run_treemap_shared), instead of being kept in this process.
     Precondition: <path> is a valid path to a file or folder.
     """
-    instructions = '\n==== Instructions for use ====\n' \
-                   'When a folder/file is selected, the following keys can be pressed:\n' \
-                   '"E" to expand the folder\n' \
-                   '"A" to expand the folder and all folders inside\n' \
-                   '"C" to collapse the parent folder\n' \
-                   '"X" to collapse the entire display\n' \
-                   '"Q" to visualize the selected folder/file\n' \
-                   '"B" to go back to parent folder (if Q was pressed)\n' \
-                   '"Up" and "Down" arrow keys to change the size of a file (in visualization)\n' \
-                   '"M" to move a file (while selecting a file and hovering over a folder)\n' \
-                   '"Del" to delete a file or folder from the visualization\n' \
-                   '"D" to duplicate a file\n' \
-                   '"V" to duplicate a copy and paste a file (while selecting a file and hovering over a folder)\n' \
-                   '(Drag window to resize)'
-
-    file_tree = FileSystemTree(path)
-    print(instructions)
-    visualizer.run_visualisation(file_tree)
-
+    visualizer = Visualiser()
+    visualizer.node_budget = node_budget
+    # open the window straight away, so there is feedback while scanning
+    visualizer.show_message(f'Scanning {path} ...')
+    if baseline is not None:
+        visualizer.baseline = FileSystemTree(baseline, options)
+    table = None
+    if share is not None:
+        from tm_shared import share_tree
+        table = share_tree(FileSystemTree(path, options), share)
+        file_tree = table.root()
+        visualizer.journal = EditJournal(file_tree)
+        if baseline is None:
+            visualizer.baseline = file_tree._clone()
+        print(f'Shared as {table.name}: view it with --attach={table.name}')
+    elif estimate:
+        from tm_scan import EstimatedScan
+        scan = EstimatedScan(path, options)
+        file_tree = scan.tree
+        visualizer.refinement = scan
+        scan.start()
+    else:
+        file_tree = FileSystemTree(path, options)
+        visualizer.journal = EditJournal(file_tree)
+        if baseline is None:
+            visualizer.baseline = file_tree._clone()
+        visualizer._start_paging(file_tree)
+    print(INSTRUCTIONS)
+    try:
+        visualizer.run_visualisation(file_tree)
+    finally:
+        if table is not None:
+            table.close()
+
+
+def run_treemap_shared(name: str) -> None:
+    """Run a treemap visualisation of the tree that another process shared
+    in the node table called <name> (see run_treemap_file_system). This
+    process keeps its own expansion state, layout and edits, but reads the
+    tree from the shared table.
+    """
+    from tm_shared import attach_tree
+    table = attach_tree(name)
+    try:
+        tree = table.root()
+        visualizer = Visualiser()
+        visualizer.journal = EditJournal(tree)
+        visualizer.baseline = tree._clone()
+        print(INSTRUCTIONS)
+        visualizer.run_visualisation(tree)
+    finally:
+        table.close()
 
 
-import os
 if __name__ == '__main__':
-    visualizer = Visualiser()
     PATH_TO_VISUALISE = os.path.join(os.getcwd(), 'example-directory', 'workshop')
     print(PATH_TO_VISUALISE)
     PATH_TO_VISUALISE = os.path.join('C:\\', 'Users', 'Raiyan Rizwan', 'Desktop', 'empty', 'Rent')
+    ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    VALUES = dict(arg[2:].split('=', 1) for arg in sys.argv[1:]
+                  if arg.startswith('--') and '=' in arg)
+    if ARGS:
+        PATH_TO_VISUALISE = ARGS[0]
+    if 'attach' in VALUES:
+        run_treemap_shared(VALUES['attach'])
+        sys.exit()
     print(PATH_TO_VISUALISE)
-    run_treemap_file_system(PATH_TO_VISUALISE)
+    run_treemap_file_system(PATH_TO_VISUALISE,
+                            baseline=ARGS[1] if len(ARGS) > 1 else None,
+                            estimate='--estimate' in sys.argv,
+                            node_budget=int(VALUES['node-budget'])
+                            if 'node-budget' in VALUES else None,
+                            share=VALUES.get('share'))